@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", 24 * 3600))
+# Cosine similarity above which a differently worded question counts as the
+# same one; 0 disables the embedding lookup and only exact matches are served.
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0))
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Lowercase, strip punctuation and collapse whitespace so trivially
+    different spellings of a question share a cache key.
+    """
+    text = _PUNCTUATION.sub(" ", (question or "").lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class _Entry:
+    __slots__ = ("category", "value", "vector", "created_at", "size")
+
+    def __init__(self, category, value, vector, size):
+        self.category = category
+        self.value = value
+        self.vector = vector
+        self.created_at = time.monotonic()
+        self.size = size
+
+
+class AnswerCache:
+    """
+    LRU + TTL cache of final answers and followups, bounded by entry count
+    and approximate memory.
+
+    Lookups match on the normalized question (and category).  When an
+    embeddings object and a similarity threshold are given, a miss falls back
+    to the most similar cached question of the same category.
+    """
+
+    def __init__(self, embeddings=None,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 max_bytes: int = ANSWER_CACHE_MAX_BYTES,
+                 ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+                 similarity_threshold: float = ANSWER_CACHE_SIMILARITY):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._recent_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.embeddings is not None and self.similarity_threshold > 0
+
+    @staticmethod
+    def _key(question: str, category: Optional[str]) -> str:
+        return f"{category or '*'}|{normalize_question(question)}"
+
+    def get(self, question: str, category: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        key = self._key(question, category)
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _copy(entry.value)
+            if not self.semantic_enabled or not self._entries:
+                self.misses += 1
+                return None
+
+        vector = self._embed(key, question)
+        with self._lock:
+            match = self._nearest(vector, category) if vector is not None else None
+            if match is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(match)
+            self.hits += 1
+            self.semantic_hits += 1
+            return _copy(self._entries[match].value)
+
+    def put(self, question: str, category: Optional[str], value: Dict[str, Any]) -> None:
+        key = self._key(question, category)
+        vector = self._embed(key, question) if self.semantic_enabled else None
+        size = len(key) + len(json.dumps(value)) + (vector.nbytes if vector is not None else 0)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = _Entry(category, _copy(value), vector, size)
+            self.total_bytes += size
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or self.total_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *_args) -> None:
+        """
+        Drop every cached answer, e.g. after the knowledge base changed.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._recent_vectors.clear()
+            self.total_bytes = 0
+            self.invalidations += 1
+        logger.info("Answer cache invalidated")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "semanticHits": self.semantic_hits,
+                "misses": self.misses,
+                "hitRatio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    # ---------------------------------------------------------------- helpers
+    def _live_entry(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry.created_at > self.ttl_seconds:
+            self._remove(key)
+            self.evictions += 1
+            return None
+        return entry
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def _nearest(self, vector: np.ndarray, category: Optional[str]) -> Optional[str]:
+        now = time.monotonic()
+        keys, vectors = [], []
+        for key, entry in self._entries.items():
+            if (entry.vector is not None and entry.category == category
+                    and now - entry.created_at <= self.ttl_seconds):
+                keys.append(key)
+                vectors.append(entry.vector)
+        if not keys:
+            return None
+        scores = np.stack(vectors) @ vector
+        best = int(np.argmax(scores))
+        return keys[best] if scores[best] >= self.similarity_threshold else None
+
+    def _embed(self, key: str, question: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._recent_vectors.get(key)
+        if vector is not None:
+            return vector
+        try:
+            vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        except Exception as err:
+            logger.warning("Answer cache could not embed question: %s", err)
+            return None
+        norm = float(np.linalg.norm(vector))
+        vector = vector / norm if norm else vector
+        with self._lock:
+            self._recent_vectors[key] = vector
+            while len(self._recent_vectors) > 256:
+                self._recent_vectors.popitem(last=False)
+        return vector
+
+
+def _copy(value: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: list(v) if isinstance(v, list) else v for k, v in value.items()}
@@ -0,0 +1,341 @@
+import os
+import json
+import base64
+import signal
+import asyncio
+import logging
+from urllib.parse import quote
+from quart import Quart, request, jsonify, Response
+from quart_cors import cors
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+from dotenv import load_dotenv
+import metrics
+from diabetes_rag_agent import NotReady, rag_agent
+from voice_chat_api import avoice_agent, astream_voice_agent, audio_cache
+from server import (
+    RETRY_AFTER_SECONDS, allowed_origins, format_sse, get_local_ips, is_ready, not_ready_body, unavailable_body,
+)
+from latency_control import BREAKER_COOLDOWN_SECONDS, UPSTREAMS, CircuitOpen
+from session_store import session_id_of
+from audio_transport import (
+    MAX_AUDIO_BYTES,
+    AudioPayloadTooLarge,
+    acounted,
+    aprimed,
+    aread_audio_request,
+    multipart_body,
+    transport_stats,
+    wants,
+)
+
+# Async serving mode: every route awaits the agent, Gemini and ElevenLabs
+# instead of blocking a thread, so one process can hold many in-flight requests.
+# Run with `python asgi_server.py` (or `hypercorn asgi_server:app`).
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PORT = int(os.getenv("PORT", 5000))
+# In-flight HTTP requests admitted at once; the rest get a 503
+MAX_INFLIGHT_REQUESTS = int(os.getenv("MAX_INFLIGHT_REQUESTS", 512))
+# Seconds in-flight requests get to finish after SIGTERM/SIGINT
+SHUTDOWN_GRACE_SECONDS = float(os.getenv("SHUTDOWN_GRACE_SECONDS", 30))
+
+app = Quart(__name__)
+# Whole-request cap; the legacy JSON integer-list audio encoding needs ~4x the audio size
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_REQUEST_BYTES", 5 * MAX_AUDIO_BYTES))
+app = cors(
+    app,
+    allow_origin=allowed_origins,
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_credentials=False,
+)
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def not_ready(e: NotReady):
+    return jsonify(not_ready_body(e)), 503, {'Retry-After': str(RETRY_AFTER_SECONDS)}
+
+
+def unavailable(e: CircuitOpen):
+    return jsonify(unavailable_body(e)), 503, {'Retry-After': str(int(BREAKER_COOLDOWN_SECONDS))}
+
+
+class InflightLimit:
+    """
+    ASGI middleware admitting at most ``limit`` concurrent HTTP requests,
+    counted until the (possibly streamed) response body is finished.
+    Health and readiness checks are always admitted.
+    """
+
+    def __init__(self, asgi_app, limit: int):
+        self.asgi_app = asgi_app
+        self.limit = limit
+        self.inflight = 0
+        self.rejected = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in ("/health", "/ready"):
+            return await self.asgi_app(scope, receive, send)
+        if self.inflight >= self.limit:
+            self.rejected += 1
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [(b"content-type", b"application/json"), (b"retry-after", b"1")],
+            })
+            await send({"type": "http.response.body", "body": b'{"error": "Server busy"}'})
+            return
+        self.inflight += 1
+        try:
+            await self.asgi_app(scope, receive, send)
+        finally:
+            self.inflight -= 1
+
+    def stats(self):
+        return {"inflight": self.inflight, "limit": self.limit, "rejected": self.rejected}
+
+
+inflight_limit = InflightLimit(app.asgi_app, MAX_INFLIGHT_REQUESTS)
+app.asgi_app = inflight_limit
+
+
+@app.route('/api/answerQuestion', methods=['POST'])
+async def answer_question():
+    data = await request.get_json()
+    question = data.get('question')
+    category = data.get('category')
+    conversation_history = data.get('conversationHistory')
+    session_id = session_id_of(request, data)
+    try:
+        result = await rag_agent.aanswer_question(
+            question=question,
+            category=category,
+            conversation_history=conversation_history,
+            session_id=session_id
+        )
+        return jsonify(result), 200
+    except NotReady as e:
+        return not_ready(e)
+    except Exception as e:
+        logger.exception(f"Error processing question: {e}")
+        return jsonify({'error': 'Failed to process the question.'}), 500
+
+
+@app.route('/api/answerQuestionStream', methods=['POST'])
+async def answer_question_stream():
+    data = await request.get_json()
+    question = data.get('question')
+    category = data.get('category')
+    conversation_history = data.get('conversationHistory')
+    session_id = session_id_of(request, data)
+
+    async def generate():
+        try:
+            async for event, payload in rag_agent.astream_answer(
+                question=question,
+                category=category,
+                conversation_history=conversation_history,
+                session_id=session_id
+            ):
+                yield format_sse(event, payload)
+        except NotReady as e:
+            yield format_sse('error', not_ready_body(e))
+        except Exception as e:
+            logger.exception(f"Error streaming answer: {e}")
+            yield format_sse('error', {'error': 'Failed to process the question.'})
+
+    response = Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+    response.timeout = None
+    return response
+
+
+@app.route('/api/answerQuestionWithAudio', methods=['POST'])
+async def answer_question_with_audio():
+    audio_bytes, category, conversation_history, session_id = await aread_audio_request(request)
+    try:
+        # Binary replies stream the MP3 (straight from the TTS cache on a hit)
+        stream_audio = wants(request, 'multipart/form-data') or wants(request, 'audio/mpeg')
+        raw_audio, followups, question_text, answer_text = await avoice_agent(
+            audio_bytes=audio_bytes,
+            category=category,
+            conversation_history=conversation_history,
+            session_id=session_id,
+            stream_audio=stream_audio
+        )
+        if stream_audio:
+            # Starts TTS here: once the 200 and the first part are sent, a failure can only truncate the body
+            raw_audio = await aprimed(raw_audio)
+        metadata = {
+            'followups': followups,
+            'question_text': question_text,
+            'answer_text': answer_text
+        }
+        if wants(request, 'multipart/form-data'):
+            parts, content_type, _ = multipart_body(metadata, raw_audio)
+            response = Response(acounted(parts, len(audio_bytes)), content_type=content_type)
+        elif wants(request, 'audio/mpeg'):
+            response = Response(acounted(raw_audio, len(audio_bytes)), mimetype='audio/mpeg', headers={
+                'X-Question-Text': quote(question_text),
+                'X-Answer-Text': quote(answer_text),
+                'X-Followups': quote(json.dumps(followups)),
+                'Access-Control-Expose-Headers': 'X-Question-Text, X-Answer-Text, X-Followups',
+            })
+        else:
+            audio_b64 = base64.b64encode(raw_audio).decode('utf-8')
+            transport_stats.record(len(audio_bytes), len(audio_b64))
+            return jsonify({'audio': audio_b64, **metadata}), 200
+        response.timeout = None
+        return response, 200
+    except NotReady as e:
+        return not_ready(e)
+    except CircuitOpen as e:
+        return unavailable(e)
+    except Exception as e:
+        logger.exception(f"Error processing audio question: {e}")
+        return jsonify({'error': 'Failed to process the audio question.'}), 500
+
+
+@app.route('/api/answerQuestionWithAudioStream', methods=['POST'])
+async def answer_question_with_audio_stream():
+    audio_bytes, category, conversation_history, session_id = await aread_audio_request(request)
+    transport_stats.record(len(audio_bytes))
+
+    async def generate():
+        try:
+            async for event, payload in astream_voice_agent(
+                audio_bytes=audio_bytes,
+                category=category,
+                conversation_history=conversation_history,
+                session_id=session_id
+            ):
+                if event == 'audio':
+                    # SSE is a text protocol, so each sentence's MP3 is sent base64 encoded
+                    payload = {**payload, 'audio': base64.b64encode(payload['audio']).decode('utf-8')}
+                yield format_sse(event, payload)
+        except NotReady as e:
+            yield format_sse('error', not_ready_body(e))
+        except CircuitOpen as e:
+            yield format_sse('error', unavailable_body(e))
+        except Exception as e:
+            logger.exception(f"Error streaming audio answer: {e}")
+            yield format_sse('error', {'error': 'Failed to process the audio question.'})
+
+    response = Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+    response.timeout = None
+    return response
+
+
+@app.route('/', methods=['GET'])
+async def home():
+    logger.info('GET / - Home route accessed')
+    return 'Hello from the backend!', 200
+
+
+@app.route('/health', methods=['GET'])
+async def health():
+    logger.info('GET /health - Health check accessed')
+    return jsonify({
+        'status': 'OK',
+        'timestamp': __import__('datetime').datetime.utcnow().isoformat() + 'Z',
+        'uptime': float(os.times()[4]),
+        'knowledgeBase': rag_agent.readiness(),
+        'answerCache': rag_agent.answer_cache.stats(),
+        'precomputedAnswers': rag_agent.precomputed.stats(),
+        'audioTransport': transport_stats.snapshot(),
+        'ttsCache': audio_cache.stats(),
+        'queryEmbeddings': rag_agent.embeddings.stats(),
+        'sessions': rag_agent.sessions.stats(),
+        'upstreams': {name: breaker.stats() for name, breaker in UPSTREAMS.items()},
+        'requests': inflight_limit.stats(),
+    }), 200
+
+
+@app.route('/ready', methods=['GET'])
+async def ready():
+    readiness = rag_agent.readiness()
+    return jsonify(readiness), 200 if is_ready(readiness, request.args.get('category')) else 503
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.errorhandler(404)
+async def not_found(e):
+    logger.warning(f'404 - Route not found: {request.method} {request.url}')
+    return jsonify({'error': 'Route not found'}), 404
+
+
+@app.errorhandler(400)
+async def bad_request(e):
+    logger.warning(f'400 - Bad request: {request.method} {request.url}: {e.description}')
+    return jsonify({'error': 'Bad request', 'message': e.description}), 400
+
+
+@app.errorhandler(413)
+@app.errorhandler(AudioPayloadTooLarge)
+async def payload_too_large(e):
+    transport_stats.record_rejected()
+    logger.warning(f'413 - Payload too large: {request.method} {request.url}')
+    return jsonify({'error': 'Audio payload too large', 'maxAudioBytes': MAX_AUDIO_BYTES}), 413
+
+
+@app.errorhandler(Exception)
+async def handle_exception(e):
+    logger.exception('Global error handler:')
+    return jsonify({
+        'error': 'Internal Server Error',
+        'message': str(e) if os.getenv('FLASK_ENV') == 'development' else None
+    }), 500
+
+
+@app.before_serving
+async def start_warmup():
+    # Loads in the background, so the port opens right away; see /ready
+    logger.info('Loading diabetes documents and vector stores in the background...')
+    rag_agent.start_warmup()
+
+
+@app.after_serving
+async def shutdown():
+    logger.info('Shutting down; in-flight requests have finished or timed out.')
+
+
+metrics.export_stats('diabe_http_rejected_total', 'Requests turned away with a 503 at the in-flight limit.',
+                     'reason', {'busy': inflight_limit.stats}, 'rejected', kind='counter')
+app.asgi_app = metrics.ASGIMetrics(app.asgi_app, {rule.rule for rule in app.url_map.iter_rules()})
+
+
+def hypercorn_config() -> Config:
+    config = Config()
+    config.bind = [f"0.0.0.0:{PORT}"]
+    config.graceful_timeout = SHUTDOWN_GRACE_SECONDS
+    # Streamed voice answers can stay open for a while
+    config.keep_alive_timeout = 75
+    return config
+
+
+async def main():
+    shutdown_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, shutdown_event.set)
+    local_ips = get_local_ips()
+    logger.info('\nAsync server is running on:')
+    logger.info(f'• Local:            http://localhost:{PORT}')
+    for ip in local_ips:
+        logger.info(f'• Network:          http://{ip}:{PORT}')
+    logger.info(f'\nAdmitting up to {MAX_INFLIGHT_REQUESTS} concurrent requests; '
+                f'{SHUTDOWN_GRACE_SECONDS:g}s grace period on shutdown')
+    logger.info('\nPress CTRL+C to stop the server')
+    await serve(app, hypercorn_config(), shutdown_trigger=shutdown_event.wait)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
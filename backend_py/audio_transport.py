@@ -0,0 +1,291 @@
+import os
+import json
+import logging
+import itertools
+import threading
+from io import BytesIO
+from typing import Optional, List, Dict, Any, AsyncIterable, AsyncIterator, Iterable, Iterator, Tuple, Union
+from uuid import uuid4
+
+from werkzeug.exceptions import BadRequest
+
+from session_store import session_id_of
+
+logger = logging.getLogger(__name__)
+
+# Largest recording accepted by the voice endpoints, in bytes of audio
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_BYTES", 10 * 1024 * 1024))
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class AudioPayloadTooLarge(Exception):
+    """Raised when an uploaded recording exceeds MAX_AUDIO_BYTES."""
+
+
+class TransportStats:
+    """
+    Process-wide byte counters for the voice endpoints.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.rejected = 0
+
+    def record(self, bytes_in: int = 0, bytes_out: int = 0) -> None:
+        with self._lock:
+            self.requests += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def record_rejected(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "bytesIn": self.bytes_in,
+                "bytesOut": self.bytes_out,
+                "rejected": self.rejected,
+            }
+
+
+transport_stats = TransportStats()
+
+
+def read_limited(stream, limit: Optional[int] = None) -> bytes:
+    """
+    Read a binary stream into one buffer, failing as soon as it passes
+    ``limit`` (MAX_AUDIO_BYTES by default).
+    """
+    limit = MAX_AUDIO_BYTES if limit is None else limit
+    buffer = BytesIO()
+    while True:
+        chunk = stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        buffer.write(chunk)
+        if buffer.tell() > limit:
+            raise AudioPayloadTooLarge(f"Audio payload exceeds {limit} bytes")
+    return buffer.getvalue()
+
+
+def _parse_history(value) -> Optional[List[Dict[str, str]]]:
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise BadRequest("'conversationHistory' is not valid JSON")
+    if not isinstance(value, list):
+        raise BadRequest("'conversationHistory' must be a list of messages")
+    return value
+
+
+def _legacy_audio(audio_bytes) -> bytes:
+    """
+    The ``audioBytes`` list of the legacy JSON body as bytes.
+    """
+    if not isinstance(audio_bytes, list):
+        raise BadRequest("'audioBytes' must be a list of integers")
+    if len(audio_bytes) > MAX_AUDIO_BYTES:
+        raise AudioPayloadTooLarge(f"Audio payload exceeds {MAX_AUDIO_BYTES} bytes")
+    try:
+        return bytes(audio_bytes)
+    except (TypeError, ValueError):
+        raise BadRequest("'audioBytes' must be a list of integers from 0 to 255")
+
+
+def read_audio_request(request) -> Tuple[bytes, Optional[str], Optional[List[Dict[str, str]]], Optional[str]]:
+    """
+    Extract ``(audio_bytes, category, conversation_history, session_id)``
+    from a Flask request in any of the supported encodings:
+
+    - ``multipart/form-data`` with an ``audio`` file part and optional
+      ``category`` / ``conversationHistory`` (JSON) / ``sessionId`` fields,
+    - a raw ``audio/*`` or ``application/octet-stream`` body, with
+      ``category`` as a query parameter,
+    - the legacy JSON body with ``audioBytes`` as a list of integers.
+    """
+    mimetype = request.mimetype or ""
+    if mimetype == "multipart/form-data":
+        upload = request.files.get("audio")
+        if upload is None:
+            raise BadRequest("Missing 'audio' file part")
+        audio = read_limited(upload.stream)
+        category = request.form.get("category") or None
+        history = _parse_history(request.form.get("conversationHistory"))
+        fields = request.form
+    elif mimetype.startswith("audio/") or mimetype == "application/octet-stream":
+        audio = read_limited(request.stream)
+        category = request.args.get("category") or None
+        history = None
+        fields = None
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            raise BadRequest("Expected a multipart upload, an audio body or a JSON object")
+        audio = _legacy_audio(data.get("audioBytes") or [])
+        category = data.get("category")
+        history = _parse_history(data.get("conversationHistory"))
+        fields = data
+    logger.info("Received %d audio bytes (%s)", len(audio), mimetype or "unknown")
+    return audio, category, history, session_id_of(request, fields)
+
+
+async def aread_limited(body, limit: Optional[int] = None) -> bytes:
+    """
+    Async ``read_limited`` over a request body's chunk iterator.
+    """
+    limit = MAX_AUDIO_BYTES if limit is None else limit
+    buffer = BytesIO()
+    async for chunk in body:
+        buffer.write(chunk)
+        if buffer.tell() > limit:
+            raise AudioPayloadTooLarge(f"Audio payload exceeds {limit} bytes")
+    return buffer.getvalue()
+
+
+async def aread_audio_request(request) -> Tuple[bytes, Optional[str], Optional[List[Dict[str, str]]], Optional[str]]:
+    """
+    ``read_audio_request`` for a Quart request, whose body, form and JSON
+    are awaited instead of read on the handler's thread.
+    """
+    mimetype = request.mimetype or ""
+    if mimetype == "multipart/form-data":
+        files = await request.files
+        upload = files.get("audio")
+        if upload is None:
+            raise BadRequest("Missing 'audio' file part")
+        # Uploads are already spooled by the form parser
+        audio = read_limited(upload.stream)
+        form = await request.form
+        category = form.get("category") or None
+        history = _parse_history(form.get("conversationHistory"))
+        fields = form
+    elif mimetype.startswith("audio/") or mimetype == "application/octet-stream":
+        audio = await aread_limited(request.body)
+        category = request.args.get("category") or None
+        history = None
+        fields = None
+    else:
+        data = await request.get_json(silent=True)
+        if not isinstance(data, dict):
+            raise BadRequest("Expected a multipart upload, an audio body or a JSON object")
+        audio = _legacy_audio(data.get("audioBytes") or [])
+        category = data.get("category")
+        history = _parse_history(data.get("conversationHistory"))
+        fields = data
+    logger.info("Received %d audio bytes (%s)", len(audio), mimetype or "unknown")
+    return audio, category, history, session_id_of(request, fields)
+
+
+def wants(request, mimetype: str) -> bool:
+    """
+    True if the client's Accept header prefers ``mimetype`` over JSON.
+    """
+    best = request.accept_mimetypes.best_match([mimetype, "application/json"])
+    return best == mimetype and request.accept_mimetypes[mimetype] > 0
+
+
+def multipart_body(metadata: Dict[str, Any], audio: Union[bytes, Iterable[bytes], AsyncIterable[bytes]],
+                   filename: str = "answer.mp3",
+                   audio_type: str = "audio/mpeg") -> Tuple[Union[Iterator[bytes], AsyncIterator[bytes]], str, Optional[int]]:
+    """
+    Build a ``multipart/form-data`` response with a JSON ``metadata`` part and
+    a binary ``audio`` part, without copying the audio into a new buffer.
+    ``audio`` may be bytes or a (sync or async) iterator of chunks, then
+    streamed as is.
+
+    Returns ``(parts, content_type, content_length)``; the length is None
+    for streamed audio.
+    """
+    boundary = uuid4().hex
+    head = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="metadata"\r\n'
+        "Content-Type: application/json\r\n\r\n"
+        f"{json.dumps(metadata)}\r\n"
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="audio"; filename="{filename}"\r\n'
+        f"Content-Type: {audio_type}\r\n\r\n"
+    ).encode("utf-8")
+    tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+    content_type = f"multipart/form-data; boundary={boundary}"
+    if isinstance(audio, (bytes, bytearray)):
+        return iter((head, audio, tail)), content_type, len(head) + len(audio) + len(tail)
+    if hasattr(audio, "__aiter__"):
+        return _achain(head, audio, tail), content_type, None
+    return itertools.chain((head,), audio, (tail,)), content_type, None
+
+
+def counted(chunks: Iterable[bytes], bytes_in: int = 0) -> Iterator[bytes]:
+    """
+    Pass a streamed response body through, recording its size once sent.
+    """
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        transport_stats.record(bytes_in, sent)
+
+
+async def acounted(chunks: AsyncIterable[bytes], bytes_in: int = 0) -> AsyncIterator[bytes]:
+    """
+    Async ``counted`` for response bodies streamed from the event loop.
+    """
+    sent = 0
+    try:
+        async for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        transport_stats.record(bytes_in, sent)
+
+
+async def _achain(head: bytes, audio: AsyncIterable[bytes], tail: bytes) -> AsyncIterator[bytes]:
+    yield head
+    async for chunk in audio:
+        yield chunk
+    yield tail
+
+
+def primed(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Pull the first chunk of a lazy audio stream now and chain it back in
+    front, so that errors opening the stream (an open circuit, a vendor
+    failure) are raised while the route can still choose the status code.
+    """
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    return chunks if first is None else itertools.chain((first,), chunks)
+
+
+async def aprimed(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """
+    Async ``primed``.
+    """
+    chunks = chunks.__aiter__()
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        return _aempty()
+    return _afollowed(first, chunks)
+
+
+async def _aempty() -> AsyncIterator[bytes]:
+    return
+    yield
+
+
+async def _afollowed(first: bytes, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    yield first
+    async for chunk in chunks:
+        yield chunk
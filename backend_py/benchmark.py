@@ -0,0 +1,440 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import platform
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, Callable
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Offline benchmark of the RAG and voice pipelines against the local stand-ins
+# in fake_providers.py and the fixture corpus in benchmark_data/.
+#
+#   python benchmark.py --profile realistic --requests 40 --concurrency 1,8,32 --output bench.json
+#
+# Results are one JSON document (stdout unless --output is given); all
+# latencies are in milliseconds.
+
+BENCHMARK_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_data")
+RESULT_SCHEMA_VERSION = 1
+
+# The Gemini and ElevenLabs clients are only built on first use, and the
+# benchmark swaps in fakes before that, so no API keys are needed.  Set only
+# to keep langchain_community's web loader from warning on import.
+os.environ.setdefault("USER_AGENT", "diabe-ai-buddy-benchmark")
+
+import server  # noqa: E402
+import metrics  # noqa: E402
+import voice_chat_api  # noqa: E402
+from diabetes_rag_agent import (  # noqa: E402
+    CATEGORIES, GENERATION_MODE, GENERATION_MODES, RETRIEVAL_MODE, RETRIEVAL_MODES, VECTOR_BACKEND,
+    VECTOR_BACKENDS, DiabetesRagAgent,
+    format_documents_as_string,
+)
+from context_packer import CONTEXT_TOKENS, VOICE_CONTEXT_TOKENS, pack_context  # noqa: E402
+from session_store import estimate_tokens  # noqa: E402
+from fake_providers import PROFILES, fake_recording, make_providers  # noqa: E402
+from tts_cache import AudioCache  # noqa: E402
+from precomputed_answers import precompute_answers  # noqa: E402
+from latency_control import GEMINI_HEDGE_AFTER_SECONDS, UPSTREAMS  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def fixture_sources(data_dir: str = BENCHMARK_DATA_DIR) -> Dict[str, List[str]]:
+    """
+    One local markdown file per category, in place of DOCUMENT_SOURCES.
+    """
+    return {category: [os.path.join(data_dir, f"{category}.md")] for category in CATEGORIES}
+
+
+def load_questions(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_retrieval_eval(path: str) -> List[Dict[str, str]]:
+    """
+    Labelled retrieval queries: ``question``, ``category`` and an
+    ``expected`` phrase the right chunk contains.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(samples_ms: List[float]) -> Dict[str, Any]:
+    if not samples_ms:
+        return {"count": 0}
+    values = np.asarray(samples_ms, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(values),
+        "meanMs": round(float(values.mean()), 2),
+        "p50Ms": round(float(p50), 2),
+        "p95Ms": round(float(p95), 2),
+        "p99Ms": round(float(p99), 2),
+        "maxMs": round(float(values.max()), 2),
+    }
+
+
+class NodeTimer(BaseCallbackHandler):
+    """
+    Callback handler recording the wall time of every LangGraph node run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started: Dict[Any, tuple] = {}
+        self.samples: Dict[str, List[float]] = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node is None or node.startswith("__") or kwargs.get("name") != node:
+            return
+        with self._lock:
+            # A node's own RunnableLambda reports under the same name as the node
+            if parent_run_id in self._started and self._started[parent_run_id][0] == node:
+                return
+            self._started[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def _finish(self, run_id) -> None:
+        with self._lock:
+            started = self._started.pop(run_id, None)
+            if started is not None:
+                node, at = started
+                self.samples.setdefault(node, []).append((time.perf_counter() - at) * 1000)
+
+
+class Benchmark:
+    """
+    Builds an agent on fake providers in a scratch directory, wires it into
+    the Flask app and voice pipeline, and runs the measurements.
+    """
+
+    def __init__(self, profile_name: str, questions: List[str], workdir: str,
+                 answer_cache: bool = False, tts_cache: bool = False, precomputed: bool = False,
+                 retrieval_eval: Optional[List[Dict[str, str]]] = None,
+                 vector_backend: str = VECTOR_BACKEND,
+                 hedge_after: float = GEMINI_HEDGE_AFTER_SECONDS,
+                 generation_mode: str = GENERATION_MODE):
+        self.profile_name = profile_name
+        self.profile = PROFILES[profile_name]
+        self.questions = questions
+        self.workdir = workdir
+        self.answer_cache = answer_cache
+        self.tts_cache = tts_cache
+        self.precomputed = precomputed
+        self.retrieval_eval = retrieval_eval or []
+        self.vector_backend = vector_backend
+        self.hedge_after = hedge_after
+        self.generation_mode = generation_mode
+        self.providers = make_providers(self.profile)
+        self.agent: Optional[DiabetesRagAgent] = None
+
+    def _new_agent(self, vector_backend: str = "chroma") -> DiabetesRagAgent:
+        return DiabetesRagAgent(
+            model=self.providers["model"],
+            embeddings=self.providers["embeddings"],
+            document_sources=fixture_sources(),
+            persist_dir=os.path.join(self.workdir, "kb_store"),
+            nutrition_path=os.path.join(BENCHMARK_DATA_DIR, "nutrition.csv"),
+            vector_backend=vector_backend,
+            precomputed_path=os.path.join(self.workdir, "precomputed_answers.jsonl"),
+        )
+
+    def measure_ingest(self) -> Dict[str, Any]:
+        """
+        Cold ingest into an empty store, then a warm restart on the same store;
+        then the same store exported to vector snapshots, and a restart that
+        maps them.  The agent of the configured backend is kept.  Last, a
+        restart warmed in the background as the servers do it, with the load
+        time of each category.
+        """
+        embeddings = self.providers["embeddings"]
+        results = {}
+        phases = (("cold", "chroma"), ("warm", "chroma"), ("snapshotExport", "snapshot"), ("snapshotWarm", "snapshot"))
+        for phase, backend in phases:
+            agent = self._new_agent(backend)
+            calls, texts = embeddings.calls, embeddings.texts
+            started = time.perf_counter()
+            agent.preload_documents()
+            results[phase] = {
+                "ms": round((time.perf_counter() - started) * 1000, 2),
+                "embedCalls": embeddings.calls - calls,
+                "embeddedTexts": embeddings.texts - texts,
+            }
+            if backend == self.vector_backend:
+                self.agent = agent
+        results["chunks"] = sum(len(store.get(include=[])["ids"]) for store in self.agent.vector_stores.values())
+        agent = self._new_agent(self.vector_backend)
+        started = time.perf_counter()
+        agent.start_warmup()
+        agent._warmup.join()
+        results["warmup"] = {
+            "ms": round((time.perf_counter() - started) * 1000, 2),
+            "categoryMs": {category: round(state["seconds"] * 1000, 2)
+                           for category, state in agent.readiness()["categories"].items()},
+        }
+        return results
+
+    def install(self) -> None:
+        """
+        Point the Flask routes and the voice pipeline at the benchmark agent,
+        the fake ElevenLabs clients and a scratch TTS cache.
+        """
+        if not self.answer_cache:
+            self.agent.answer_cache.max_entries = 0
+        self.agent.hedge_after = self.hedge_after
+        self.agent.generation_mode = self.generation_mode
+        audio_cache = AudioCache(os.path.join(self.workdir, "tts_cache"),
+                                 max_bytes=256 * 1024 * 1024 if self.tts_cache else 0)
+        server.rag_agent = voice_chat_api.rag_agent = self.agent
+        server.audio_cache = voice_chat_api.audio_cache = audio_cache
+        voice_chat_api.client = self.providers["elevenlabs"]
+        voice_chat_api.aclient = self.providers["aelevenlabs"]
+
+    def measure_nodes(self) -> Dict[str, Any]:
+        timer = NodeTimer()
+        for question in self.questions:
+            self.agent.executor.invoke(self.agent._new_state(question, None, None),
+                                       config={"callbacks": [timer]})
+        return {node: summarize(samples) for node, samples in timer.samples.items()}
+
+    def measure_retrieval(self) -> Dict[str, Any]:
+        """
+        Hit rate and MRR of the labelled queries in every retrieval mode,
+        with the latency of a retrieval including its embedding call, and
+        how much of the retrieved text (and of the hits) survives packing
+        into the text and voice context budgets.
+        """
+        results = {}
+        for mode in RETRIEVAL_MODES:
+            latencies, reciprocal_ranks, retrieved_tokens = [], [], []
+            packed = {name: {"tokens": [], "hits": 0} for name in ("text", "voice")}
+            for query in self.retrieval_eval:
+                started = time.perf_counter()
+                docs = self.agent.retrieve(query["question"], query["category"], mode=mode)
+                latencies.append((time.perf_counter() - started) * 1000)
+                expected = query["expected"].lower()
+                rank = next((i for i, doc in enumerate(docs, start=1) if expected in doc.page_content.lower()), None)
+                reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+                retrieved_tokens.append(estimate_tokens(format_documents_as_string(docs)))
+                for name, budget in (("text", CONTEXT_TOKENS), ("voice", VOICE_CONTEXT_TOKENS)):
+                    context = pack_context(docs, budget)
+                    packed[name]["tokens"].append(estimate_tokens(context))
+                    packed[name]["hits"] += expected in context.lower()
+            queries = len(reciprocal_ranks)
+            results[mode] = {
+                "hitRate": round(sum(1 for rr in reciprocal_ranks if rr) / queries, 3) if queries else None,
+                "mrr": round(sum(reciprocal_ranks) / queries, 3) if queries else None,
+                "latency": summarize(latencies),
+                "contextTokens": {
+                    "retrieved": round(float(np.mean(retrieved_tokens)), 1) if queries else None,
+                    **{name: round(float(np.mean(p["tokens"])), 1) if queries else None for name, p in packed.items()},
+                },
+                "packedHitRate": {name: round(p["hits"] / queries, 3) if queries else None
+                                  for name, p in packed.items()},
+            }
+        return results
+
+    def measure_generation(self, requests: int) -> Dict[str, Any]:
+        """
+        ``/api/answerQuestion`` one request at a time in each generation
+        mode, with the chat calls and prompt/completion tokens per request
+        and how the single structured calls turned out.
+        """
+        model = self.providers["model"]
+        results = {}
+        for mode in GENERATION_MODES:
+            self.agent.generation_mode = mode
+            calls = model.calls
+            tokens = metrics.LLM_TOKENS.snapshot()
+            outcomes = metrics.STRUCTURED_ANSWERS.snapshot()
+            load = self.run_load("/api/answerQuestion", self._text_request, requests, 1)
+            used = {kind: sum(count - tokens.get(key, 0)
+                              for key, count in metrics.LLM_TOKENS.snapshot().items() if key[1] == kind)
+                    for kind in ("input", "output")}
+            results[mode] = {
+                "errors": load["errors"],
+                "latency": load["latency"],
+                "llmCallsPerRequest": round((model.calls - calls) / requests, 2) if requests else None,
+                "inputTokensPerRequest": round(used["input"] / requests, 1) if requests else None,
+                "outputTokensPerRequest": round(used["output"] / requests, 1) if requests else None,
+                "structuredAnswers": {outcome: int(count - outcomes.get((outcome,), 0))
+                                      for (outcome,), count in sorted(metrics.STRUCTURED_ANSWERS.snapshot().items())
+                                      if count - outcomes.get((outcome,), 0)},
+            }
+        self.agent.generation_mode = self.generation_mode
+        return results
+
+    def _text_request(self, client, question: str) -> int:
+        return client.post("/api/answerQuestion", json={"question": question}).status_code
+
+    def _audio_request(self, client, question: str) -> int:
+        response = client.post("/api/answerQuestionWithAudio", data=fake_recording(question),
+                               content_type="audio/webm", headers={"Accept": "audio/mpeg"})
+        response.get_data()
+        return response.status_code
+
+    def run_load(self, name: str, request: Callable, total: int, concurrency: int) -> Dict[str, Any]:
+        """
+        ``total`` requests over ``concurrency`` threads, one Flask test client each.
+        """
+        local = threading.local()
+        latencies: List[float] = []
+        errors = 0
+        lock = threading.Lock()
+
+        def one(i: int) -> None:
+            nonlocal errors
+            if not hasattr(local, "client"):
+                local.client = server.app.test_client()
+            started = time.perf_counter()
+            try:
+                ok = request(local.client, self.questions[i % len(self.questions)]) == 200
+            except Exception as err:
+                logger.warning("%s request failed: %s", name, err)
+                ok = False
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                errors += 0 if ok else 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as pool:
+            list(pool.map(one, range(total)))
+        seconds = time.perf_counter() - started
+        return {
+            "endpoint": name,
+            "concurrency": concurrency,
+            "requests": total,
+            "errors": errors,
+            "seconds": round(seconds, 3),
+            "throughputRps": round(total / seconds, 2) if seconds else None,
+            "latency": summarize(latencies),
+        }
+
+    def run(self, requests: int, concurrency_levels: List[int]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result: Dict[str, Any] = {
+            "schemaVersion": RESULT_SCHEMA_VERSION,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                            "cpus": os.cpu_count()},
+            "config": {
+                "profile": self.profile_name,
+                "latency": vars(self.profile),
+                "questions": len(self.questions),
+                "requests": requests,
+                "concurrency": concurrency_levels,
+                "answerCache": self.answer_cache,
+                "ttsCache": self.tts_cache,
+                "precomputed": self.precomputed,
+                "retrievalMode": RETRIEVAL_MODE,
+                "vectorBackend": self.vector_backend,
+                "retrievalQueries": len(self.retrieval_eval),
+                "hedgeAfterSeconds": self.hedge_after,
+                "generationMode": self.generation_mode,
+            },
+        }
+        logger.info("Measuring ingest...")
+        result["ingest"] = self.measure_ingest()
+        logger.info("Measuring retrieval quality per mode...")
+        result["retrieval"] = self.measure_retrieval()
+        self.install()
+        if self.precomputed:
+            logger.info("Precomputing answers for the benchmark questions...")
+            result["precompute"] = precompute_answers(self.agent, self.questions, rate_per_minute=0,
+                                                      voice=True, tts=self.tts_cache)
+        logger.info("Measuring per-node latency...")
+        result["nodes"] = self.measure_nodes()
+        logger.info("Comparing generation modes...")
+        result["generation"] = self.measure_generation(requests)
+        endpoints = {
+            "/api/answerQuestion": self._text_request,
+            "/api/answerQuestionWithAudio": self._audio_request,
+        }
+        logger.info("Measuring end-to-end latency...")
+        result["endpoints"] = {
+            name: self.run_load(name, request, requests, 1)["latency"]
+            for name, request in endpoints.items()
+        }
+        result["load"] = []
+        for concurrency in concurrency_levels:
+            for name, request in endpoints.items():
+                logger.info("Load: %s at concurrency %d...", name, concurrency)
+                result["load"].append(self.run_load(name, request, requests, concurrency))
+        result["queryEmbeddings"] = self.agent.embeddings.stats()
+        result["precomputedAnswers"] = self.agent.precomputed.stats()
+        result["upstreams"] = {name: breaker.stats() for name, breaker in UPSTREAMS.items()}
+        result["skippedStages"] = {f"{stage}:{reason}": int(count)
+                                   for (stage, reason), count in sorted(metrics.SKIPPED_STAGES.snapshot().items())}
+        result["totalSeconds"] = round(time.perf_counter() - started, 3)
+        return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmark of the diabetes RAG and voice pipelines.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic",
+                        help="latency profile of the fake providers")
+    parser.add_argument("--requests", type=int, default=40, help="requests per measurement")
+    parser.add_argument("--concurrency", default="1,8,32",
+                        help="comma-separated concurrency levels for the load phase")
+    parser.add_argument("--questions", default=os.path.join(BENCHMARK_DATA_DIR, "questions.txt"))
+    parser.add_argument("--retrieval-eval", default=os.path.join(BENCHMARK_DATA_DIR, "retrieval_eval.jsonl"),
+                        help="labelled queries for the per-mode retrieval measurement")
+    parser.add_argument("--vector-backend", choices=VECTOR_BACKENDS, default=VECTOR_BACKEND,
+                        help="vector backend of the agent under load")
+    parser.add_argument("--answer-cache", action="store_true", help="keep the answer cache enabled")
+    parser.add_argument("--tts-cache", action="store_true", help="keep the TTS audio cache enabled")
+    parser.add_argument("--precomputed", action="store_true",
+                        help="precompute answers (and, with --tts-cache, audio) for the questions first")
+    parser.add_argument("--hedge-after", type=float, default=GEMINI_HEDGE_AFTER_SECONDS,
+                        help="hedge categorize/answer calls slower than this many seconds (0 disables)")
+    parser.add_argument("--generation-mode", choices=GENERATION_MODES, default=GENERATION_MODE,
+                        help="generation mode of the agent under load")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    # Per-request logging of the app would dominate the measurement
+    for name in ("server", "diabetes_rag_agent", "voice_chat_api", "knowledge_base",
+                 "question_router", "lexical_index", "vector_snapshot", "precomputed_answers", "audio_transport",
+                 "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    with tempfile.TemporaryDirectory(prefix="diabe-bench-") as workdir:
+        benchmark = Benchmark(args.profile, load_questions(args.questions), workdir,
+                              answer_cache=args.answer_cache, tts_cache=args.tts_cache,
+                              precomputed=args.precomputed,
+                              retrieval_eval=load_retrieval_eval(args.retrieval_eval),
+                              vector_backend=args.vector_backend, hedge_after=args.hedge_after,
+                              generation_mode=args.generation_mode)
+        result = benchmark.run(args.requests, levels)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        logger.info("Benchmark results written to %s", args.output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
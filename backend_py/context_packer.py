@@ -0,0 +1,137 @@
+import os
+import logging
+from dataclasses import dataclass
+from typing import Optional, List, Set
+
+from knowledge_base import CHUNK_OVERLAP
+from lexical_index import tokenize
+from session_store import clip, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Prompt tokens the retrieved context may take in generate_answer
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", 900))
+# Spoken answers are short, so the voice path gets less context
+VOICE_CONTEXT_TOKENS = int(os.getenv("VOICE_CONTEXT_TOKENS", 450))
+# MMR trade-off: 1 ranks by retrieval order only, 0 by novelty only
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.7))
+# Shortest shared text taken as a splitter overlap rather than a coincidence
+MIN_OVERLAP_CHARS = 24
+# A passage is cut to fit only if at least this much budget is left for it
+MIN_CLIPPED_TOKENS = 48
+
+
+@dataclass
+class Passage:
+    text: str
+    source: Optional[str]
+    # Best retrieval rank among the chunks it was merged from
+    rank: int
+    chunks: int = 1
+    pinned: bool = False
+
+
+def _overlap(a: str, b: str) -> int:
+    """
+    Length of the longest suffix of ``a`` that is a prefix of ``b``.
+    """
+    head = b[:MIN_OVERLAP_CHARS]
+    if len(head) < MIN_OVERLAP_CHARS:
+        return 0
+    i = a.find(head, max(0, len(a) - 2 * CHUNK_OVERLAP))
+    while i != -1:
+        if b.startswith(a[i:]):
+            return len(a) - i
+        i = a.find(head, i + 1)
+    return 0
+
+
+def _join(a: str, b: str) -> Optional[str]:
+    if b in a:
+        return a
+    if a in b:
+        return b
+    n = _overlap(a, b)
+    if n:
+        return a + b[n:]
+    n = _overlap(b, a)
+    if n:
+        return b + a[n:]
+    return None
+
+
+def merge_chunks(docs) -> List[Passage]:
+    """
+    Merge retrieved chunks of the same source that overlap (as consecutive
+    splitter chunks do) or contain one another into single passages, in
+    retrieval order.  Chunks with ``metadata["pinned"]`` are kept as they are.
+    """
+    passages: List[Passage] = []
+    for rank, doc in enumerate(docs):
+        metadata = getattr(doc, "metadata", None) or {}
+        text = getattr(doc, "page_content", str(doc)).strip()
+        if not text:
+            continue
+        passage = Passage(text, metadata.get("source"), rank, pinned=bool(metadata.get("pinned")))
+        merged = not passage.pinned and passage.source is not None
+        while merged:
+            merged = False
+            for other in passages:
+                if other.pinned or other.source != passage.source:
+                    continue
+                joined = _join(other.text, passage.text)
+                if joined is not None:
+                    passages.remove(other)
+                    passage = Passage(joined, passage.source, min(rank, other.rank), other.chunks + passage.chunks)
+                    merged = True
+                    break
+        passages.append(passage)
+    passages.sort(key=lambda p: p.rank)
+    return passages
+
+
+def _similarity(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def mmr_order(passages: List[Passage], mmr_lambda: float = MMR_LAMBDA) -> List[Passage]:
+    """
+    Order passages by maximal marginal relevance: retrieval rank as the
+    relevance, word-set overlap with the passages already chosen as the
+    redundancy.  Pinned passages come first.
+    """
+    chosen = [p for p in passages if p.pinned]
+    rest = [p for p in passages if not p.pinned]
+    if not rest:
+        return chosen
+    words = {id(p): set(tokenize(p.text)) for p in passages}
+    worst = max(p.rank for p in rest) + 1
+    while rest:
+        def score(p: Passage) -> float:
+            redundancy = max((_similarity(words[id(p)], words[id(q)]) for q in chosen), default=0.0)
+            return mmr_lambda * (1 - p.rank / worst) - (1 - mmr_lambda) * redundancy
+        best = max(rest, key=score)
+        rest.remove(best)
+        chosen.append(best)
+    return chosen
+
+
+def pack_context(docs, budget: int = CONTEXT_TOKENS, mmr_lambda: float = MMR_LAMBDA) -> str:
+    """
+    Context string for the answer prompt: retrieved chunks merged, ordered
+    by MMR and added until ``budget`` tokens are used, the last one cut at
+    a word boundary when enough room is left.
+    """
+    parts: List[str] = []
+    remaining = budget
+    for passage in mmr_order(merge_chunks(docs), mmr_lambda):
+        cost = estimate_tokens(passage.text) + 1
+        if cost <= remaining:
+            parts.append(passage.text)
+            remaining -= cost
+        elif remaining >= MIN_CLIPPED_TOKENS:
+            parts.append(clip(passage.text, remaining - 1))
+            remaining = 0
+        if remaining <= 0:
+            break
+    return "\n\n".join(parts)
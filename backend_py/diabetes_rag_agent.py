@@ -1,19 +1,35 @@
 import os
+import time
+import asyncio
 import logging
-from typing import Optional, List, Dict, Any
+import threading
+from typing import Optional, List, Dict, Any, AsyncIterator, Iterator, Tuple
 from dotenv import load_dotenv
 from dataclasses import dataclass, field, asdict
 
 # LangChain/LangGraph imports (adjust as needed for your environment)
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_community.document_loaders import WebBaseLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.runnables import RunnableLambda
+from langchain_core.documents import Document
 from langchain_community.vectorstores import Chroma
 from langgraph.graph import StateGraph, END, START
 from uuid import uuid4
-from langchain_community.document_loaders.csv_loader import CSVLoader
-from langchain_community.document_loaders import PyPDFLoader
+from knowledge_base import KB_PERSIST_DIR, KnowledgeBase
+from vector_snapshot import SnapshotVectorStore
+from answer_cache import AnswerCache
+from precomputed_answers import PRECOMPUTED_ANSWERS_PATH, PrecomputedAnswers
+from query_embedder import QueryEmbeddingBatcher
+from session_store import SessionStore, clean_history, clip, estimate_tokens, render_context
+from context_packer import CONTEXT_TOKENS, pack_context
+from question_router import ROUTER_K, ROUTER_MIN_CONFIDENCE, QuestionRouter
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from nutrition_index import NutritionTable
+from structured_answer import InvalidStructuredAnswer, parse_structured_answer, response_schema
+from latency_control import (
+    GEMINI_HEDGE_AFTER_SECONDS, GEMINI_TIMEOUT_SECONDS, REQUEST_BUDGET_SECONDS, UPSTREAMS,
+    CircuitOpen, abounded_call, bounded_call, call_timeout, remaining,
+)
+import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -21,6 +37,22 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# Concurrent Gemini calls from the async serving mode
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", 64))
+GEMINI_CHAT_MODEL = "gemini-2.0-flash"
+GEMINI_EMBEDDING_MODEL = "models/embedding-001"
+# Seconds a request waits for its category to finish loading before a 503
+WARMUP_WAIT_SECONDS = float(os.getenv("WARMUP_WAIT_SECONDS", 10))
+# Request budget that must be left to ask the LLM for a category; with less
+# (or under load) an unrouted question goes to "general"
+ROUTING_MIN_SECONDS = float(os.getenv("ROUTING_MIN_SECONDS", 8))
+# Request budget that must be left to generate followup questions
+FOLLOWUP_MIN_SECONDS = float(os.getenv("FOLLOWUP_MIN_SECONDS", 2))
+# Retrieved context quoted when the answer call fails or runs out of time
+FALLBACK_ANSWER_TOKENS = 150
+
+CATEGORIES: List[str] = ["glucose", "medication", "meal", "wellness", "general"]
+
 DOCUMENT_SOURCES = {
     "glucose": [
         "https://www.diabetes.org/healthy-living/medication-treatments/blood-glucose-testing-and-control",
@@ -33,7 +65,6 @@ DOCUMENT_SOURCES = {
     "meal": [
         "https://diabetesjournals.org/care/article/40/Supplement_1/S33/36913/4-Lifestyle-Management",
         "https://www.niddk.nih.gov/health-information/diabetes/overview/diet-eating-physical-activity",
-        "./backend_py/data/nutritiondata.csv"
     ],
     "wellness": [
         "https://www.diabetes.org/healthy-living/mental-health",
@@ -46,6 +77,61 @@ DOCUMENT_SOURCES = {
     ]
 }
 
+# "vector" (Chroma only), "hybrid" (Chroma + BM25, rank-fused) or "lexical"
+# (BM25 only, no embedding round trip at all)
+RETRIEVAL_MODES = ("vector", "hybrid", "lexical")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Chunks retrieved per question; pack_context trims them to the token budget
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", 6))
+# Candidates taken from each ranking before fusion in hybrid mode
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 10))
+# "graph" answers with separate categorize, answer and followup calls;
+# "single" asks for category, answer and followups in one structured call
+# (falling back to the separate calls when its reply does not validate)
+GENERATION_MODES = ("graph", "single")
+GENERATION_MODE = os.getenv("GENERATION_MODE", "graph")
+# "chroma" searches the Chroma collections; "snapshot" searches memory-mapped
+# exports of them and skips opening Chroma while they are current
+VECTOR_BACKENDS = ("chroma", "snapshot")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+
+# Food nutrient table, queried directly for "meal" questions instead of being embedded
+NUTRITION_DATA_PATH = os.getenv("NUTRITION_DATA_PATH", "./backend_py/data/nutritiondata.csv")
+NUTRITION_MAX_ROWS = int(os.getenv("NUTRITION_MAX_ROWS", 5))
+
+def _gemini_api_key() -> Optional[str]:
+    api_key = os.getenv("GEMINI_API_KEY")
+    if api_key:
+        os.environ["GOOGLE_API_KEY"] = api_key  # Correct way to set environment variable
+    return api_key
+
+def _gemini_chat_model():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(
+        api_key=_gemini_api_key(),
+        model=GEMINI_CHAT_MODEL,
+        max_output_tokens=2048,
+    )
+
+def _gemini_embeddings():
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(
+        google_api_key=_gemini_api_key(),
+        model=GEMINI_EMBEDDING_MODEL,
+    )
+
+class NotReady(RuntimeError):
+    """
+    The agent is still starting, or the category a question needs is still
+    loading; the servers answer 503 with a Retry-After.
+    """
+
+    def __init__(self, category: Optional[str] = None, state: str = "starting"):
+        super().__init__(f"Knowledge base category '{category}' is {state}" if category
+                         else "The assistant is still starting")
+        self.category = category
+        self.state = state
+
 def format_documents_as_string(docs):
     """
     Format a list of document objects as a single string for context.
@@ -62,128 +148,557 @@ class agents_state_schema:
     """
     question: str
     category: Optional[str] = None
+    retrievedDocs: Optional[List[Any]] = None
     relevantDocs: Optional[str] = None
+    # Token budget of relevantDocs; CONTEXT_TOKENS when unset
+    contextTokens: Optional[int] = None
     answer: Optional[str] = None
     followupQuestions: Optional[List[str]] = field(default_factory=list)
     needsMoreInfo: bool = False
     conversationHistory: Optional[List[Dict[str, str]]] = None
+    # Earlier turns (summary and recent messages), already within the token budget
+    conversationContext: Optional[str] = None
+    questionEmbedding: Optional[List[float]] = None
+    # time.perf_counter() the answer is due by; None (offline jobs) runs every
+    # stage and lets upstream errors propagate
+    deadline: Optional[float] = None
+    # Streamed answers are not hedged, as both calls would stream tokens
+    streaming: bool = False
+    # {"stage", "reason"} of each stage dropped or answered by a fallback
+    skippedStages: List[Dict[str, str]] = field(default_factory=list)
+    # One of GENERATION_MODES
+    generationMode: str = "graph"
 
 class DiabetesRagAgent:
-    def __init__(self):
-        api_key = os.getenv("GEMINI_API_KEY")
-        os.environ["GOOGLE_API_KEY"] = api_key  # Correct way to set environment variable
-        self.model = ChatGoogleGenerativeAI(
-            api_key=api_key,
-            model="gemini-2.0-flash",
-            max_output_tokens=2048,
-        )
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            google_api_key=api_key,
-            model="models/embedding-001",
-        )
+    """
+    The LangGraph RAG pipeline.  ``model``, ``embeddings`` and
+    ``document_sources`` default to Gemini and DOCUMENT_SOURCES; the
+    benchmark passes local stand-ins instead.
+    """
+
+    def __init__(self, model=None, embeddings=None,
+                 document_sources: Optional[Dict[str, List[str]]] = None,
+                 persist_dir: str = KB_PERSIST_DIR,
+                 nutrition_path: Optional[str] = NUTRITION_DATA_PATH,
+                 retrieval_mode: str = RETRIEVAL_MODE,
+                 vector_backend: str = VECTOR_BACKEND,
+                 precomputed_path: Optional[str] = PRECOMPUTED_ANSWERS_PATH,
+                 generation_mode: str = GENERATION_MODE):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{retrieval_mode}', expected one of {RETRIEVAL_MODES}")
+        if vector_backend not in VECTOR_BACKENDS:
+            raise ValueError(f"Unknown vector backend '{vector_backend}', expected one of {VECTOR_BACKENDS}")
+        if generation_mode not in GENERATION_MODES:
+            raise ValueError(f"Unknown generation mode '{generation_mode}', expected one of {GENERATION_MODES}")
+        # The Gemini clients are built on first use, so constructing the agent
+        # (and importing the servers) stays cheap
+        self._model = model
+        self._model_lock = threading.Lock()
+        self._structured_model = None
+        # Gemini can be held to the answer schema; other chat models only get the prompt's instructions
+        self._constrain_output = model is None
+        # Query embeddings from concurrent requests share batched calls and an LRU
+        self.embeddings = QueryEmbeddingBatcher(embeddings or _gemini_embeddings,
+                                                model=None if embeddings else GEMINI_EMBEDDING_MODEL)
         #self.embeddings = GoogleGenerativeAIEmbeddings(
         #    api_key=api_key,
         #    model="embedding-001",
         #)
+        self.document_sources = document_sources or DOCUMENT_SOURCES
+        self.nutrition_path = nutrition_path
+        self.nutrition: Optional[NutritionTable] = None
+        self.knowledge_base = KnowledgeBase(self.embeddings, persist_dir=persist_dir)
+        self.answer_cache = AnswerCache(self.embeddings)
+        self.knowledge_base.add_change_listener(self.answer_cache.invalidate)
+        self.precomputed = PrecomputedAnswers(precomputed_path)
+        self.knowledge_base.add_change_listener(self.precomputed.invalidate)
+        self.router = QuestionRouter(self.embeddings)
+        self.sessions = SessionStore(self.summarize_conversation)
+        self.lexical_index = LexicalIndex()
+        self.retrieval_mode = retrieval_mode
+        self.vector_backend = vector_backend
+        self.llm_semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
+        self.gemini = UPSTREAMS["gemini"]
+        self.hedge_after = GEMINI_HEDGE_AFTER_SECONDS
+        self.generation_mode = generation_mode
         self.vector_stores: Dict[str, Any] = {}
         self.graph = StateGraph(agents_state_schema)
         self.executor = None
         self.is_initialized = False
+        # Startup: the graph first, then the categories, each with its own ready event
+        self._load_lock = threading.Lock()
+        self._warmup_lock = threading.Lock()
+        self._warmup: Optional[threading.Thread] = None
+        self._base_ready = threading.Event()
+        self._ready = {category: threading.Event() for category in CATEGORIES}
+        # Categories requests are waiting for, loaded next
+        self._wanted: List[str] = []
+        self.category_state: Dict[str, Dict[str, Any]] = {category: {"state": "pending"} for category in CATEGORIES}
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = _gemini_chat_model()
+        return self._model
+
+    @property
+    def structured_model(self):
+        """
+        The chat model for the single structured call.
+        """
+        if self._structured_model is None:
+            self._structured_model = self.model.bind(
+                response_mime_type="application/json", response_json_schema=response_schema(CATEGORIES)
+            ) if self._constrain_output else self.model
+        return self._structured_model
 
     def preload_documents(self):
-        self._setup_vector_stores()
+        """
+        Load everything before returning, syncing all categories together;
+        for batch jobs and the benchmark.  The servers use ``start_warmup``.
+        """
+        warmup = self._warmup
+        if warmup is not None:
+            warmup.join()
+            return
+        with self._load_lock:
+            self._setup_base()
+            self._setup_vector_stores()
+            self.lexical_index.fit(self.vector_stores)
+            self._finish_loading()
+
+    def start_warmup(self) -> None:
+        """
+        Load the knowledge base on a background thread, one category at a
+        time, so that questions for the categories already loaded are served
+        while the rest loads.  Does nothing if loading already started.
+        """
+        with self._warmup_lock:
+            if self._warmup is not None or self.is_initialized:
+                return
+            self._warmup = threading.Thread(target=self._warm, name="kb-warmup", daemon=True)
+            self._warmup.start()
+
+    def _warm(self) -> None:
+        started = time.perf_counter()
+        try:
+            with self._load_lock:
+                self._setup_base()
+            while True:
+                category = self._next_pending()
+                if category is None:
+                    break
+                with self._load_lock:
+                    if not self._ready[category].is_set():
+                        self._load_category(category)
+            with self._load_lock:
+                self._finish_loading()
+        except Exception as error:
+            logger.exception("Warmup failed: %s", error)
+            return
+        logger.info("Warmup done in %.2fs", time.perf_counter() - started)
+
+    def _next_pending(self) -> Optional[str]:
+        with self._warmup_lock:
+            pending = [c for c in self._wanted + CATEGORIES if not self._ready[c].is_set()]
+            self._wanted = [c for c in self._wanted if not self._ready[c].is_set()]
+        return pending[0] if pending else None
+
+    def _setup_base(self) -> None:
+        if self._base_ready.is_set():
+            return
+        self._setup_nutrition()
         self._setup_graph()
         self.executor = self.graph.compile()
+        # Before requests are admitted, so precomputed answers are checked from the first one;
+        # categories that change while loading drop theirs
+        self._validate_precomputed()
+        self._base_ready.set()
+
+    def _finish_loading(self) -> None:
+        # Fitted once every category is in, so routing never favours the early ones
+        self.router.fit(self.vector_stores)
+        self._validate_precomputed()
         self.is_initialized = True
 
+    def _validate_precomputed(self) -> None:
+        self.precomputed.validate({
+            category: self.knowledge_base.manifest_fingerprint(self.knowledge_base.load_manifest(category))
+            for category in CATEGORIES
+        })
+
+    def readiness(self) -> Dict[str, Any]:
+        """
+        Load state of every category: ``pending``, ``loading``, ``ready`` or
+        ``failed`` (served without documents), and the overall status.
+        """
+        categories = {category: dict(state) for category, state in self.category_state.items()}
+        states = {state["state"] for state in categories.values()}
+        if not self._base_ready.is_set() or not states <= {"ready", "failed"}:
+            status = "warming"
+        else:
+            status = "ready" if states == {"ready"} else "degraded"
+        return {"status": status, "categories": categories}
+
+    def _ensure_started(self) -> None:
+        if self._base_ready.is_set():
+            return
+        self.start_warmup()
+        if not self._base_ready.wait(WARMUP_WAIT_SECONDS):
+            raise NotReady()
+
+    async def _aensure_started(self) -> None:
+        if not self._base_ready.is_set():
+            await asyncio.to_thread(self._ensure_started)
+
+    def _want(self, category: str) -> Optional[threading.Event]:
+        event = self._ready.get(category)
+        if event is None or event.is_set():
+            return None
+        self.start_warmup()
+        with self._warmup_lock:
+            if category not in self._wanted:
+                self._wanted.append(category)
+        return event
+
+    def wait_ready(self, category: str) -> None:
+        """
+        Wait up to WARMUP_WAIT_SECONDS for ``category`` to load, moving it
+        to the front of the warmup; raises ``NotReady`` on timeout.
+        """
+        event = self._want(category)
+        if event is not None and not event.wait(WARMUP_WAIT_SECONDS):
+            raise NotReady(category, self.category_state[category]["state"])
+
+    async def await_ready(self, category: str) -> None:
+        event = self._want(category)
+        if event is not None and not await asyncio.to_thread(event.wait, WARMUP_WAIT_SECONDS):
+            raise NotReady(category, self.category_state[category]["state"])
+
+    def _setup_nutrition(self) -> None:
+        if not self.nutrition_path:
+            return
+        try:
+            self.nutrition = NutritionTable.from_csv(self.nutrition_path)
+        except Exception as error:
+            logger.error("Error loading nutrition table %s: %s", self.nutrition_path, error)
+            self.nutrition = None
+
+    def nutrition_facts(self, question: str) -> str:
+        """
+        Nutrition table rows matching the foods and ranges in a question.
+        """
+        if self.nutrition is None:
+            return ""
+        rows = self.nutrition.search(question, limit=NUTRITION_MAX_ROWS)
+        if len(rows):
+            logger.info(f"Matched {len(rows)} nutrition table rows")
+        return self.nutrition.format_rows(rows)
+
     def _setup_vector_stores(self) -> None:
         """
-        Build/refresh an in‑memory vector store for each category defined in
-        DOCUMENT_SOURCES.  Mirrors the TypeScript `setupVectorStores` logic.
+        Open the persistent vector store for each category defined in
+        ``document_sources``, fetching and embedding only new or changed sources.
+        Sources of all categories are fetched concurrently and their chunks
+        embedded in shared batches.  With the snapshot backend, categories
+        whose snapshot is current are mapped without syncing; the others are
+        synced and exported again.
         """
-        categories: List[str] = ["glucose", "medication", "meal",
-                                "wellness", "general"]
+        started = time.perf_counter()
+        sources = {category: self.document_sources[category] for category in CATEGORIES
+                   if category in self.document_sources and not self._ready[category].is_set()}
+        snapshots = {}
+        if self.vector_backend == "snapshot":
+            for category in list(sources):
+                snapshot = self.knowledge_base.open_snapshot(category, sources[category])
+                if snapshot is not None:
+                    snapshots[category] = snapshot
+                    del sources[category]
+        results = self.knowledge_base.sync_all(sources) if sources else {}
+        for category in CATEGORIES:
+            if self._ready[category].is_set():
+                continue
+            if category in snapshots:
+                store = snapshots[category]
+                logger.info("Vector snapshot mapped for category: %s (%d chunks)", category, len(store.ids))
+            elif category in results:
+                store, changed = results[category]
+                if self.vector_backend == "snapshot":
+                    store = self.knowledge_base.export_snapshot(category, store)
+                logger.info("Vector store ready for category: %s (%s)",
+                            category, "updated" if changed else "unchanged")
+            else:
+                store = self._empty_store(category)
+            failed = category in sources and category not in results
+            self._set_store(category, store, time.perf_counter() - started,
+                            "sync failed, see the log" if failed else None)
 
-        for category in categories:
-            try:
-                # 1) create loaders for every source in the category
-                web_loaders = [
-                    PyPDFLoader(source) if source.endswith(".pdf") else (
-                        CSVLoader(source) if source.endswith(".csv") else WebBaseLoader(source)
-                    )
-                    for source in DOCUMENT_SOURCES[category]
-                ]
-
-                # 2) load the documents
-                docs = []
-                for source, loader in zip(DOCUMENT_SOURCES[category], web_loaders):
-                    try:
-                        if source.endswith(".csv"):
-                            logger.info("Attempting to load CSV file: %s", source)
-                        loaded_docs = loader.load()
-                        if not loaded_docs:
-                            logger.warning("No documents loaded from source: %s", source)
-                            continue
-                        docs.extend(loaded_docs)
-                        logger.info(
-                            "✅ Successfully Pre‑loaded %d pages from %s (category: %s)",
-                            len(loaded_docs), source, category
-                        )
-                    except Exception as err:
-                        logger.warning("Failed to load a document source, skipping: %s", err)
-                        if source.endswith(".csv"):
-                            logger.error("Error loading CSV file: %s. Please check the file format and content.", source)
-
-                if not docs:
-                    logger.warning("No documents available for category: %s", category)
-                    self.vector_stores[category] = Chroma(
-                        collection_name=f"empty_{category}_{uuid4().hex[:8]}",
-                        embedding_function=self.embeddings,
-                    )
-                    logger.info("Created empty vector store for category: %s", category)
-                    continue
+    def _load_category(self, category: str) -> None:
+        """
+        Open, sync or export the vector store of one category, as
+        ``_setup_vector_stores`` does for all of them.
+        """
+        started = time.perf_counter()
+        self.category_state[category] = {"state": "loading"}
+        sources = self.document_sources.get(category)
+        error = None
+        try:
+            store = None
+            if sources and self.vector_backend == "snapshot":
+                store = self.knowledge_base.open_snapshot(category, sources)
+            if store is None and sources:
+                store, _ = self.knowledge_base.sync_category(category, sources)
+                if self.vector_backend == "snapshot":
+                    store = self.knowledge_base.export_snapshot(category, store)
+            if store is None:
+                store = self._empty_store(category)
+        except Exception as err:
+            logger.error("Error loading category %s: %s", category, err)
+            store, error = self._empty_store(category), str(err)
+        # Indexed before it is marked ready, so a waiting lexical search finds it
+        self.lexical_index.add(category, store)
+        self._set_store(category, store, time.perf_counter() - started, error)
+        logger.info("Category %s %s in %.2fs", category, "failed" if error else "ready",
+                    time.perf_counter() - started)
 
-                # 3) split into chunks
-                splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=1000,
-                    chunk_overlap=200,
-                )
-                split_docs = splitter.split_documents(docs)
+    def _empty_store(self, category: str):
+        logger.info("Created empty vector store for category: %s", category)
+        if self.vector_backend == "snapshot":
+            return SnapshotVectorStore.empty(self.embeddings)
+        # create an empty chroma collection so similarity_search still works
+        return Chroma(
+            collection_name=f"empty_{category}_{uuid4().hex[:8]}",
+            embedding_function=self.embeddings,
+        )
 
-                if not split_docs:
-                    logger.warning("No document chunks created for category: %s", category)
-                    self.vector_stores[category] = Chroma(
-                        collection_name=f"empty_{category}_{uuid4().hex[:8]}",
-                        embedding_function=self.embeddings,
-                    )
-                    logger.info("Created empty vector store for category: %s", category)
-                    continue
+    def _set_store(self, category: str, store, seconds: float, error: Optional[str] = None) -> None:
+        self.vector_stores[category] = store
+        try:
+            chunks = len(store.get(include=[])["ids"])
+        except Exception:
+            chunks = None
+        state = {"state": "failed" if error else "ready", "chunks": chunks, "seconds": round(seconds, 3)}
+        if error:
+            state["error"] = error
+        self.category_state[category] = state
+        self._ready[category].set()
+
+    def retrieve(self, question: str, category: str, mode: Optional[str] = None,
+                 embedding: Optional[List[float]] = None) -> List[Any]:
+        """
+        Top RETRIEVAL_K chunks of ``category`` for ``question`` in the given
+        retrieval mode (default ``self.retrieval_mode``).  ``embedding``
+        saves the vector search its own embedding call.  Waits for the
+        category if it is still loading.
+        """
+        self.wait_ready(category)
+        mode = mode or self.retrieval_mode
+        if mode == "lexical":
+            return self.lexical_index.search(category, question, k=RETRIEVAL_K)
+        k = RETRIEVAL_K if mode == "vector" else HYBRID_CANDIDATES
+        vector_store = self.vector_stores.get(category)
+        if embedding:
+            docs = vector_store.similarity_search_by_vector(embedding, k=k)
+        else:
+            docs = vector_store.similarity_search(question, k=k)
+        if mode == "vector":
+            return docs
+        lexical = self.lexical_index.search(category, question, k=HYBRID_CANDIDATES)
+        return reciprocal_rank_fusion([docs, lexical], RETRIEVAL_K)
+
+    async def aretrieve(self, question: str, category: str, mode: Optional[str] = None,
+                        embedding: Optional[List[float]] = None) -> List[Any]:
+        await self.await_ready(category)
+        mode = mode or self.retrieval_mode
+        if mode == "lexical":
+            return self.lexical_index.search(category, question, k=RETRIEVAL_K)
+        k = RETRIEVAL_K if mode == "vector" else HYBRID_CANDIDATES
+        vector_store = self.vector_stores.get(category)
+        if embedding:
+            docs = await vector_store.asimilarity_search_by_vector(embedding, k=k)
+        else:
+            docs = await vector_store.asimilarity_search(question, k=k)
+        if mode == "vector":
+            return docs
+        lexical = self.lexical_index.search(category, question, k=HYBRID_CANDIDATES)
+        return reciprocal_rank_fusion([docs, lexical], RETRIEVAL_K)
 
-                # 4) build the vector store for the category
-                self.vector_stores[category] = Chroma.from_documents(
-                    split_docs, self.embeddings
+    def retrieve_any(self, question: str, embedding: Optional[List[float]] = None) -> List[Any]:
+        """
+        Chunks for a question no router could place: every category loaded
+        so far is searched and the rankings fused.
+        """
+        categories = [category for category in CATEGORIES if self._ready[category].is_set()] or ["general"]
+        rankings = [self.retrieve(question, category, embedding=embedding) for category in categories]
+        return reciprocal_rank_fusion(rankings, RETRIEVAL_K)
+
+    async def aretrieve_any(self, question: str, embedding: Optional[List[float]] = None) -> List[Any]:
+        categories = [category for category in CATEGORIES if self._ready[category].is_set()] or ["general"]
+        rankings = await asyncio.gather(*(self.aretrieve(question, category, embedding=embedding)
+                                          for category in categories))
+        return reciprocal_rank_fusion(list(rankings), RETRIEVAL_K)
+
+    def _chat(self, node: str, messages, structured: bool = False):
+        with metrics.vendor_call("gemini", "chat"):
+            response = (self.structured_model if structured else self.model).invoke(messages)
+        metrics.record_usage(node, response)
+        return response
+
+    def summarize_conversation(self, summary: str, messages: List[Dict[str, str]]) -> str:
+        """
+        Fold messages that left a session's window into its running summary.
+        """
+        transcript = "\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in messages)
+        response = self._chat("summarize_conversation", [
+            SystemMessage(
+                content=(
+                    "You maintain a short running summary of a conversation between a diabetes patient and "
+                    "an assistant. Update the summary with the new messages. Keep facts about the patient "
+                    "(their medicines, readings, diet, concerns) and the topics already covered. "
+                    "Reply with the updated summary only, in at most 120 words."
                 )
+            ),
+            HumanMessage(content=f"Current summary: {summary or '(none)'}\n\nNew messages:\n{transcript}"),
+        ])
+        return response.content.strip()
+
+    async def _achat(self, node: str, messages, structured: bool = False):
+        async with self.llm_semaphore:
+            with metrics.vendor_call("gemini", "chat"):
+                response = await (self.structured_model if structured else self.model).ainvoke(messages)
+        metrics.record_usage(node, response)
+        return response
+
+    def _bounded_chat(self, node: str, messages, state: agents_state_schema, hedge: bool = False,
+                      structured: bool = False):
+        """
+        ``_chat`` within the request's remaining budget (and
+        GEMINI_TIMEOUT_SECONDS), through the Gemini circuit breaker, hedged
+        when ``hedge`` and hedging is on.
+        """
+        return bounded_call(lambda: self._chat(node, messages, structured),
+                            call_timeout(state.deadline, GEMINI_TIMEOUT_SECONDS),
+                            self.gemini if state.deadline is not None else None,
+                            self._hedge_after(state, hedge), node)
+
+    async def _abounded_chat(self, node: str, messages, state: agents_state_schema, hedge: bool = False,
+                             structured: bool = False):
+        return await abounded_call(lambda: self._achat(node, messages, structured),
+                                   call_timeout(state.deadline, GEMINI_TIMEOUT_SECONDS),
+                                   self.gemini if state.deadline is not None else None,
+                                   self._hedge_after(state, hedge), node)
 
-                logger.info("Processed %d document chunks for category: %s",
-                            len(split_docs), category)
+    def _hedge_after(self, state: agents_state_schema, hedge: bool) -> float:
+        if not hedge or state.streaming or state.deadline is None:
+            return 0.0
+        return self.hedge_after
 
+    def _degrade_reason(self, state: agents_state_schema, min_seconds: float) -> Optional[str]:
+        """
+        Why an optional LLM stage should be dropped now, or None to run it.
+        """
+        if state.deadline is None:
+            return None
+        if self.gemini.is_open:
+            return "circuit_open"
+        if self.gemini.overloaded:
+            return "load"
+        if remaining(state.deadline) < min_seconds:
+            return "budget"
+        return None
+
+    @staticmethod
+    def _failure_reason(error: Exception) -> str:
+        if isinstance(error, CircuitOpen):
+            return "circuit_open"
+        return "timeout" if isinstance(error, TimeoutError) else "error"
+
+    @staticmethod
+    def _skip(state: agents_state_schema, stage: str, reason: str, error: Optional[Exception] = None) -> None:
+        logger.warning(f"Skipped {stage} ({reason})" + (f": {error}" if error else ""))
+        metrics.SKIPPED_STAGES.inc(stage, reason)
+        state.skippedStages = [*state.skippedStages, {"stage": stage, "reason": reason}]
+
+    def _llm_node(self, name: str, prepare, finish, degrade=None, skip=None, hedge: bool = False,
+                  structured: bool = False) -> RunnableLambda:
+        """
+        Build a graph node around one chat-model call, with a blocking
+        implementation for ``invoke``/``stream`` and a non-blocking one for
+        ``ainvoke``/``astream``.  ``prepare(state)`` returns the messages (or
+        None to skip the call) and ``finish(state, response)`` the new state.
+
+        With ``degrade(state)``, a call that fails or times out, or that
+        ``skip(state)`` gives a reason to drop, is recorded in skippedStages
+        and ``degrade`` supplies the new state instead.  ``structured`` calls
+        ``structured_model``.
+        """
+        def node(state: agents_state_schema) -> agents_state_schema:
+            messages = prepare(state)
+            if messages is None:
+                return state
+            reason = skip(state) if skip else None
+            if reason:
+                self._skip(state, name, reason)
+                return degrade(state)
+            try:
+                response = self._bounded_chat(name, messages, state, hedge, structured)
             except Exception as error:
-                logger.error("Error processing document category %s: %s",
-                            category, error)
-                # fall back to an empty store so similarity_search still works
-                # self.vector_stores[category] = Chroma(self.embeddings)
-                # create an empty chroma collection so similarity_search still works
-
-                self.vector_stores[category] = Chroma(
-                    collection_name=f"empty_{category}_{uuid4().hex[:8]}",
-                    embedding_function=self.embeddings,
-                )
-                logger.info("Created empty vector store for category: %s", category)
+                if degrade is None or state.deadline is None:
+                    raise
+                self._skip(state, name, self._failure_reason(error), error)
+                return degrade(state)
+            return finish(state, response)
+
+        async def anode(state: agents_state_schema) -> agents_state_schema:
+            messages = prepare(state)
+            if messages is None:
+                return state
+            reason = skip(state) if skip else None
+            if reason:
+                self._skip(state, name, reason)
+                return degrade(state)
+            try:
+                response = await self._abounded_chat(name, messages, state, hedge, structured)
+            except Exception as error:
+                if degrade is None or state.deadline is None:
+                    raise
+                self._skip(state, name, self._failure_reason(error), error)
+                return degrade(state)
+            return finish(state, response)
+
+        return RunnableLambda(metrics.instrument(name, node), afunc=metrics.instrument(name, anode), name=name)
 
     def _setup_graph(self):
-        # Categorize question node
-        def categorize_question(state: agents_state_schema) -> agents_state_schema:
-            response = self.model.invoke([
+        # Categorize question node: local embedding router first, LLM when it abstains
+        def route_locally(state: agents_state_schema, error: Optional[Exception]) -> bool:
+            if error is not None:
+                logger.warning(f"Local question router failed, falling back to LLM: {error}")
+                return False
+            category, confidence = self.router.classify(state.question, state.questionEmbedding)
+            if category is None:
+                logger.info(f"Local router abstained (confidence {confidence:.2f}), asking the LLM")
+                return False
+            logger.info(f"Routed question to '{category}' locally (confidence {confidence:.2f})")
+            state.category = category
+            return True
+
+        def route_lexically(state: agents_state_schema) -> bool:
+            # Lexical mode stays off the embedding API entirely, routing included
+            if not self.is_initialized:
+                # Until every category is loaded the vote would favour the loaded ones
+                return False
+            category, confidence = self.lexical_index.classify(state.question, ROUTER_K, ROUTER_MIN_CONFIDENCE)
+            if category is None:
+                logger.info(f"Lexical router abstained (confidence {confidence:.2f}), asking the LLM")
+                return False
+            logger.info(f"Routed question to '{category}' lexically (confidence {confidence:.2f})")
+            state.category = category
+            return True
+
+        def categorize_messages(state: agents_state_schema):
+            return [
                 SystemMessage(
                     content=(
                         "You are an expert at categorizing diabetes-related questions. "
@@ -195,56 +710,170 @@ class DiabetesRagAgent:
                     )
                 ),
                 HumanMessage(content=state.question),
-            ])
+            ]
+
+        def finish_categorize(state: agents_state_schema, response) -> agents_state_schema:
             category = response.content.strip().lower()
-            valid_categories = ["glucose", "medication", "meal", "wellness", "general"]
-            state.category = category if category in valid_categories else "general"
+            state.category = category if category in CATEGORIES else "general"
+            return state
+
+        def route_by_default(state: agents_state_schema, reason: str,
+                             error: Optional[Exception] = None) -> agents_state_schema:
+            self._skip(state, "categorize_question", reason, error)
+            state.category = "general"
             return state
 
+        def categorize_question(state: agents_state_schema) -> agents_state_schema:
+            if self.retrieval_mode == "lexical":
+                if route_lexically(state):
+                    return state
+            elif self.router.is_ready:
+                error = None
+                try:
+                    state.questionEmbedding = self.router.embed(state.question)
+                except Exception as err:
+                    error = err
+                if route_locally(state, error):
+                    return state
+            if state.generationMode == "single":
+                # Left open: retrieval spans the categories and the single call names one
+                return state
+            reason = self._degrade_reason(state, ROUTING_MIN_SECONDS)
+            if reason:
+                return route_by_default(state, reason)
+            try:
+                response = self._bounded_chat("categorize_question", categorize_messages(state), state, hedge=True)
+            except Exception as error:
+                if state.deadline is None:
+                    raise
+                return route_by_default(state, self._failure_reason(error), error)
+            return finish_categorize(state, response)
+
+        async def acategorize_question(state: agents_state_schema) -> agents_state_schema:
+            if self.retrieval_mode == "lexical":
+                if route_lexically(state):
+                    return state
+            elif self.router.is_ready:
+                error = None
+                try:
+                    state.questionEmbedding = await self.router.aembed(state.question)
+                except Exception as err:
+                    error = err
+                if route_locally(state, error):
+                    return state
+            if state.generationMode == "single":
+                # Left open: retrieval spans the categories and the single call names one
+                return state
+            reason = self._degrade_reason(state, ROUTING_MIN_SECONDS)
+            if reason:
+                return route_by_default(state, reason)
+            try:
+                response = await self._abounded_chat("categorize_question", categorize_messages(state), state,
+                                                     hedge=True)
+            except Exception as error:
+                if state.deadline is None:
+                    raise
+                return route_by_default(state, self._failure_reason(error), error)
+            return finish_categorize(state, response)
+
         # Retrieve documents node
+        def finish_retrieve(state: agents_state_schema, category: str, docs) -> agents_state_schema:
+            logger.info(f"Retrieved {len(docs)} documents for category '{category}'")
+            if category == "meal":
+                facts = self.nutrition_facts(state.question)
+                if facts:
+                    # Pinned: packed first and never merged with the prose chunks
+                    docs = [Document(page_content=facts, metadata={"source": "nutrition", "pinned": True}), *docs]
+            state.retrievedDocs = docs
+            return state
+
+        def retrieve_failed(state: agents_state_schema, error: Exception) -> agents_state_schema:
+            logger.error(f"Error retrieving documents: {error}")
+            state.retrievedDocs = []
+            state.needsMoreInfo = True
+            return state
+
         def retrieve_documents(state: agents_state_schema) -> agents_state_schema:
             category = state.category or "general"
-            vector_store = self.vector_stores.get(category)
             try:
-                docs = vector_store.similarity_search(state.question, k=3)
-                relevant_docs = format_documents_as_string(docs)
-                state.relevantDocs = relevant_docs
-                logger.info(f"Retrieved {len(docs)} documents for category '{category}'")
+                if state.category is None and state.generationMode == "single":
+                    docs, category = self.retrieve_any(state.question, state.questionEmbedding), "any"
+                else:
+                    docs = self.retrieve(state.question, category, embedding=state.questionEmbedding)
+            except NotReady:
+                raise
+            except Exception as error:
+                return retrieve_failed(state, error)
+            return finish_retrieve(state, category, docs)
+
+        async def aretrieve_documents(state: agents_state_schema) -> agents_state_schema:
+            category = state.category or "general"
+            try:
+                if state.category is None and state.generationMode == "single":
+                    docs, category = await self.aretrieve_any(state.question, state.questionEmbedding), "any"
+                else:
+                    docs = await self.aretrieve(state.question, category, embedding=state.questionEmbedding)
+            except NotReady:
+                raise
             except Exception as error:
-                logger.error(f"Error retrieving documents: {error}")
-                state.relevantDocs = ""
-                state.needsMoreInfo = True
+                return retrieve_failed(state, error)
+            return finish_retrieve(state, category, docs)
+
+        # Pack context node: merge overlapping chunks, order by MMR, cut to the token budget
+        def pack_documents(state: agents_state_schema) -> agents_state_schema:
+            docs = state.retrievedDocs or []
+            state.relevantDocs = pack_context(docs, state.contextTokens or CONTEXT_TOKENS)
+            retrieved_tokens = estimate_tokens(format_documents_as_string(docs))
+            packed_tokens = estimate_tokens(state.relevantDocs)
+            metrics.PROMPT_CONTEXT_TOKENS.observe(retrieved_tokens, "retrieved")
+            metrics.PROMPT_CONTEXT_TOKENS.observe(packed_tokens, "packed")
+            logger.info(f"Packed {len(docs)} chunks from ~{retrieved_tokens} into ~{packed_tokens} tokens")
             return state
 
+        async def apack_documents(state: agents_state_schema) -> agents_state_schema:
+            return pack_documents(state)
+
         # Generate answer node
-        def generate_answer(state: agents_state_schema) -> agents_state_schema:
-            response = self.model.invoke([
-                SystemMessage(
-                    content=(
-                        "You are a helpful and accurate medical AI assistant for diabetes patients. "
-                        "Use the provided context information to answer the question if it is relevant. "
-                        "If the context does not contain the answer, use your own knowledge to provide the most accurate and helpful response. "
-                        "Do not say 'I am sorry, but this document does not contain information about ...' or similar phrases. "
-                        "Always provide a helpful, informative answer, and mention that the patient should consult healthcare professionals for medical advice."
-                    )
-                ),
-                HumanMessage(
-                    content=(
-                        f"Context information: {state.relevantDocs or 'No specific information available.'}\n\n"
-                        f"Question: {state.question}\n\n"
-                        "Answer the question based on the context provided, or your own knowledge if the context is insufficient."
-                    )
-                )
-            ])
+        answer_instructions = (
+            "You are a helpful and accurate medical AI assistant for diabetes patients. "
+            "Use the provided context information to answer the question if it is relevant. "
+            "If the context does not contain the answer, use your own knowledge to provide the most accurate and helpful response. "
+            "Do not say 'I am sorry, but this document does not contain information about ...' or similar phrases. "
+            "Always provide a helpful, informative answer, and mention that the patient should consult healthcare professionals for medical advice."
+        )
+
+        def answer_prompt(state: agents_state_schema) -> str:
+            return (
+                (f"Conversation so far:\n{state.conversationContext}\n\n" if state.conversationContext else "") +
+                f"Context information: {state.relevantDocs or 'No specific information available.'}\n\n"
+                f"Question: {state.question}\n\n"
+                "Answer the question based on the context provided, or your own knowledge if the context is insufficient."
+            )
+
+        def answer_messages(state: agents_state_schema):
+            return [SystemMessage(content=answer_instructions), HumanMessage(content=answer_prompt(state))]
+
+        def finish_answer(state: agents_state_schema, response) -> agents_state_schema:
             state.answer = response.content
             return state
 
+        def fallback_answer(state: agents_state_schema) -> agents_state_schema:
+            if state.relevantDocs:
+                state.answer = (
+                    "I can't reach the assistant right now, so here is the most relevant information I found:\n\n"
+                    f"{clip(state.relevantDocs, FALLBACK_ANSWER_TOKENS)}\n\n"
+                    "Please consult your healthcare professional for medical advice."
+                )
+            else:
+                state.answer = "I'm sorry, I couldn't generate an answer at this time. Please try again shortly."
+            return state
+
         # Generate followups node
-        def generate_followups(state: agents_state_schema) -> agents_state_schema:
+        def followup_messages(state: agents_state_schema):
             if not state.answer:
                 state.followupQuestions = []
-                return state
-            response = self.model.invoke([
+                return None
+            return [
                 SystemMessage(
                     content=(
                         "Based on the user's question and your answer, suggest 1 natural follow-up questions they might want to ask. "
@@ -258,49 +887,351 @@ class DiabetesRagAgent:
                         "Generate 1 potential follow-up question:"
                     )
                 )
-            ])
+            ]
+
+        def finish_followups(state: agents_state_schema, response) -> agents_state_schema:
             content = response.content.replace("**", "")
             questions = [q.strip() for q in content.split('\n') if q.strip()]
             state.followupQuestions = questions if questions else []
             return state
 
+        def skip_followups(state: agents_state_schema) -> Optional[str]:
+            if any(skipped["stage"] == "generate_answer" for skipped in state.skippedStages):
+                # No followups for a fallback answer
+                return "answer_fallback"
+            return self._degrade_reason(state, FOLLOWUP_MIN_SECONDS)
+
+        def no_followups(state: agents_state_schema) -> agents_state_schema:
+            state.followupQuestions = []
+            return state
+
+        # Single structured call: category, answer and followups at once
+        def structured_messages(state: agents_state_schema):
+            return [
+                SystemMessage(
+                    content=(
+                        f"{answer_instructions} "
+                        "Reply with a JSON object only, with these keys: "
+                        f"\"category\": the question's category, one of {', '.join(CATEGORIES)} "
+                        "(glucose: blood sugar management, medication: medications and treatments, "
+                        "meal: nutrition and diet, wellness: emotional and mental health, "
+                        "general: general diabetes information); "
+                        "\"answer\": your answer; "
+                        "\"followupQuestions\": a list with 1 natural follow-up question the user might ask next, "
+                        "related to diabetes management and no more than 10 words."
+                    )
+                ),
+                HumanMessage(content=answer_prompt(state)),
+            ]
+
+        def finish_structured(state: agents_state_schema, response) -> agents_state_schema:
+            try:
+                parsed = parse_structured_answer(response.text, CATEGORIES)
+            except InvalidStructuredAnswer as error:
+                # Left without an answer, the graph continues with generate_answer
+                logger.warning(f"Structured answer did not validate, falling back to separate calls: {error}")
+                metrics.STRUCTURED_ANSWERS.inc("invalid")
+                return state
+            metrics.STRUCTURED_ANSWERS.inc("valid")
+            state.category = state.category or parsed.category
+            state.answer = parsed.answer
+            state.followupQuestions = parsed.followupQuestions
+            return state
+
+        def structured_failed(state: agents_state_schema) -> agents_state_schema:
+            metrics.STRUCTURED_ANSWERS.inc("failed")
+            return state
+
+        categorize_question = RunnableLambda(metrics.instrument("categorize_question", categorize_question),
+                                             afunc=metrics.instrument("categorize_question", acategorize_question),
+                                             name="categorize_question")
+        retrieve_documents = RunnableLambda(metrics.instrument("retrieve_documents", retrieve_documents),
+                                            afunc=metrics.instrument("retrieve_documents", aretrieve_documents),
+                                            name="retrieve_documents")
+        # Not rebound to pack_documents: apack_documents calls that by name
+        pack_node = RunnableLambda(metrics.instrument("pack_context", pack_documents),
+                                   afunc=metrics.instrument("pack_context", apack_documents),
+                                   name="pack_context")
+        generate_answer = self._llm_node("generate_answer", answer_messages, finish_answer,
+                                         degrade=fallback_answer, hedge=True)
+        generate_followups = self._llm_node("generate_followups", followup_messages, finish_followups,
+                                            degrade=no_followups, skip=skip_followups)
+        generate_structured = self._llm_node("generate_structured", structured_messages, finish_structured,
+                                             degrade=structured_failed, hedge=True, structured=True)
+
         # Build the state graph
         self.graph.add_node("categorize_question", categorize_question)
         self.graph.add_node("retrieve_documents", retrieve_documents)
+        self.graph.add_node("pack_context", pack_node)
         self.graph.add_node("generate_answer", generate_answer)
         self.graph.add_node("generate_followups", generate_followups)
-        self.graph.add_edge(START, "categorize_question")
+        self.graph.add_node("generate_structured", generate_structured)
+        # Skip routing entirely when the caller already supplied a valid category
+        def route_entry(state: agents_state_schema) -> str:
+            return "retrieve_documents" if state.category in CATEGORIES else "categorize_question"
+
+        self.graph.add_conditional_edges(
+            START, route_entry, ["categorize_question", "retrieve_documents"]
+        )
         self.graph.add_edge("categorize_question", "retrieve_documents")
-        self.graph.add_edge("retrieve_documents", "generate_answer")
+        self.graph.add_edge("retrieve_documents", "pack_context")
+        def route_generation(state: agents_state_schema) -> str:
+            return "generate_structured" if state.generationMode == "single" else "generate_answer"
+
+        # A structured call that failed or did not validate leaves no answer: fall back to the separate calls
+        def after_structured(state: agents_state_schema) -> str:
+            return END if state.answer else "generate_answer"
+
+        self.graph.add_conditional_edges("pack_context", route_generation, ["generate_structured", "generate_answer"])
+        self.graph.add_conditional_edges("generate_structured", after_structured, [END, "generate_answer"])
         self.graph.add_edge("generate_answer", "generate_followups")
         self.graph.add_edge("generate_followups", END)
 
-    def answer_question(
+    def _new_state(
         self,
         question: str,
-        category: Optional[str] = None,
-        conversation_history: Optional[List[Dict[str, str]]] = None
-    ) -> Dict[str, Any]:
-        if not self.is_initialized:
-            self.preload_documents()
-        # Create state using dataclass
-        state = agents_state_schema(
+        category: Optional[str],
+        conversation_history: Optional[List[Dict[str, str]]],
+        conversation_context: Optional[str] = None,
+        context_tokens: Optional[int] = None,
+        deadline: Optional[float] = None,
+        streaming: bool = False,
+        generation_mode: Optional[str] = None
+    ) -> agents_state_schema:
+        return agents_state_schema(
             question=question,
             category=category,
             needsMoreInfo=False,
             conversationHistory=conversation_history,
+            conversationContext=conversation_context or None,
+            contextTokens=context_tokens,
+            deadline=deadline,
+            streaming=streaming,
+            generationMode=generation_mode or self.generation_mode,
         )
-        #logger.info(f"Initial state: {state}")
-        final_state = self.executor.invoke(state)
-        #logger.info(f"Final state returned by executor: {final_state} (type: {type(final_state)})")
+
+    def conversation_context(self, session_id: Optional[str],
+                             conversation_history: Optional[List[Dict[str, str]]]) -> str:
+        """
+        Earlier turns for the answer prompt: the server-side session when
+        there is one, else the client's ``conversationHistory``, either way
+        within SESSION_CONTEXT_TOKENS.
+        """
+        if session_id:
+            return self.sessions.context(session_id)
+        return render_context("", clean_history(conversation_history))
+
+    def _finish(self, question: str, category: Optional[str], final_state,
+                session_id: Optional[str] = None, context: str = "") -> Dict[str, Any]:
         # If final_state is a dict, convert to dataclass
         if isinstance(final_state, dict):
             final_state = agents_state_schema(**final_state)
         # Convert dataclass to dict for output
-        return {
-            "answer": getattr(final_state, "answer", "I'm sorry, I couldn't generate an answer at this time."),
-            "followupQuestions": getattr(final_state, "followupQuestions", []),
+        result = {
+            "answer": final_state.answer or "I'm sorry, I couldn't generate an answer at this time.",
+            "followupQuestions": final_state.followupQuestions or [],
         }
+        if final_state.skippedStages:
+            result["skippedStages"] = final_state.skippedStages
+        # Answers that depend on earlier turns are not reusable for other conversations,
+        # and degraded ones should be answered in full next time
+        if final_state.answer and not context and not final_state.skippedStages:
+            self.answer_cache.put(question, category, result)
+        return self._record(question, session_id, result)
+
+    def _record(self, question: str, session_id: Optional[str], result: Dict[str, Any]) -> Dict[str, Any]:
+        if session_id:
+            self.sessions.append(session_id, question, result["answer"])
+            result = {**result, "sessionId": session_id}
+        return result
+
+    def _cache_get(self, question: str, category: Optional[str]) -> Optional[Dict[str, Any]]:
+        # The offline answer table first, then answers computed since startup
+        return self.precomputed.get(question, category) or self.answer_cache.get(question, category)
+
+    async def _acache_get(self, question: str, category: Optional[str]) -> Optional[Dict[str, Any]]:
+        precomputed = self.precomputed.get(question, category)
+        if precomputed is not None:
+            return precomputed
+        # A near-duplicate lookup embeds the question, so keep it off the event loop
+        if self.answer_cache.semantic_enabled:
+            return await asyncio.to_thread(self.answer_cache.get, question, category)
+        return self.answer_cache.get(question, category)
+
+    def answer_question(
+        self,
+        question: str,
+        category: Optional[str] = None,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        session_id: Optional[str] = None,
+        context_tokens: Optional[int] = None
+    ) -> Dict[str, Any]:
+        self._ensure_started()
+        context = self.conversation_context(session_id, conversation_history)
+        cached = None if context else self._cache_get(question, category)
+        if cached is not None:
+            logger.info("Answer cache hit for question: %s", question)
+            return self._record(question, session_id, cached)
+        state = self._new_state(question, category, conversation_history, context, context_tokens,
+                                deadline=time.perf_counter() + REQUEST_BUDGET_SECONDS)
+        final_state = self.executor.invoke(state)
+        return self._finish(question, category, final_state, session_id, context)
 
+    async def aanswer_question(
+        self,
+        question: str,
+        category: Optional[str] = None,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        session_id: Optional[str] = None,
+        context_tokens: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Non-blocking ``answer_question`` for the async serving mode.
+        """
+        await self._aensure_started()
+        context = self.conversation_context(session_id, conversation_history)
+        cached = None if context else await self._acache_get(question, category)
+        if cached is not None:
+            logger.info("Answer cache hit for question: %s", question)
+            return self._record(question, session_id, cached)
+        state = self._new_state(question, category, conversation_history, context, context_tokens,
+                                deadline=time.perf_counter() + REQUEST_BUDGET_SECONDS)
+        final_state = await self.executor.ainvoke(state)
+        return self._finish(question, category, final_state, session_id, context)
+
+    @staticmethod
+    def _cached_events(cached: Dict[str, Any], category: Optional[str]) -> List[Tuple[str, Dict[str, Any]]]:
+        return [
+            ("meta", {"category": category, "cached": True}),
+            ("token", {"text": cached["answer"]}),
+            ("answer", {"answer": cached["answer"]}),
+            ("followups", {"followupQuestions": cached["followupQuestions"]}),
+        ]
+
+    @staticmethod
+    def _stream_events(mode: str, payload, final_state: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Translate one LangGraph ``updates``/``messages`` stream item into
+        client events, accumulating node updates into ``final_state``.
+        """
+        if mode == "messages":
+            chunk, metadata = payload
+            # Tokens of an answer call abandoned for a fallback may still trickle in
+            if metadata.get("langgraph_node") != "generate_answer" or not chunk.text or final_state.get("answer"):
+                return []
+            return [("token", {"text": chunk.text})]
+        events = []
+        for node, update in payload.items():
+            final_state.update(update or {})
+            if node == "retrieve_documents":
+                events.append(("meta", {"category": final_state.get("category"), "cached": False}))
+            elif node == "generate_answer":
+                events.append(("answer", {"answer": final_state.get("answer") or ""}))
+            elif node == "generate_followups":
+                events.append(("followups", {"followupQuestions": final_state.get("followupQuestions") or []}))
+            elif node == "generate_structured" and final_state.get("answer"):
+                # Not streamed token by token: the reply is JSON until it has been parsed.  A
+                # question no router placed has its category only now, so meta is sent again
+                events.append(("meta", {"category": final_state.get("category"), "cached": False}))
+                events.append(("answer", {"answer": final_state["answer"]}))
+                events.append(("followups", {"followupQuestions": final_state.get("followupQuestions") or []}))
+        return events
+
+    @staticmethod
+    def _done_event(started: float, first_token_at: Optional[float], session_id: Optional[str] = None,
+                    skipped: Optional[List[Dict[str, str]]] = None) -> Tuple[str, Dict[str, Any]]:
+        if first_token_at:
+            metrics.STAGE_SECONDS.observe(first_token_at - started, "answer_first_token")
+        timings = {
+            "ttftMs": round((first_token_at - started) * 1000, 1) if first_token_at else None,
+            "totalMs": round((time.perf_counter() - started) * 1000, 1),
+        }
+        logger.info(f"Streamed answer: time to first token {timings['ttftMs']} ms, total {timings['totalMs']} ms")
+        data: Dict[str, Any] = {"timings": timings}
+        if skipped:
+            data["skippedStages"] = skipped
+        if session_id:
+            data["sessionId"] = session_id
+        return "done", data
+
+    def stream_answer(
+        self,
+        question: str,
+        category: Optional[str] = None,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        session_id: Optional[str] = None,
+        context_tokens: Optional[int] = None
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Run the graph and yield ``(event, data)`` pairs as soon as each is
+        available: ``meta`` once retrieval is done, ``token`` for every chunk
+        of the answer, ``answer`` with the full text once it is complete,
+        ``followups`` when that node finishes and ``done`` with the request
+        timings (including time to first token) and any ``skippedStages``.
+        """
+        started = time.perf_counter()
+        self._ensure_started()
+        first_token_at = None
+        skipped = None
+        context = self.conversation_context(session_id, conversation_history)
+        cached = None if context else self._cache_get(question, category)
+        if cached is not None:
+            first_token_at = time.perf_counter()
+            yield from self._cached_events(cached, category)
+            self._record(question, session_id, cached)
+        else:
+            state = self._new_state(question, category, conversation_history, context, context_tokens,
+                                    deadline=started + REQUEST_BUDGET_SECONDS, streaming=True)
+            final_state: Dict[str, Any] = {}
+            for mode, payload in self.executor.stream(state, stream_mode=["updates", "messages"]):
+                for event, data in self._stream_events(mode, payload, final_state):
+                    if event == "answer" and first_token_at is None and data["answer"]:
+                        # A fallback answer is not streamed; send it whole so clients show (and speak) it
+                        first_token_at = time.perf_counter()
+                        yield "token", {"text": data["answer"]}
+                    if event == "token" and first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    yield event, data
+            self._finish(question, category, final_state, session_id, context)
+            skipped = final_state.get("skippedStages")
+        yield self._done_event(started, first_token_at, session_id, skipped)
+
+    async def astream_answer(
+        self,
+        question: str,
+        category: Optional[str] = None,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        session_id: Optional[str] = None,
+        context_tokens: Optional[int] = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Non-blocking ``stream_answer`` for the async serving mode.
+        """
+        started = time.perf_counter()
+        await self._aensure_started()
+        first_token_at = None
+        skipped = None
+        context = self.conversation_context(session_id, conversation_history)
+        cached = None if context else await self._acache_get(question, category)
+        if cached is not None:
+            first_token_at = time.perf_counter()
+            for event in self._cached_events(cached, category):
+                yield event
+            self._record(question, session_id, cached)
+        else:
+            state = self._new_state(question, category, conversation_history, context, context_tokens,
+                                    deadline=started + REQUEST_BUDGET_SECONDS, streaming=True)
+            final_state: Dict[str, Any] = {}
+            async for mode, payload in self.executor.astream(state, stream_mode=["updates", "messages"]):
+                for event, data in self._stream_events(mode, payload, final_state):
+                    if event == "answer" and first_token_at is None and data["answer"]:
+                        first_token_at = time.perf_counter()
+                        yield "token", {"text": data["answer"]}
+                    if event == "token" and first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    yield event, data
+            self._finish(question, category, final_state, session_id, context)
+            skipped = final_state.get("skippedStages")
+        yield self._done_event(started, first_token_at, session_id, skipped)
 
 rag_agent = DiabetesRagAgent()
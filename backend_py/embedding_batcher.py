@@ -0,0 +1,104 @@
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 100))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 4))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", 5))
+EMBED_BACKOFF_SECONDS = float(os.getenv("EMBED_BACKOFF_SECONDS", 1.0))
+
+
+class EmbeddingBatcher:
+    """
+    Shared document-embedding batcher used during ingestion.
+
+    Texts submitted from any loader thread are packed into batches of
+    ``batch_size``; full batches are embedded right away on a pool of at most
+    ``concurrency`` workers, each batch retried with exponential backoff and
+    jitter.  ``flush()`` sends the last partial batch.
+    """
+
+    def __init__(self, embeddings, batch_size: int = EMBED_BATCH_SIZE,
+                 concurrency: int = EMBED_CONCURRENCY,
+                 max_retries: int = EMBED_MAX_RETRIES,
+                 backoff_seconds: float = EMBED_BACKOFF_SECONDS):
+        self.embeddings = embeddings
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency),
+                                        thread_name_prefix="embed")
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[str, Future]] = []
+        self.batches = 0
+        self.texts = 0
+        self.retries = 0
+        self.embed_seconds = 0.0
+
+    def submit(self, texts: List[str]) -> List[Future]:
+        """
+        Queue texts for embedding; each returned future resolves to a vector.
+        """
+        futures = [Future() for _ in texts]
+        with self._lock:
+            self._pending.extend(zip(texts, futures))
+            while len(self._pending) >= self.batch_size:
+                batch = self._pending[:self.batch_size]
+                self._pending = self._pending[self.batch_size:]
+                self._pool.submit(self._run, batch)
+        return futures
+
+    def flush(self) -> None:
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if batch:
+            self._pool.submit(self._run, batch)
+
+    def close(self) -> None:
+        self.flush()
+        self._pool.shutdown(wait=True)
+
+    def _run(self, batch: List[Tuple[str, Future]]) -> None:
+        texts = [text for text, _ in batch]
+        try:
+            vectors = self._embed_with_retry(texts)
+        except Exception as err:
+            for _, future in batch:
+                future.set_exception(err)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+    def _embed_with_retry(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                with metrics.vendor_call("gemini", "embed_documents"):
+                    vectors = self.embeddings.embed_documents(texts)
+            except Exception as err:
+                if attempt == self.max_retries:
+                    logger.error("Embedding batch of %d failed after %d attempts: %s",
+                                 len(texts), attempt + 1, err)
+                    raise
+                delay = self.backoff_seconds * (2 ** attempt) * (1 + random.random())
+                with self._lock:
+                    self.retries += 1
+                logger.warning("Embedding batch of %d failed (%s), retrying in %.1fs",
+                               len(texts), err, delay)
+                time.sleep(delay)
+                continue
+            # Counted once the batch is embedded, so retries of the same texts are not counted again
+            metrics.EMBEDDED_TEXTS.inc("documents", amount=len(texts))
+            with self._lock:
+                self.batches += 1
+                self.texts += len(texts)
+                self.embed_seconds += time.perf_counter() - started
+            return vectors
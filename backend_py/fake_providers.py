@@ -0,0 +1,365 @@
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from dataclasses import dataclass, asdict, replace
+from types import SimpleNamespace
+from typing import Optional, List, Dict, Any, AsyncIterator, Iterator
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Deterministic, network-free stand-ins for Gemini (chat + embeddings) and
+# ElevenLabs (STT + TTS), with configurable latency, used by benchmark.py.
+
+CATEGORY_KEYWORDS: Dict[str, List[str]] = {
+    "glucose": ["glucose", "sugar", "a1c", "hypoglycemia", "hyperglycemia", "low", "high", "check", "monitor", "cgm"],
+    "medication": ["metformin", "insulin", "medicine", "medication", "dose", "pill", "pills", "tablet", "injection", "side"],
+    "meal": ["eat", "food", "meal", "snack", "carbohydrate", "carbohydrates", "carbs", "diet", "plate", "alcohol", "exercise"],
+    "wellness": ["stress", "sleep", "mood", "feet", "foot", "eye", "eyes", "sick", "depression", "kidney"],
+}
+_WORD = re.compile(r"[a-z0-9]+")
+_TOKEN = re.compile(r"\S+\s*")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+# Fake recordings carry their transcript after this marker
+RECORDING_MAGIC = b"FAKEAUDIO\x00"
+
+
+@dataclass
+class LatencyProfile:
+    """
+    Upstream latency model for the fake providers.  Zero means instant.
+    """
+    llm_first_token_seconds: float = 0.0
+    llm_tokens_per_second: float = 0.0
+    embed_call_seconds: float = 0.0
+    embed_seconds_per_text: float = 0.0
+    stt_seconds: float = 0.0
+    stt_seconds_per_audio_second: float = 0.0
+    tts_first_chunk_seconds: float = 0.0
+    tts_chars_per_second: float = 0.0
+    # Every Nth chat call waits llm_stall_seconds longer for its first token: a latency tail
+    llm_stall_every: int = 0
+    llm_stall_seconds: float = 0.0
+
+    def scaled(self, factor: float) -> "LatencyProfile":
+        values = asdict(self)
+        for name, value in values.items():
+            if name.endswith("_every"):
+                continue
+            if name.endswith("_per_second"):
+                values[name] = value / factor if factor else 0.0
+            else:
+                values[name] = value * factor
+        return LatencyProfile(**values)
+
+
+PROFILES: Dict[str, LatencyProfile] = {
+    "instant": LatencyProfile(),
+    # Roughly what gemini-2.0-flash, embedding-001 and ElevenLabs turbo show from a nearby region
+    "realistic": LatencyProfile(
+        llm_first_token_seconds=0.35,
+        llm_tokens_per_second=180.0,
+        embed_call_seconds=0.12,
+        embed_seconds_per_text=0.002,
+        stt_seconds=0.3,
+        stt_seconds_per_audio_second=0.05,
+        tts_first_chunk_seconds=0.25,
+        tts_chars_per_second=400.0,
+    ),
+}
+PROFILES["slow"] = PROFILES["realistic"].scaled(3.0)
+# Realistic, but one chat call in ten stalls for 4 s
+PROFILES["tail"] = replace(PROFILES["realistic"], llm_stall_every=10, llm_stall_seconds=4.0)
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN.findall(text)
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def _rate_delay(count: int, per_second: float) -> float:
+    return count / per_second if per_second > 0 else 0.0
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering the agent's prompts deterministically: a
+    keyword-voted category, a few context sentences as the answer, a canned
+    followup and a conversation summary listing the questions asked, or all
+    three of the first as a JSON object when the prompt asks for one.
+    Streams word tokens at ``llm_tokens_per_second`` and reports rough token
+    usage (four characters a token in, one word a token out).
+    """
+
+    profile: LatencyProfile = LatencyProfile()
+    max_answer_words: int = 60
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def respond(self, messages: List[BaseMessage]) -> str:
+        system = messages[0].content if len(messages) > 1 else ""
+        prompt = messages[-1].content
+        if "JSON object" in system:
+            question = prompt.partition("\n\nQuestion: ")[2].split("\n\n", 1)[0]
+            return json.dumps({
+                "category": categorize(question),
+                "answer": answer(prompt, self.max_answer_words),
+                "followupQuestions": [followup(question)],
+            })
+        if "categorizing" in system:
+            return categorize(prompt)
+        if "follow-up" in system:
+            return followup(prompt)
+        if "running summary" in system:
+            return summarize(prompt)
+        return answer(prompt, self.max_answer_words)
+
+    def _first_token_delay(self) -> float:
+        every = self.profile.llm_stall_every
+        stall = self.profile.llm_stall_seconds if every and self.calls % every == 0 else 0.0
+        return self.profile.llm_first_token_seconds + stall
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = self.respond(messages)
+        self.calls += 1
+        time.sleep(self._first_token_delay()
+                   + _rate_delay(len(_tokens(text)), self.profile.llm_tokens_per_second))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(
+            content=text, usage_metadata=_usage(messages, text)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = self.respond(messages)
+        self.calls += 1
+        await asyncio.sleep(self._first_token_delay()
+                            + _rate_delay(len(_tokens(text)), self.profile.llm_tokens_per_second))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(
+            content=text, usage_metadata=_usage(messages, text)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        self.calls += 1
+        time.sleep(self._first_token_delay())
+        for token in _tokens(self.respond(messages)):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            time.sleep(_rate_delay(1, self.profile.llm_tokens_per_second))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        self.calls += 1
+        await asyncio.sleep(self._first_token_delay())
+        for token in _tokens(self.respond(messages)):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            await asyncio.sleep(_rate_delay(1, self.profile.llm_tokens_per_second))
+
+
+def _usage(messages: List[BaseMessage], text: str) -> Dict[str, int]:
+    prompt = sum(len(str(message.content)) for message in messages) // 4
+    completion = len(_tokens(text))
+    return {"input_tokens": prompt, "output_tokens": completion, "total_tokens": prompt + completion}
+
+
+def categorize(question: str) -> str:
+    words = set(_words(question))
+    scores = {category: len(words.intersection(keywords)) for category, keywords in CATEGORY_KEYWORDS.items()}
+    best = max(scores, key=scores.get)
+    return best if scores[best] else "general"
+
+
+def answer(prompt: str, max_words: int) -> str:
+    """
+    The context sentences sharing the most words with the question, in
+    document order, capped at ``max_words``.
+    """
+    context, _, rest = prompt.partition("\n\nQuestion: ")
+    context = context.split("Context information: ", 1)[-1]
+    question = rest.split("\n\n", 1)[0]
+    asked = set(_words(question))
+    sentences = [s.strip() for s in _SENTENCE.split(context.replace("\n", " ")) if s.strip()]
+    ranked = sorted(range(len(sentences)), key=lambda i: -len(asked.intersection(_words(sentences[i]))))
+    chosen, words = [], 0
+    for i in ranked:
+        length = len(sentences[i].split())
+        if chosen and words + length > max_words:
+            break
+        chosen.append(i)
+        words += length
+    body = " ".join(sentences[i] for i in sorted(chosen))
+    return f"{body} Please consult your healthcare provider for advice about your own care.".strip()
+
+
+def followup(prompt: str) -> str:
+    question = prompt.split("\n", 1)[0].replace("User question: ", "", 1)
+    return f"How does {categorize(question)} affect my daily routine?"
+
+
+def summarize(prompt: str) -> str:
+    summary, _, messages = prompt.partition("\n\nNew messages:\n")
+    summary = summary.replace("Current summary: ", "", 1).replace("(none)", "").strip()
+    asked = [line[len("User: "):] for line in messages.splitlines() if line.startswith("User: ")]
+    return " ".join(filter(None, [summary, *(f"The patient asked: {question}" for question in asked)]))
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Feature-hashing bag-of-words embeddings: stable across runs, similar
+    texts get similar vectors.
+    """
+
+    def __init__(self, profile: Optional[LatencyProfile] = None, dimensions: int = 256):
+        self.profile = profile or LatencyProfile()
+        self.dimensions = dimensions
+        self.model = f"fake-hashing-{dimensions}"
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.texts = 0
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in _words(text):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = float(np.linalg.norm(vector))
+        return (vector / norm if norm else vector).tolist()
+
+    def _delay(self, count: int) -> float:
+        with self._lock:
+            self.calls += 1
+            self.texts += count
+        return self.profile.embed_call_seconds + self.profile.embed_seconds_per_text * count
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self._delay(len(texts)))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self._delay(1))
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self._delay(len(texts)))
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(self._delay(1))
+        return self._vector(text)
+
+
+def fake_recording(text: str, bytes_per_second: int = 16000, words_per_second: float = 2.5) -> bytes:
+    """
+    A stand-in recording of ``text``: the transcript behind a marker, padded
+    to the size of real compressed speech of that length.
+    """
+    payload = RECORDING_MAGIC + text.encode("utf-8")
+    seconds = max(1.0, len(text.split()) / words_per_second)
+    return payload + b"\x00" * max(0, int(seconds * bytes_per_second) - len(payload))
+
+
+def _recording_text(audio: bytes) -> str:
+    if not audio.startswith(RECORDING_MAGIC):
+        return ""
+    return audio[len(RECORDING_MAGIC):].split(b"\x00", 1)[0].decode("utf-8")
+
+
+class _SpeechToText:
+    def __init__(self, owner: "FakeElevenLabs"):
+        self.owner = owner
+
+    def _transcribe(self, file) -> tuple:
+        audio = file.read()
+        seconds = len(audio) / self.owner.audio_bytes_per_second
+        delay = self.owner.profile.stt_seconds + self.owner.profile.stt_seconds_per_audio_second * seconds
+        return SimpleNamespace(text=_recording_text(audio)), delay
+
+    def convert(self, file, **kwargs):
+        result, delay = self._transcribe(file)
+        time.sleep(delay)
+        return result
+
+
+class _AsyncSpeechToText(_SpeechToText):
+    async def convert(self, file, **kwargs):
+        result, delay = self._transcribe(file)
+        await asyncio.sleep(delay)
+        return result
+
+
+class _TextToSpeech:
+    def __init__(self, owner: "FakeElevenLabs"):
+        self.owner = owner
+
+    def _chunks(self, text: str) -> List[bytes]:
+        # Same size as real 128 kbps speech of the text; the content is a digest of the text
+        size = int(len(text) / self.owner.chars_per_audio_second * self.owner.audio_bytes_per_second)
+        pattern = hashlib.sha256(text.encode("utf-8")).digest()
+        audio = (pattern * (size // len(pattern) + 1))[:max(size, 1)]
+        step = self.owner.chunk_bytes
+        return [audio[i:i + step] for i in range(0, len(audio), step)]
+
+    def _chunk_delay(self, chunk: bytes) -> float:
+        chars = len(chunk) / self.owner.audio_bytes_per_second * self.owner.chars_per_audio_second
+        return _rate_delay(chars, self.owner.profile.tts_chars_per_second)
+
+    def convert(self, text: str, **kwargs) -> Iterator[bytes]:
+        time.sleep(self.owner.profile.tts_first_chunk_seconds)
+        for chunk in self._chunks(text):
+            yield chunk
+            time.sleep(self._chunk_delay(chunk))
+
+
+class _AsyncTextToSpeech(_TextToSpeech):
+    async def convert(self, text: str, **kwargs) -> AsyncIterator[bytes]:
+        await asyncio.sleep(self.owner.profile.tts_first_chunk_seconds)
+        for chunk in self._chunks(text):
+            yield chunk
+            await asyncio.sleep(self._chunk_delay(chunk))
+
+
+class FakeElevenLabs:
+    """
+    Drop-in for the ``ElevenLabs`` client's ``speech_to_text.convert`` and
+    ``text_to_speech.convert``; ``asynchronous=True`` mimics ``AsyncElevenLabs``.
+    Transcripts come from ``fake_recording`` payloads.
+    """
+
+    def __init__(self, profile: Optional[LatencyProfile] = None, asynchronous: bool = False,
+                 audio_bytes_per_second: int = 16000, chars_per_audio_second: float = 15.0,
+                 chunk_bytes: int = 4096):
+        self.profile = profile or LatencyProfile()
+        self.audio_bytes_per_second = audio_bytes_per_second
+        self.chars_per_audio_second = chars_per_audio_second
+        self.chunk_bytes = chunk_bytes
+        if asynchronous:
+            self.speech_to_text = _AsyncSpeechToText(self)
+            self.text_to_speech = _AsyncTextToSpeech(self)
+        else:
+            self.speech_to_text = _SpeechToText(self)
+            self.text_to_speech = _TextToSpeech(self)
+
+
+def make_providers(profile: LatencyProfile) -> Dict[str, Any]:
+    """
+    One set of fake providers sharing ``profile``.
+    """
+    return {
+        "model": FakeChatModel(profile=profile),
+        "embeddings": FakeEmbeddings(profile),
+        "elevenlabs": FakeElevenLabs(profile),
+        "aelevenlabs": FakeElevenLabs(profile, asynchronous=True),
+    }
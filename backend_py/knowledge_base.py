@@ -0,0 +1,462 @@
+import os
+import json
+import contextlib
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Any, Tuple, Callable
+from urllib.parse import urlparse
+
+import chromadb
+from langchain_community.document_loaders import WebBaseLoader
+from langchain_community.document_loaders.csv_loader import CSVLoader
+from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from langchain_community.vectorstores import Chroma
+from langchain_community.vectorstores.utils import filter_complex_metadata
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from embedding_batcher import EmbeddingBatcher
+from vector_snapshot import SnapshotVectorStore, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Where the per-category Chroma stores and manifests live between restarts.
+KB_PERSIST_DIR = os.getenv(
+    "KB_PERSIST_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "kb_store"),
+)
+# Remote sources already in the manifest are only re-fetched after this many
+# seconds; local files are re-checked on every start via their size/mtime.
+KB_REFRESH_SECONDS = int(os.getenv("KB_REFRESH_SECONDS", 7 * 24 * 3600))
+# Concurrent source fetches overall, and against any single host.
+KB_LOAD_WORKERS = int(os.getenv("KB_LOAD_WORKERS", 8))
+KB_PER_HOST_LIMIT = int(os.getenv("KB_PER_HOST_LIMIT", 2))
+
+MANIFEST_VERSION = 1
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+UPSERT_BATCH_SIZE = 1000
+
+
+def content_hash(text: str) -> str:
+    """
+    Stable sha256 hex digest of a piece of text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def is_local_source(source: str) -> bool:
+    return not source.startswith(("http://", "https://"))
+
+
+def make_loader(source: str):
+    """
+    Pick the document loader for a source, based on its extension.
+    """
+    if source.endswith(".pdf"):
+        return PyPDFLoader(source)
+    if source.endswith(".csv"):
+        return CSVLoader(source)
+    if source.endswith((".txt", ".md")):
+        return TextLoader(source, encoding="utf-8")
+    return WebBaseLoader(source)
+
+
+def local_fingerprint(source: str) -> Optional[str]:
+    """
+    Cheap change detector for local files (size + mtime), None if missing.
+    """
+    try:
+        stat = os.stat(source)
+    except OSError:
+        return None
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class KnowledgeBase:
+    """
+    Persistent on-disk vector store per category with content-hash manifests.
+
+    Each category directory holds a Chroma collection and a ``manifest.json``
+    recording, per source, the hash of its loaded content and the ids of the
+    chunks it produced.  Chunk ids are content hashes, so on a changed source
+    only chunks whose text actually changed are embedded again.  A category
+    can also be exported to a memory-mapped ``snapshot/`` (see
+    ``vector_snapshot``), reopened without Chroma while the manifest matches.
+    """
+
+    def __init__(self, embeddings, persist_dir: str = KB_PERSIST_DIR,
+                 refresh_seconds: int = KB_REFRESH_SECONDS,
+                 load_workers: int = KB_LOAD_WORKERS,
+                 per_host_limit: int = KB_PER_HOST_LIMIT):
+        self.embeddings = embeddings
+        self.persist_dir = persist_dir
+        self.refresh_seconds = refresh_seconds
+        self.load_workers = max(1, load_workers)
+        self.per_host_limit = max(1, per_host_limit)
+        self._host_lock = threading.Lock()
+        self._host_semaphores: Dict[str, threading.Semaphore] = {}
+        self._change_listeners: List[Callable[[List[str]], None]] = []
+        self.embedding_model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+        )
+
+    # ------------------------------------------------------------------ paths
+    def _category_dir(self, category: str) -> str:
+        return os.path.join(self.persist_dir, category)
+
+    def _manifest_path(self, category: str) -> str:
+        return os.path.join(self._category_dir(category), "manifest.json")
+
+    # --------------------------------------------------------------- manifest
+    def _new_manifest(self) -> Dict[str, Any]:
+        return {
+            "version": MANIFEST_VERSION,
+            "embedding_model": self.embedding_model,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "sources": {},
+        }
+
+    def _manifest_compatible(self, manifest: Dict[str, Any]) -> bool:
+        expected = self._new_manifest()
+        return all(
+            manifest.get(key) == expected[key]
+            for key in ("version", "embedding_model", "chunk_size", "chunk_overlap")
+        )
+
+    def load_manifest(self, category: str) -> Dict[str, Any]:
+        path = self._manifest_path(category)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return self._new_manifest()
+        except (OSError, ValueError) as err:
+            logger.warning("Unreadable manifest %s, rebuilding: %s", path, err)
+            return self._new_manifest()
+
+    def save_manifest(self, category: str, manifest: Dict[str, Any]) -> None:
+        path = self._manifest_path(category)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    # ------------------------------------------------------------------ store
+    def _chroma_client(self, category: str):
+        # chromadb shares one system per path, so the store and the collection see the same data
+        return chromadb.PersistentClient(path=os.path.join(self._category_dir(category), "chroma"))
+
+    def open_store(self, category: str) -> Chroma:
+        return Chroma(
+            client=self._chroma_client(category),
+            collection_name=f"diabetes_{category}",
+            embedding_function=self.embeddings,
+        )
+
+    def open_collection(self, category: str):
+        """
+        The chromadb collection behind ``open_store``, for writing chunks
+        whose embeddings are already computed.
+        """
+        return self._chroma_client(category).get_or_create_collection(f"diabetes_{category}",
+                                                                       embedding_function=None)
+
+    # -------------------------------------------------------------- snapshots
+    def _snapshot_dir(self, category: str) -> str:
+        return os.path.join(self._category_dir(category), "snapshot")
+
+    def manifest_fingerprint(self, manifest: Dict[str, Any]) -> str:
+        """
+        Identity of the chunk set a manifest describes, for matching snapshots.
+        """
+        chunk_ids = sorted(chunk_id for entry in manifest["sources"].values()
+                           for chunk_id in entry.get("chunk_ids", []))
+        return content_hash("\n".join([self.embedding_model, *chunk_ids]))
+
+    def open_snapshot(self, category: str, sources: List[str]) -> Optional[SnapshotVectorStore]:
+        """
+        Map the category's snapshot if it matches the manifest and no source
+        is due for a re-fetch; None means a sync is needed.
+        """
+        manifest = self.load_manifest(category)
+        entries = manifest.get("sources", {})
+        if not self._manifest_compatible(manifest) or set(entries) != set(sources):
+            return None
+        if any(self._needs_fetch(source, entries[source]) for source in sources):
+            return None
+        snapshot = SnapshotVectorStore.open(self._snapshot_dir(category), self.embeddings)
+        if snapshot is None or snapshot.header.get("fingerprint") != self.manifest_fingerprint(manifest):
+            return None
+        return snapshot
+
+    def export_snapshot(self, category: str, store: Chroma) -> SnapshotVectorStore:
+        """
+        Write the synced Chroma collection of a category as its snapshot and
+        map it.
+        """
+        started = time.perf_counter()
+        data = store.get(include=["embeddings", "documents", "metadatas"])
+        header = write_snapshot(
+            self._snapshot_dir(category), data["ids"], data["embeddings"], data["documents"], data["metadatas"],
+            self.manifest_fingerprint(self.load_manifest(category)), self.embedding_model,
+        )
+        logger.info("Exported vector snapshot for category %s: %d chunks in %.2fs",
+                    category, header["count"], time.perf_counter() - started)
+        return SnapshotVectorStore.open(self._snapshot_dir(category), self.embeddings)
+
+    # ---------------------------------------------------------------- loading
+    def _needs_fetch(self, source: str, entry: Optional[Dict[str, Any]]) -> bool:
+        if entry is None:
+            return True
+        if is_local_source(source):
+            return local_fingerprint(source) != entry.get("fingerprint")
+        return time.time() - entry.get("fetched_at", 0) >= self.refresh_seconds
+
+    def load_source(self, source: str):
+        """
+        Load a source and return (documents, content hash of all pages).
+        """
+        if source.endswith(".csv"):
+            logger.info("Attempting to load CSV file: %s", source)
+        docs = make_loader(source).load()
+        digest = content_hash("\n\x00".join(doc.page_content for doc in docs))
+        return docs, digest
+
+    def split_source(self, source: str, docs) -> Dict[str, Any]:
+        """
+        Split loaded documents into chunks keyed by their content-hash id.
+        """
+        chunks = {}
+        for chunk in filter_complex_metadata(self.splitter.split_documents(docs)):
+            chunk_id = content_hash(f"{source}\x00{chunk.page_content}")
+            chunk.metadata["chunk_id"] = chunk_id
+            chunks.setdefault(chunk_id, chunk)
+        return chunks
+
+    def add_change_listener(self, callback: Callable[[List[str]], None]) -> None:
+        """
+        Register ``callback(changed_categories)``, called after any sync that
+        added or removed chunks (e.g. to invalidate answer caches).
+        """
+        self._change_listeners.append(callback)
+
+    # ------------------------------------------------------------------- sync
+    def sync_category(self, category: str, sources: List[str]):
+        """
+        Bring the persisted store for ``category`` in line with ``sources``.
+
+        Returns ``(store, changed)`` where ``changed`` tells whether any chunk
+        was added or removed.  An unchanged corpus makes no embedding calls.
+        """
+        results = self.sync_all({category: sources})
+        if category not in results:
+            raise RuntimeError(f"Failed to sync knowledge base category '{category}'")
+        return results[category]
+
+    def sync_all(self, sources_by_category: Dict[str, List[str]]) -> Dict[str, Tuple[Chroma, bool]]:
+        """
+        Sync several categories at once.
+
+        Sources of every category are fetched concurrently on a bounded pool
+        (at most ``per_host_limit`` at a time against one host), and their new
+        chunks stream into one shared ``EmbeddingBatcher`` as soon as each
+        source is split.  Categories that fail are logged and left out of the
+        returned ``{category: (store, changed)}`` mapping.
+        """
+        started = time.perf_counter()
+        syncs: Dict[str, _CategorySync] = {}
+        for category, sources in sources_by_category.items():
+            try:
+                syncs[category] = self._prepare_category(category, sources)
+            except Exception as error:
+                logger.error("Error preparing document category %s: %s", category, error)
+
+        batcher = EmbeddingBatcher(self.embeddings)
+        try:
+            jobs = {}
+            with ThreadPoolExecutor(max_workers=self.load_workers,
+                                    thread_name_prefix="kb-load") as pool:
+                for category, sync in syncs.items():
+                    for source in sync.sources:
+                        entry = sync.entries.get(source)
+                        if self._needs_fetch(source, entry):
+                            known_hash = entry.get("content_hash") if entry else None
+                            jobs[pool.submit(self._fetch_source, source, known_hash)] = (category, source)
+                for future in as_completed(jobs):
+                    category, source = jobs[future]
+                    try:
+                        fetched = future.result()
+                    except Exception as err:
+                        logger.warning("Failed to load a document source, keeping previous chunks: %s (%s)",
+                                       source, err)
+                        if source.endswith(".csv"):
+                            logger.error("Error loading CSV file: %s. Please check the file format and content.", source)
+                        continue
+                    self._stage_source(syncs[category], source, fetched, batcher)
+            batcher.flush()
+            fetched_at = time.perf_counter()
+
+            results = {}
+            for category, sync in syncs.items():
+                try:
+                    self._commit_category(sync)
+                    results[category] = (sync.store, sync.changed)
+                except Exception as error:
+                    logger.error("Error processing document category %s: %s", category, error)
+        finally:
+            batcher.close()
+
+        logger.info(
+            "Knowledge base sync: %d sources fetched in %.2fs, %d chunks embedded in %d batches "
+            "(%.2fs embedding time, %d retries), %.2fs total",
+            len(jobs), fetched_at - started, batcher.texts, batcher.batches,
+            batcher.embed_seconds, batcher.retries, time.perf_counter() - started
+        )
+        changed = [category for category, (_, was_changed) in results.items() if was_changed]
+        if changed:
+            for callback in self._change_listeners:
+                callback(changed)
+        return results
+
+    def _prepare_category(self, category: str, sources: List[str]) -> "_CategorySync":
+        manifest = self.load_manifest(category)
+        store = self.open_store(category)
+        if not self._manifest_compatible(manifest):
+            logger.info("Manifest for category '%s' is stale or missing, rebuilding", category)
+            existing = store.get(include=[])["ids"]
+            if existing:
+                store.delete(ids=existing)
+            manifest = self._new_manifest()
+
+        sync = _CategorySync(category=category, sources=list(sources), store=store,
+                             collection=self.open_collection(category), manifest=manifest)
+
+        # prune sources that were removed from DOCUMENT_SOURCES
+        for source in [s for s in sync.entries if s not in sync.sources]:
+            stale_ids = sync.entries.pop(source).get("chunk_ids", [])
+            if stale_ids:
+                store.delete(ids=stale_ids)
+            sync.changed = True
+            logger.info("Pruned %d chunks of removed source %s (category: %s)",
+                        len(stale_ids), source, category)
+        return sync
+
+    def _host_semaphore(self, source: str):
+        if is_local_source(source):
+            return contextlib.nullcontext()
+        host = urlparse(source).netloc
+        with self._host_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.Semaphore(self.per_host_limit)
+            return self._host_semaphores[host]
+
+    def _fetch_source(self, source: str, known_hash: Optional[str]) -> Dict[str, Any]:
+        """
+        Worker job: load one source and, if its content changed, split it.
+        """
+        with self._host_semaphore(source):
+            started = time.perf_counter()
+            docs, digest = self.load_source(source)
+        loaded = time.perf_counter()
+        chunks = None if digest == known_hash else self.split_source(source, docs)
+        logger.info("Loaded %s: %d pages in %.2fs, split in %.2fs",
+                    source, len(docs), loaded - started, time.perf_counter() - loaded)
+        return {"pages": len(docs), "content_hash": digest, "chunks": chunks}
+
+    def _stage_source(self, sync: "_CategorySync", source: str,
+                      fetched: Dict[str, Any], batcher: EmbeddingBatcher) -> None:
+        """
+        Diff a fetched source against the manifest and queue its new chunks.
+        """
+        if not fetched["pages"]:
+            logger.warning("No documents loaded from source: %s", source)
+        entry = sync.entries.get(source)
+        fingerprint = local_fingerprint(source) if is_local_source(source) else None
+        if fetched["chunks"] is None:
+            entry.update(fetched_at=time.time(), fingerprint=fingerprint)
+            logger.info("Source unchanged, skipping re-embed: %s", source)
+            return
+
+        chunks = fetched["chunks"]
+        old_ids = set(entry.get("chunk_ids", [])) if entry else set()
+        new_ids = [chunk_id for chunk_id in chunks if chunk_id not in old_ids]
+        sync.staged.append({
+            "source": source,
+            "chunks": chunks,
+            "new_ids": new_ids,
+            "removed_ids": sorted(old_ids - set(chunks)),
+            "vectors": batcher.submit([chunks[chunk_id].page_content for chunk_id in new_ids]),
+            "entry": {
+                "content_hash": fetched["content_hash"],
+                "fingerprint": fingerprint,
+                "fetched_at": time.time(),
+                "chunk_ids": list(chunks),
+            },
+        })
+
+    def _commit_category(self, sync: "_CategorySync") -> None:
+        """
+        Wait for the staged embeddings and write them, source by source.
+        """
+        for staged in sync.staged:
+            source = staged["source"]
+            try:
+                vectors = [future.result() for future in staged["vectors"]]
+            except Exception as err:
+                logger.warning("Embedding failed for %s, keeping previous chunks: %s", source, err)
+                continue
+            started = time.perf_counter()
+            if staged["removed_ids"]:
+                sync.store.delete(ids=staged["removed_ids"])
+            upsert_embedded(sync.collection, [staged["chunks"][chunk_id] for chunk_id in staged["new_ids"]],
+                            staged["new_ids"], vectors)
+            sync.entries[source] = staged["entry"]
+            sync.changed = sync.changed or bool(staged["new_ids"] or staged["removed_ids"])
+            self.save_manifest(sync.category, sync.manifest)
+            logger.info(
+                "✅ Synced %s (category: %s): %d chunks, %d embedded, %d removed, written in %.2fs",
+                source, sync.category, len(staged["chunks"]), len(staged["new_ids"]),
+                len(staged["removed_ids"]), time.perf_counter() - started
+            )
+        sync.staged = []
+        self.save_manifest(sync.category, sync.manifest)
+
+
+@dataclass
+class _CategorySync:
+    """
+    Working state of one category while ``KnowledgeBase.sync_all`` runs.
+    """
+    category: str
+    sources: List[str]
+    store: Chroma
+    collection: Any
+    manifest: Dict[str, Any]
+    changed: bool = False
+    staged: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        return self.manifest["sources"]
+
+
+def upsert_embedded(collection, docs, ids: List[str], vectors: List[List[float]]) -> None:
+    """
+    Write chunks whose embeddings were computed up front into a chromadb
+    collection.
+    """
+    for i in range(0, len(ids), UPSERT_BATCH_SIZE):
+        collection.upsert(
+            ids=ids[i:i + UPSERT_BATCH_SIZE],
+            embeddings=vectors[i:i + UPSERT_BATCH_SIZE],
+            documents=[doc.page_content for doc in docs[i:i + UPSERT_BATCH_SIZE]],
+            metadatas=[doc.metadata for doc in docs[i:i + UPSERT_BATCH_SIZE]],
+        )
@@ -0,0 +1,352 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Iterator, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Wall time one question may take through the graph; optional stages are
+# dropped and the answer falls back rather than run past it
+REQUEST_BUDGET_SECONDS = float(os.getenv("REQUEST_BUDGET_SECONDS", 20))
+# Longest a single upstream call may take (also capped by the request budget)
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", 15))
+ELEVENLABS_TIMEOUT_SECONDS = float(os.getenv("ELEVENLABS_TIMEOUT_SECONDS", 20))
+# Send a second, identical categorize/answer call when the first has not
+# returned after this long and take whichever finishes first; 0 disables hedging
+GEMINI_HEDGE_AFTER_SECONDS = float(os.getenv("GEMINI_HEDGE_AFTER_SECONDS", 0))
+# Consecutive failures (errors or timeouts) that open an upstream's circuit,
+# and how long it stays open before one probe call is let through
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", 30))
+# Upstream calls in flight at which optional stages are dropped
+DEGRADE_INFLIGHT_CALLS = int(os.getenv("DEGRADE_INFLIGHT_CALLS", 48))
+# Threads running blocking calls under a timeout (abandoned calls keep theirs until they return)
+BOUNDED_CALL_WORKERS = int(os.getenv("BOUNDED_CALL_WORKERS", 64))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpen(RuntimeError):
+    """
+    The upstream failed repeatedly and is not being called until its
+    cooldown has passed.
+    """
+
+    def __init__(self, upstream: str):
+        super().__init__(f"Circuit to {upstream} is open")
+        self.upstream = upstream
+
+
+class StageTimeout(TimeoutError):
+    """
+    An upstream call did not finish within its share of the request budget.
+    """
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker and load gauge for one upstream.
+
+    ``failures`` consecutive failures open the circuit: calls are refused
+    with ``CircuitOpen`` for ``cooldown`` seconds, then a single probe is let
+    through, whose outcome closes or reopens it.  A probe that ends without
+    an outcome (cancelled, or its stream closed early) is handed back with
+    ``release`` so the next call probes instead.  Calls in flight are
+    counted as the load signal for dropping optional stages.
+    """
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES,
+                 cooldown: float = BREAKER_COOLDOWN_SECONDS,
+                 degrade_inflight: int = DEGRADE_INFLIGHT_CALLS):
+        self.name = name
+        self.failure_threshold = max(1, failures)
+        self.cooldown = cooldown
+        self.degrade_inflight = degrade_inflight
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.inflight = 0
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.opened = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    @property
+    def is_open(self) -> bool:
+        """
+        Whether a call now would be refused.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at < self.cooldown
+            return self._probing
+
+    @property
+    def overloaded(self) -> bool:
+        return self.degrade_inflight > 0 and self.inflight >= self.degrade_inflight
+
+    def check(self) -> bool:
+        """
+        Raise ``CircuitOpen`` unless a call may go through now; True when
+        that call is the half-open probe.
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            if self.state != CLOSED:
+                self.rejected += 1
+                raise CircuitOpen(self.name)
+            return False
+
+    def release(self, probe: bool) -> None:
+        """
+        End a call that finished with neither a success nor a failure.  It
+        says nothing about the upstream, so only a probe's slot is freed.
+        """
+        if not probe:
+            return
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+
+    def success(self) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("Circuit to %s closed again", self.name)
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._probing = False
+
+    def failure(self, timeout: bool = False) -> None:
+        with self._lock:
+            self.failures += 1
+            self.timeouts += 1 if timeout else 0
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                    logger.warning("Circuit to %s opened after %d consecutive failures",
+                                   self.name, self.consecutive_failures)
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def _enter(self) -> None:
+        with self._lock:
+            self.inflight += 1
+            self.calls += 1
+
+    def _exit(self) -> None:
+        with self._lock:
+            self.inflight -= 1
+
+    def _hedged(self, won: bool = False) -> None:
+        with self._lock:
+            if won:
+                self.hedge_wins += 1
+            else:
+                self.hedged += 1
+
+    def stats(self) -> Dict[str, Any]:
+        is_open = self.is_open
+        with self._lock:
+            return {
+                "state": self.state,
+                "open": is_open,
+                "inflight": self.inflight,
+                "calls": self.calls,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "opened": self.opened,
+                "hedged": self.hedged,
+                "hedgeWins": self.hedge_wins,
+            }
+
+
+UPSTREAMS: Dict[str, CircuitBreaker] = {name: CircuitBreaker(name) for name in ("gemini", "elevenlabs")}
+
+_pool = ThreadPoolExecutor(max_workers=max(1, BOUNDED_CALL_WORKERS), thread_name_prefix="bounded-call")
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """
+    Seconds left until a ``time.perf_counter()`` deadline; None without one.
+    """
+    return None if deadline is None else deadline - time.perf_counter()
+
+
+def call_timeout(deadline: Optional[float], limit: float) -> float:
+    left = remaining(deadline)
+    return limit if left is None else min(limit, left)
+
+
+def bounded_call(fn: Callable[[], T], timeout: float, breaker: Optional[CircuitBreaker] = None,
+                 hedge_after: float = 0.0, name: str = "call") -> T:
+    """
+    Run the blocking ``fn`` with a ``timeout``, through ``breaker`` when
+    given.  With ``hedge_after`` a second ``fn`` starts if the first has not
+    returned by then, and the first to succeed wins.  A call that times out
+    is abandoned, not interrupted: its thread is freed when it returns.
+    Calls run in a copy of the caller's context, so LangChain callbacks
+    (and LangGraph token streaming) still see them.
+    """
+    if timeout <= 0:
+        raise StageTimeout(f"No time left for {name}")
+    if breaker is not None:
+        breaker.check()
+    end = time.perf_counter() + timeout
+
+    def run() -> T:
+        if breaker is None:
+            return fn()
+        breaker._enter()
+        try:
+            return fn()
+        finally:
+            breaker._exit()
+
+    futures = [_pool.submit(contextvars.copy_context().run, run)]
+    if 0 < hedge_after < timeout:
+        done, _ = wait(futures, timeout=hedge_after)
+        if not done and (breaker is None or not breaker.overloaded):
+            if breaker is not None:
+                breaker._hedged()
+            futures.append(_pool.submit(contextvars.copy_context().run, run))
+    pending, error = set(futures), None
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, end - time.perf_counter()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            if future.exception() is None:
+                if breaker is not None:
+                    breaker.success()
+                    if len(futures) > 1 and future is futures[1]:
+                        breaker._hedged(won=True)
+                return future.result()
+            error = future.exception()
+    if breaker is not None:
+        breaker.failure(timeout=error is None)
+    if error is not None:
+        raise error
+    raise StageTimeout(f"{name} did not finish within {timeout:.1f}s")
+
+
+async def abounded_call(make_call: Callable[[], Awaitable[T]], timeout: float,
+                        breaker: Optional[CircuitBreaker] = None,
+                        hedge_after: float = 0.0, name: str = "call") -> T:
+    """
+    Async ``bounded_call``: ``make_call()`` returns a new awaitable per
+    attempt, and attempts still running at the end are cancelled.
+    """
+    if timeout <= 0:
+        raise StageTimeout(f"No time left for {name}")
+    probe = breaker.check() if breaker is not None else False
+    loop = asyncio.get_running_loop()
+    end = loop.time() + timeout
+
+    async def run() -> T:
+        if breaker is None:
+            return await make_call()
+        breaker._enter()
+        try:
+            return await make_call()
+        finally:
+            breaker._exit()
+
+    tasks = [asyncio.ensure_future(run())]
+    try:
+        if 0 < hedge_after < timeout:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done and (breaker is None or not breaker.overloaded):
+                if breaker is not None:
+                    breaker._hedged()
+                tasks.append(asyncio.ensure_future(run()))
+        pending, error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, end - loop.time()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                if task.exception() is None:
+                    if breaker is not None:
+                        breaker.success()
+                        if len(tasks) > 1 and task is tasks[1]:
+                            breaker._hedged(won=True)
+                    return task.result()
+                error = task.exception()
+        if breaker is not None:
+            breaker.failure(timeout=error is None)
+        if error is not None:
+            raise error
+        raise StageTimeout(f"{name} did not finish within {timeout:.1f}s")
+    except asyncio.CancelledError:
+        # Cancelled from outside (a lost race, the request going away) before an outcome
+        if breaker is not None:
+            breaker.release(probe)
+        raise
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+@contextmanager
+def guarded(breaker: CircuitBreaker):
+    """
+    Pass one call through ``breaker`` when the client enforces its own
+    timeout: refused while the circuit is open, counted as a success or a
+    failure by how the block exits.
+    """
+    probe = breaker.check()
+    breaker._enter()
+    try:
+        yield
+    except Exception as err:
+        breaker.failure(timeout="timeout" in type(err).__name__.lower())
+        raise
+    except BaseException:
+        # Cancelled, or a stream closed by its consumer (GeneratorExit)
+        breaker.release(probe)
+        raise
+    else:
+        breaker.success()
+    finally:
+        breaker._exit()
+
+
+def guarded_stream(open_stream: Callable[[], Iterable[bytes]], breaker: CircuitBreaker) -> Iterator[bytes]:
+    """
+    ``guarded`` over a streamed response, from opening it to its last chunk.
+    ``open_stream`` is only called once ``breaker`` lets the call through,
+    so nothing is sent upstream while the circuit is open.
+    """
+    with guarded(breaker):
+        yield from open_stream()
+
+
+async def aguarded_stream(open_stream: Callable[[], AsyncIterable[bytes]],
+                          breaker: CircuitBreaker) -> AsyncIterator[bytes]:
+    with guarded(breaker):
+        async for chunk in open_stream():
+            yield chunk
@@ -0,0 +1,194 @@
+import os
+import re
+import math
+import logging
+import threading
+from collections import Counter
+from typing import Optional, List, Dict, Any, Iterable, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+# Rank constant of reciprocal-rank fusion; larger values flatten the rank curve
+RRF_K = int(os.getenv("RRF_K", 60))
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = set("""
+a about after all also an and any are as at be because been before but by can could do does did
+for from had has have how i if in into is it its me more most my no not of on or other our out
+should so some such than that the their them then there these they this to too up us very was
+we were what when where which while who why will with would you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens without stopwords, with a plain plural "s"
+    stripped so "tablets" matches "tablet".
+    """
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class _CategoryIndex:
+    """
+    BM25 postings of one category's chunks.  Each posting already holds the
+    term's BM25 weight in that chunk, so a query only sums postings.
+    """
+
+    def __init__(self, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]],
+                 k1: float, b: float):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        counts = [Counter(tokenize(text)) for text in texts]
+        lengths = np.asarray([sum(c.values()) for c in counts], dtype=np.float32)
+        avg_length = float(lengths.mean()) if len(lengths) else 0.0
+        norms = k1 * (1 - b + b * lengths / avg_length) if avg_length else np.full(len(texts), k1)
+        documents: Dict[str, List[int]] = {}
+        frequencies: Dict[str, List[int]] = {}
+        for row, counter in enumerate(counts):
+            for term, tf in counter.items():
+                documents.setdefault(term, []).append(row)
+                frequencies.setdefault(term, []).append(tf)
+        total = len(texts)
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for term, rows in documents.items():
+            rows = np.asarray(rows, dtype=np.int32)
+            tf = np.asarray(frequencies[term], dtype=np.float32)
+            idf = math.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+            self.postings[term] = (rows, idf * tf * (k1 + 1) / (tf + norms[rows]))
+
+    def search(self, terms: Iterable[str], k: int) -> List[Tuple[int, float]]:
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        hits = np.flatnonzero(scores)
+        if not len(hits):
+            return []
+        k = min(k, len(hits))
+        top = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.texts[row], metadata=dict(self.metadatas[row] or {}))
+
+
+class LexicalIndex:
+    """
+    In-process BM25 index over the same chunks as the per-category Chroma
+    stores.
+
+    ``fit`` reads the stored chunk texts (no embedding calls); ``search``
+    needs no embedding round trip, and ``classify`` lets the best-scoring
+    chunks of all categories vote, like ``QuestionRouter`` does with vectors.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, _CategoryIndex] = {}
+
+    @property
+    def is_ready(self) -> bool:
+        return bool(self._indexes)
+
+    def fit(self, vector_stores: Dict[str, Any]) -> None:
+        indexes = {}
+        for category, store in vector_stores.items():
+            index = self._build(category, store)
+            if index is not None:
+                indexes[category] = index
+        with self._lock:
+            self._indexes = indexes
+        logger.info("Lexical index built over %d chunks across %d categories",
+                    sum(len(index.ids) for index in indexes.values()), len(indexes))
+
+    def add(self, category: str, store) -> None:
+        """
+        Index (or re-index) one category, keeping the others.
+        """
+        index = self._build(category, store)
+        with self._lock:
+            indexes = dict(self._indexes)
+            if index is None:
+                indexes.pop(category, None)
+            else:
+                indexes[category] = index
+            self._indexes = indexes
+
+    def _build(self, category: str, store) -> Optional[_CategoryIndex]:
+        try:
+            data = store.get(include=["documents", "metadatas"])
+        except Exception as err:
+            logger.warning("Lexical index could not read chunks for '%s': %s", category, err)
+            return None
+        if not data["ids"]:
+            return None
+        return _CategoryIndex(data["ids"], data["documents"], data["metadatas"], self.k1, self.b)
+
+    def search(self, category: str, question: str, k: int = 3) -> List[Document]:
+        with self._lock:
+            index = self._indexes.get(category)
+        if index is None:
+            return []
+        return [index.document(row) for row, _ in index.search(tokenize(question), k)]
+
+    def classify(self, question: str, k: int = 10,
+                 min_confidence: float = 0.6) -> Tuple[Optional[str], float]:
+        """
+        Return ``(category, confidence)`` from the category share of the
+        BM25 score mass of the top ``k`` chunks overall; None below
+        ``min_confidence``.
+        """
+        with self._lock:
+            indexes = dict(self._indexes)
+        terms = tokenize(question)
+        hits = []
+        for category, index in indexes.items():
+            hits.extend((score, category) for _, score in index.search(terms, k))
+        hits.sort(reverse=True)
+        votes: Dict[str, float] = {}
+        for score, category in hits[:k]:
+            votes[category] = votes.get(category, 0.0) + score
+        total = sum(votes.values())
+        if total <= 0:
+            return None, 0.0
+        best = max(votes, key=votes.get)
+        confidence = votes[best] / total
+        if confidence < min_confidence:
+            return None, confidence
+        return best, confidence
+
+
+def chunk_key(doc: Document) -> str:
+    return (doc.metadata or {}).get("chunk_id") or doc.page_content
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, rrf_k: int = RRF_K) -> List[Document]:
+    """
+    Merge ranked result lists by summing ``1 / (rrf_k + rank)`` per chunk.
+    """
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = chunk_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ordered[:k]]
@@ -0,0 +1,407 @@
+import time
+import bisect
+import inspect
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any, AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, Tuple
+
+# In-process metrics rendered in the Prometheus text format on /metrics.
+# Every update is one dict lookup and a few additions under a per-metric
+# lock, cheap enough to leave on in production.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Tuple[Any, ...]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(str(label) for label in labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class CallbackGauge(_Metric):
+    """
+    Gauge (or counter) read at scrape time from ``callback()``, which returns
+    ``{label_values_tuple: value}``; used to export existing stats objects.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str],
+                 callback: Callable[[], Dict[Tuple[str, ...], float]], kind: str = "gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, tuple(map(str, key)))} {_number(value)}"
+                for key, value in sorted(self.callback().items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket..., count above the last bucket], sum
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        lines = []
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "diabe_stage_seconds", "Wall time of each pipeline stage (LangGraph nodes, STT, TTS).", ["stage"]))
+VENDOR_SECONDS = REGISTRY.register(Histogram(
+    "diabe_vendor_call_seconds", "Wall time of each upstream vendor call.", ["vendor", "operation"]))
+VENDOR_FIRST_BYTE_SECONDS = REGISTRY.register(Histogram(
+    "diabe_vendor_first_byte_seconds", "Time until a streamed vendor response yields its first chunk.",
+    ["vendor", "operation"]))
+VENDOR_ERRORS = REGISTRY.register(Counter(
+    "diabe_vendor_errors_total", "Upstream vendor calls that raised.", ["vendor", "operation"]))
+VENDOR_BYTES = REGISTRY.register(Counter(
+    "diabe_vendor_bytes_total", "Bytes sent to or received from upstream vendors.",
+    ["vendor", "operation", "direction"]))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "diabe_llm_tokens_total", "Chat-model tokens by node and direction.", ["node", "direction"]))
+EMBEDDED_TEXTS = REGISTRY.register(Counter(
+    "diabe_embedded_texts_total", "Texts embedded by the embedding model (retries not counted again).", ["operation"]))
+QUERY_EMBED_BATCH_SIZE = REGISTRY.register(Histogram(
+    "diabe_query_embed_batch_size", "Queries per coalesced query-embedding call.", [],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)))
+QUERY_EMBED_QUEUE_SECONDS = REGISTRY.register(Histogram(
+    "diabe_query_embed_queue_seconds", "Time a query waited for its embedding batch to be sent.", [],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)))
+PROMPT_CONTEXT_TOKENS = REGISTRY.register(Histogram(
+    "diabe_prompt_context_tokens", "Estimated tokens of retrieved context before and after packing.", ["phase"],
+    buckets=(64, 128, 256, 512, 768, 1024, 1536, 2048, 4096)))
+STRUCTURED_ANSWERS = REGISTRY.register(Counter(
+    "diabe_structured_answers_total", "Single structured generation calls by outcome (valid, invalid, failed).",
+    ["outcome"]))
+SKIPPED_STAGES = REGISTRY.register(Counter(
+    "diabe_skipped_stages_total", "Pipeline stages dropped or answered by a fallback, by reason.",
+    ["stage", "reason"]))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "diabe_http_request_seconds", "HTTP request duration including the streamed body.",
+    ["method", "route", "status"]))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "diabe_http_requests_in_flight", "HTTP requests currently being served.", ["route"]))
+
+
+def span(stage: str):
+    """
+    Context manager timing one pipeline stage into diabe_stage_seconds.
+    """
+    return STAGE_SECONDS.time(stage)
+
+
+def instrument(stage: str, func: Callable) -> Callable:
+    """
+    Wrap a (sync or async) function so each call records a stage span.
+    """
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with STAGE_SECONDS.time(stage):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with STAGE_SECONDS.time(stage):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def vendor_call(vendor: str, operation: str):
+    """
+    Time one blocking or awaited vendor call and count its failures.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        VENDOR_ERRORS.inc(vendor, operation)
+        raise
+    finally:
+        VENDOR_SECONDS.observe(time.perf_counter() - started, vendor, operation)
+
+
+def record_usage(node: str, message) -> None:
+    """
+    Count the prompt and completion tokens reported on a chat response.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    if usage.get("input_tokens"):
+        LLM_TOKENS.inc(node, "input", amount=usage["input_tokens"])
+    if usage.get("output_tokens"):
+        LLM_TOKENS.inc(node, "output", amount=usage["output_tokens"])
+
+
+def timed_stream(chunks: Iterable[bytes], vendor: str, operation: str) -> Iterator[bytes]:
+    """
+    Pass a streamed vendor response through, recording time to first chunk,
+    total time and bytes received.
+    """
+    started = time.perf_counter()
+    received = 0
+    try:
+        for chunk in chunks:
+            if not received:
+                VENDOR_FIRST_BYTE_SECONDS.observe(time.perf_counter() - started, vendor, operation)
+            received += len(chunk)
+            yield chunk
+    except Exception:
+        VENDOR_ERRORS.inc(vendor, operation)
+        raise
+    finally:
+        VENDOR_SECONDS.observe(time.perf_counter() - started, vendor, operation)
+        VENDOR_BYTES.inc(vendor, operation, "in", amount=received)
+
+
+async def atimed_stream(chunks: AsyncIterable[bytes], vendor: str, operation: str) -> AsyncIterator[bytes]:
+    """
+    Async ``timed_stream``.
+    """
+    started = time.perf_counter()
+    received = 0
+    try:
+        async for chunk in chunks:
+            if not received:
+                VENDOR_FIRST_BYTE_SECONDS.observe(time.perf_counter() - started, vendor, operation)
+            received += len(chunk)
+            yield chunk
+    except Exception:
+        VENDOR_ERRORS.inc(vendor, operation)
+        raise
+    finally:
+        VENDOR_SECONDS.observe(time.perf_counter() - started, vendor, operation)
+        VENDOR_BYTES.inc(vendor, operation, "in", amount=received)
+
+
+def export_stats(name: str, documentation: str, labelname: str,
+                 sources: Dict[str, Callable[[], Dict[str, Any]]], field: str, kind: str = "gauge") -> None:
+    """
+    Export one numeric field of several ``stats()`` dicts as a labelled
+    metric, e.g. the hit ratio of every cache under ``cache="..."``.
+    """
+    def collect() -> Dict[Tuple[str, ...], float]:
+        return {(label,): stats()[field] for label, stats in sources.items()}
+    REGISTRY.register(CallbackGauge(name, documentation, [labelname], collect, kind=kind))
+
+
+def _route(path: str, routes: Optional[set]) -> str:
+    # Unknown paths share one label so 404 scans can't blow up the series count
+    return path if routes is None or path in routes else "other"
+
+
+class WSGIMetrics:
+    """
+    WSGI middleware recording in-flight requests and request duration,
+    measured until the (possibly streamed) response body is closed.
+    """
+
+    def __init__(self, wsgi_app, routes: Optional[set] = None):
+        self.wsgi_app = wsgi_app
+        self.routes = routes
+
+    def __call__(self, environ, start_response):
+        route = _route(environ.get("PATH_INFO", ""), self.routes)
+        method = environ.get("REQUEST_METHOD", "")
+        status = ["500"]
+        started = time.perf_counter()
+
+        def recording_start_response(status_line, headers, exc_info=None):
+            status[0] = status_line.split(" ", 1)[0]
+            return start_response(status_line, headers, exc_info)
+
+        HTTP_IN_FLIGHT.inc(route)
+        try:
+            body = self.wsgi_app(environ, recording_start_response)
+        except BaseException:
+            HTTP_IN_FLIGHT.dec(route)
+            HTTP_SECONDS.observe(time.perf_counter() - started, method, route, status[0])
+            raise
+        return _ClosingBody(body, lambda: (
+            HTTP_IN_FLIGHT.dec(route),
+            HTTP_SECONDS.observe(time.perf_counter() - started, method, route, status[0]),
+        ))
+
+
+class _ClosingBody:
+    """
+    Response body calling ``on_close`` once, when it is exhausted or closed.
+    """
+
+    def __init__(self, body, on_close: Callable[[], Any]):
+        self.body = body
+        self.on_close = on_close
+        self._closed = False
+
+    def __iter__(self):
+        try:
+            yield from self.body
+        finally:
+            self._finish()
+
+    def close(self):
+        try:
+            if hasattr(self.body, "close"):
+                self.body.close()
+        finally:
+            self._finish()
+
+    def _finish(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self.on_close()
+
+
+class ASGIMetrics:
+    """
+    ASGI counterpart of ``WSGIMetrics``.
+    """
+
+    def __init__(self, asgi_app, routes: Optional[set] = None):
+        self.asgi_app = asgi_app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.asgi_app(scope, receive, send)
+        route = _route(scope["path"], self.routes)
+        status = ["500"]
+        started = time.perf_counter()
+
+        async def recording_send(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(route)
+        try:
+            await self.asgi_app(scope, receive, recording_send)
+        finally:
+            HTTP_IN_FLIGHT.dec(route)
+            HTTP_SECONDS.observe(time.perf_counter() - started, scope["method"], route, status[0])
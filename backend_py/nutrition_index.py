@@ -0,0 +1,278 @@
+import re
+import csv
+import bisect
+import logging
+from collections import Counter
+from typing import Optional, List, Dict, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NAME_COLUMNS = ("name", "food", "food_name", "description", "shrt_desc", "item")
+# Share of non-empty cells that must parse as numbers for a column to be numeric
+NUMERIC_MIN_SHARE = 0.9
+# Leading comma-separated parts of a food name that name the food ("Fish, salmon");
+# the rest are descriptors ("farmed, cooked, dry heat") that never match on their own
+FOOD_NAME_SEGMENTS = 2
+# Nutrients listed for each matched food, when the table has them
+SUMMARY_NUTRIENTS = ("calories", "carbs", "sugar", "fiber", "protein", "fat", "sodium")
+# Question words naming a nutrient, and the column-name stems they resolve to
+NUTRIENT_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "calories": ("calorie", "energ", "kcal"),
+    "carbs": ("carbohydrate", "carb"),
+    "sugar": ("sugar",),
+    "fiber": ("fiber", "fibre"),
+    "protein": ("protein",),
+    "fat": ("total_fat", "fat"),
+    "sodium": ("sodium",),
+    "cholesterol": ("cholesterol",),
+}
+_NUTRIENT_WORDS = {
+    "calorie": "calories", "calories": "calories", "kcal": "calories", "energy": "calories",
+    "carb": "carbs", "carbs": "carbs", "carbohydrate": "carbs", "carbohydrates": "carbs",
+    "sugar": "sugar", "sugars": "sugar", "fiber": "fiber", "fibre": "fiber",
+    "protein": "protein", "proteins": "protein", "fat": "fat", "fats": "fat",
+    "sodium": "sodium", "salt": "sodium", "cholesterol": "cholesterol",
+}
+_COMPARATORS = {
+    "<": "<", "<=": "<", "under": "<", "below": "<", "less than": "<", "fewer than": "<", "at most": "<",
+    "no more than": "<", "max": "<",
+    ">": ">", ">=": ">", "over": ">", "above": ">", "more than": ">", "at least": ">", "min": ">",
+}
+_COMPARATOR = "|".join(sorted((re.escape(c) for c in _COMPARATORS), key=len, reverse=True))
+_NUTRIENT = "|".join(sorted(_NUTRIENT_WORDS, key=len, reverse=True))
+# "carbs < 15 g", "calories under 200" / "under 15 g of carbs", "less than 200 calories"
+_RANGE_AFTER = re.compile(rf"\b({_NUTRIENT})\b\s*(?:of\s+|is\s+|are\s+)?({_COMPARATOR})\s*(\d+(?:\.\d+)?)")
+_RANGE_BEFORE = re.compile(rf"({_COMPARATOR})\s*(\d+(?:\.\d+)?)\s*(?:[a-z]+\s+)?(?:of\s+)?({_NUTRIENT})\b")
+_VALUE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*([a-zA-Zµ]*)\s*$")
+_WORD = re.compile(r"[a-z]+")
+_STOPWORDS = set("""
+a an and are as at be can could do does for from give how i in is it its me much many my of on or
+per some than that the there this to what which with would you your food foods eat eating serving
+servings gram grams g mg mcg kcal have has contain contains content amount any good low high
+""".split())
+
+
+def _column_key(header: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", header.strip().lower()).strip("_")
+
+
+def _singular(word: str) -> str:
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("es") and word[:-2].endswith(("ch", "sh", "o", "x")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+class NutritionTable:
+    """
+    Columnar, in-memory view of the nutrition CSV.
+
+    Food names live in one array with a sorted lowercase copy for exact and
+    prefix lookup and an inverted word index; every numeric column is a
+    float32 array (NaN where missing), so range filters are vectorized.
+    Nothing here is embedded.
+    """
+
+    def __init__(self, names: List[str], columns: Dict[str, np.ndarray], units: Dict[str, str]):
+        self.names = np.asarray(names, dtype=object)
+        self.columns = columns
+        self.units = units
+        lowered = [name.lower() for name in names]
+        self._order = np.argsort(np.asarray(lowered, dtype=object), kind="stable")
+        self._sorted = [lowered[i] for i in self._order]
+        words: Dict[str, List[int]] = {}
+        food_words: Dict[str, List[int]] = {}
+        for row, name in enumerate(lowered):
+            for word in set(_WORD.findall(name)):
+                words.setdefault(_singular(word), []).append(row)
+            # "Fish, salmon, Atlantic, farmed, cooked": the food is named first, descriptors follow
+            for word in set(_WORD.findall(",".join(name.split(",")[:FOOD_NAME_SEGMENTS]))):
+                food_words.setdefault(_singular(word), []).append(row)
+        self._word_rows = {word: np.asarray(rows, dtype=np.int32) for word, rows in words.items()}
+        self._food_rows = {word: np.asarray(rows, dtype=np.int32) for word, rows in food_words.items()}
+        self._aliases = {alias: self._resolve(stems) for alias, stems in NUTRIENT_ALIASES.items()}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def from_csv(cls, path: str) -> "NutritionTable":
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            reader = csv.reader(f)
+            headers = [_column_key(h) for h in next(reader)]
+            rows = list(reader)
+        cells = list(zip(*rows)) if rows else [() for _ in headers]
+
+        parsed: Dict[str, Tuple[np.ndarray, str]] = {}
+        for key, values in zip(headers, cells):
+            column = _parse_numeric(values)
+            if column is not None:
+                parsed[key] = column
+        name_key = next((key for key in NAME_COLUMNS if key in headers and key not in parsed), None)
+        if name_key is None:
+            name_key = next((key for key in headers if key not in parsed and key), None)
+        if name_key is None:
+            raise ValueError(f"No food name column in {path}")
+        names = [value.strip() for value in cells[headers.index(name_key)]]
+        columns = {key: values for key, (values, _) in parsed.items() if key not in ("", "id", "index")}
+        units = {key: unit for key, (_, unit) in parsed.items() if key in columns}
+        logger.info("Nutrition table: %d foods, %d numeric columns from %s", len(names), len(columns), path)
+        return cls(names, columns, units)
+
+    # ---------------------------------------------------------------- columns
+    def _resolve(self, stems: Tuple[str, ...]) -> Optional[str]:
+        for stem in stems:
+            matches = [key for key in self.columns if key == stem or key.startswith(stem) or stem in key]
+            if matches:
+                return min(matches, key=len)
+        return None
+
+    def column(self, nutrient: str) -> Optional[str]:
+        """
+        Column holding a nutrient given by alias ("carbs") or column name.
+        """
+        if nutrient in self.columns:
+            return nutrient
+        return self._aliases.get(_NUTRIENT_WORDS.get(nutrient, nutrient))
+
+    # ---------------------------------------------------------------- lookups
+    def lookup(self, name: str) -> np.ndarray:
+        """
+        Rows whose name equals ``name``, ignoring case.
+        """
+        key = name.strip().lower()
+        start = bisect.bisect_left(self._sorted, key)
+        end = bisect.bisect_right(self._sorted, key)
+        return np.sort(self._order[start:end])
+
+    def prefix(self, prefix: str, limit: Optional[int] = None) -> np.ndarray:
+        """
+        Rows whose name starts with ``prefix``, ignoring case, in name order.
+        """
+        key = prefix.strip().lower()
+        start = bisect.bisect_left(self._sorted, key)
+        end = bisect.bisect_left(self._sorted, key + "\uffff")
+        if limit is not None:
+            end = min(end, start + limit)
+        return self._order[start:end]
+
+    def filter(self, ranges: Dict[str, Tuple[Optional[float], Optional[float]]],
+               rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Rows (of ``rows``, default all) with every nutrient within its
+        inclusive ``(low, high)`` range; either bound may be None.  Missing
+        values never match.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for nutrient, (low, high) in ranges.items():
+            key = self.column(nutrient)
+            if key is None:
+                raise KeyError(f"Unknown nutrient: {nutrient}")
+            values = self.columns[key]
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+        if rows is not None:
+            return rows[mask[rows]]
+        return np.flatnonzero(mask)
+
+    def match_words(self, text: str) -> np.ndarray:
+        """
+        Rows whose names contain every food word of ``text`` (stopwords and
+        nutrient words ignored), shortest names first.  A row only matches
+        if ``text`` names its food (a word of the first FOOD_NAME_SEGMENTS
+        parts of its name), so a word shared with a descriptor ("long-grain",
+        "dry heat") matches nothing.  When no row has every word, the rows
+        whose food ``text`` names are returned ("rice or bread").
+        """
+        words = [_singular(w) for w in _WORD.findall(text.lower())
+                 if w not in _STOPWORDS and w not in _NUTRIENT_WORDS and w not in _COMPARATORS]
+        words = [w for w in dict.fromkeys(words) if w in self._word_rows]
+        named = [self._food_rows[w] for w in words if w in self._food_rows]
+        if not named:
+            return np.empty(0, dtype=np.int32)
+        rows = self._word_rows[words[0]]
+        for word in words[1:]:
+            rows = np.intersect1d(rows, self._word_rows[word], assume_unique=True)
+        named = np.unique(np.concatenate(named))
+        rows = np.intersect1d(rows, named, assume_unique=True) if len(rows) else named
+        lengths = np.fromiter((len(self.names[i]) for i in rows), dtype=np.int32, count=len(rows))
+        return rows[np.argsort(lengths, kind="stable")]
+
+    def search(self, question: str, limit: int = 5) -> np.ndarray:
+        """
+        Rows answering a free-text question: foods it names, narrowed by any
+        nutrient ranges it states ("carbs < 15 g", "under 200 calories").
+        """
+        ranges = parse_ranges(question)
+        ranges = {nutrient: bounds for nutrient, bounds in ranges.items() if self.column(nutrient)}
+        rows = self.match_words(question)
+        if ranges:
+            rows = self.filter(ranges, rows if len(rows) else None)
+        return rows[:limit]
+
+    # ------------------------------------------------------------- formatting
+    def describe(self, row: int) -> str:
+        parts = []
+        for nutrient in SUMMARY_NUTRIENTS:
+            key = self.column(nutrient)
+            if key is None or np.isnan(self.columns[key][row]):
+                continue
+            unit = self.units.get(key) or ("kcal" if nutrient == "calories" else "")
+            parts.append(f"{nutrient} {self.columns[key][row]:g}{(' ' + unit) if unit else ''}")
+        serving = next((key for key in self.columns if key.startswith("serving")), None)
+        per = f" (per {self.columns[serving][row]:g} {self.units.get(serving) or 'g'})" if serving else ""
+        return f"{self.names[row]}{per}: {', '.join(parts)}"
+
+    def format_rows(self, rows: np.ndarray) -> str:
+        if not len(rows):
+            return ""
+        return "Nutrition facts:\n" + "\n".join(f"- {self.describe(int(row))}" for row in rows)
+
+
+def parse_ranges(question: str) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    """
+    Nutrient ranges stated in a question, as ``{nutrient: (low, high)}``.
+    """
+    text = question.lower()
+    found = [(nutrient, comparator, value) for nutrient, comparator, value in _RANGE_AFTER.findall(text)]
+    found += [(nutrient, comparator, value) for comparator, value, nutrient in _RANGE_BEFORE.findall(text)]
+    ranges: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+    for word, comparator, value in found:
+        nutrient = _NUTRIENT_WORDS[word]
+        low, high = ranges.get(nutrient, (None, None))
+        if _COMPARATORS[comparator] == "<":
+            high = float(value)
+        else:
+            low = float(value)
+        ranges[nutrient] = (low, high)
+    return ranges
+
+
+def _parse_numeric(values) -> Optional[Tuple[np.ndarray, str]]:
+    """
+    Parse a CSV column of numbers with optional unit suffixes ("9.17 g");
+    None if it is not numeric.
+    """
+    numbers = np.full(len(values), np.nan, dtype=np.float32)
+    units = Counter()
+    filled = parsed = 0
+    for i, value in enumerate(values):
+        if not value or not value.strip() or value.strip().lower() in ("nan", "na", "n/a", "-"):
+            continue
+        filled += 1
+        match = _VALUE.match(value)
+        if match:
+            numbers[i] = float(match.group(1))
+            parsed += 1
+            if match.group(2):
+                units[match.group(2)] += 1
+    if not filled or parsed < NUMERIC_MIN_SHARE * filled:
+        return None
+    return numbers, units.most_common(1)[0][0] if units else ""
@@ -0,0 +1,347 @@
+import os
+import csv
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Iterable
+from uuid import uuid4
+
+from answer_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+# Answer table the server consults before running the graph; missing means empty
+PRECOMPUTED_ANSWERS_PATH = os.getenv(
+    "PRECOMPUTED_ANSWERS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "precomputed_answers.jsonl"),
+)
+# Questions answered at once by the batch job
+PRECOMPUTE_CONCURRENCY = int(os.getenv("PRECOMPUTE_CONCURRENCY", 4))
+# Questions started per minute, to stay under the Gemini quota; 0 disables pacing
+PRECOMPUTE_RATE_PER_MINUTE = float(os.getenv("PRECOMPUTE_RATE_PER_MINUTE", 60))
+PRECOMPUTE_MAX_RETRIES = int(os.getenv("PRECOMPUTE_MAX_RETRIES", 5))
+PRECOMPUTE_BACKOFF_SECONDS = float(os.getenv("PRECOMPUTE_BACKOFF_SECONDS", 2.0))
+
+_RATE_LIMIT_MARKERS = ("429", "resource_exhausted", "rate limit", "ratelimit", "quota", "too many requests")
+
+
+class PrecomputedAnswers:
+    """
+    Table of answers computed offline by ``precompute_answers``.
+
+    Entries are appended to a JSONL file as they are computed, so the file
+    doubles as the job's checkpoint; a later line for the same question
+    replaces an earlier one.  Lookups match on the normalized question.
+    Each entry records the knowledge-base fingerprint of its category, and
+    entries whose category has changed since are not served.
+    """
+
+    def __init__(self, path: Optional[str] = PRECOMPUTED_ANSWERS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        # category -> current knowledge-base fingerprint; nothing is served until validate()
+        self._fingerprints: Optional[Dict[str, str]] = None
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        skipped = 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self._entries[entry["key"]] = entry
+                except (ValueError, KeyError, TypeError):
+                    # A line cut short by an interrupted job
+                    skipped += 1
+        logger.info("Precomputed answers: %d entries from %s%s", len(self._entries), self.path,
+                    f" ({skipped} unreadable lines skipped)" if skipped else "")
+
+    # ---------------------------------------------------------------- serving
+    def validate(self, fingerprints: Dict[str, str]) -> None:
+        """
+        Set the current knowledge-base fingerprint of each category; entries
+        computed against another one stop being served.
+        """
+        with self._lock:
+            self._fingerprints = dict(fingerprints)
+            stale = sum(1 for entry in self._entries.values() if not self._is_current(entry))
+        if stale:
+            logger.info("Precomputed answers: %d of %d entries are stale", stale, len(self._entries))
+
+    def invalidate(self, categories: List[str]) -> None:
+        """
+        Stop serving the entries of categories whose knowledge base changed.
+        """
+        with self._lock:
+            if self._fingerprints is not None:
+                for category in categories:
+                    self._fingerprints.pop(category, None)
+
+    def _is_current(self, entry: Dict[str, Any]) -> bool:
+        if self._fingerprints is None:
+            return False
+        fingerprint = self._fingerprints.get(entry.get("category"))
+        return fingerprint is not None and fingerprint == entry.get("kbFingerprint")
+
+    def get(self, question: str, category: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is None or not self._is_current(entry)
+                    or (category is not None and category != entry.get("category"))):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return {"answer": entry["answer"], "followupQuestions": list(entry["followupQuestions"])}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "current": sum(1 for entry in self._entries.values() if self._is_current(entry)),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": self.hits / lookups if lookups else 0.0,
+            }
+
+    # ---------------------------------------------------------------- writing
+    def is_done(self, question: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(normalize_question(question))
+            return entry is not None and self._is_current(entry)
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        entry = {**entry, "key": normalize_question(entry["question"])}
+        with self._lock:
+            self._entries[entry["key"]] = entry
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+
+    def compact(self) -> None:
+        """
+        Rewrite the file with one line per question, dropping replaced lines.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            tmp_path = f"{self.path}.{uuid4().hex}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in self._entries.values():
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(tmp_path, self.path)
+
+
+def load_question_corpus(path: str, column: str = "question", limit: Optional[int] = None) -> List[str]:
+    """
+    Distinct questions of a text file (one per line) or a CSV file such as
+    MedQuAD (``column``), most frequent first, then in file order.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            questions = [row.get(column) or "" for row in csv.DictReader(f)]
+        else:
+            questions = f.readlines()
+    counts: Counter = Counter()
+    first: Dict[str, str] = {}
+    for question in questions:
+        question = question.strip()
+        key = normalize_question(question)
+        if key:
+            counts[key] += 1
+            first.setdefault(key, question)
+    ordered = sorted(first, key=lambda key: -counts[key])
+    return [first[key] for key in ordered[:limit]]
+
+
+class _Pacer:
+    """
+    Spaces job starts ``60 / rate_per_minute`` seconds apart; ``back_off``
+    pauses every worker after the provider pushed back.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def back_off(self, seconds: float) -> None:
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in _RATE_LIMIT_MARKERS)
+
+
+def _with_retry(call, pacer: _Pacer, max_retries: int, backoff_seconds: float, what: str):
+    for attempt in range(max_retries + 1):
+        pacer.wait()
+        try:
+            return call()
+        except Exception as err:
+            if attempt == max_retries:
+                raise
+            delay = backoff_seconds * (2 ** attempt) * (1 + random.random())
+            if _is_rate_limited(err):
+                # Everyone waits, not just this worker
+                pacer.back_off(delay)
+            logger.warning("%s failed (%s), retrying in %.1fs", what, err, delay)
+            time.sleep(delay)
+
+
+def precompute_answers(agent, questions: Iterable[str], table: Optional[PrecomputedAnswers] = None,
+                       concurrency: int = PRECOMPUTE_CONCURRENCY,
+                       rate_per_minute: float = PRECOMPUTE_RATE_PER_MINUTE,
+                       voice: bool = False, tts: bool = False,
+                       max_retries: int = PRECOMPUTE_MAX_RETRIES,
+                       backoff_seconds: float = PRECOMPUTE_BACKOFF_SECONDS) -> Dict[str, Any]:
+    """
+    Run each question through the agent's graph and add the answer and
+    followups to ``table`` (default ``agent.precomputed``).
+
+    Questions the table already answers for the current knowledge base are
+    skipped, so an interrupted run resumes where it stopped.  With ``voice``
+    the spoken variant the voice endpoints ask is computed too, with their
+    context budget; ``tts`` also synthesizes its audio into the TTS cache,
+    whole and sentence by sentence as the streaming endpoint requests it.
+    """
+    from context_packer import VOICE_CONTEXT_TOKENS
+
+    if not agent.is_initialized:
+        agent.preload_documents()
+    table = table if table is not None else agent.precomputed
+    voice = voice or tts
+    suffix = ""
+    if voice:
+        from voice_chat_api import SHORT_ANSWER_SUFFIX
+        suffix = SHORT_ANSWER_SUFFIX
+    knowledge_base = agent.knowledge_base
+    fingerprints = {category: knowledge_base.manifest_fingerprint(knowledge_base.load_manifest(category))
+                    for category in agent.vector_stores}
+    table.validate(fingerprints)
+
+    jobs = []
+    for question in questions:
+        question = question.strip()
+        if not question:
+            continue
+        jobs.append((question, False))
+        if voice:
+            jobs.append((f"{question}{suffix}", True))
+    pending = [(question, spoken) for question, spoken in jobs if not table.is_done(question)]
+    logger.info("Precomputing %d answers (%d already done)", len(pending), len(jobs) - len(pending))
+
+    pacer = _Pacer(rate_per_minute)
+    lock = threading.Lock()
+    counts = {"answered": 0, "failed": 0, "audio": 0}
+
+    def run(question: str, spoken: bool) -> None:
+        def answer():
+            state = agent._new_state(question, None, None, None, VOICE_CONTEXT_TOKENS if spoken else None)
+            final_state = agent.executor.invoke(state)
+            return type(state)(**final_state) if isinstance(final_state, dict) else final_state
+
+        try:
+            final_state = _with_retry(answer, pacer, max_retries, backoff_seconds, f"Answering '{question}'")
+            if not final_state.answer or final_state.needsMoreInfo:
+                raise RuntimeError("no answer from the knowledge base")
+            audio = _synthesize(final_state.answer, pacer, max_retries, backoff_seconds) if spoken and tts else []
+        except Exception as err:
+            logger.error("Could not precompute '%s': %s", question, err)
+            with lock:
+                counts["failed"] += 1
+            return
+        table.add({
+            "question": question,
+            "category": final_state.category,
+            "answer": final_state.answer,
+            "followupQuestions": final_state.followupQuestions or [],
+            "voice": spoken,
+            "audio": audio,
+            "kbFingerprint": fingerprints.get(final_state.category),
+            "createdAt": time.time(),
+        })
+        with lock:
+            counts["answered"] += 1
+            counts["audio"] += len(audio)
+            done = counts["answered"] + counts["failed"]
+        if done % 50 == 0:
+            logger.info("Precomputed %d of %d answers", done, len(pending))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="precompute") as pool:
+        for _ in pool.map(lambda job: run(*job), pending):
+            pass
+    table.compact()
+    return {
+        "questions": len(jobs),
+        "skipped": len(jobs) - len(pending),
+        **counts,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def _synthesize(answer: str, pacer: _Pacer, max_retries: int, backoff_seconds: float) -> List[str]:
+    """
+    Put the spoken answer into the TTS cache; returns the cache keys.
+    """
+    from voice_chat_api import (
+        TTS_LANGUAGE_CODE, TTS_MODEL_ID, TTS_OUTPUT_FORMAT, TTS_VOICE_ID,
+        audio_cache, spoken_texts, text_to_speech,
+    )
+
+    keys = []
+    for text in spoken_texts(answer):
+        _with_retry(lambda: text_to_speech(text), pacer, max_retries, backoff_seconds, "Synthesizing answer")
+        keys.append(audio_cache.key(text, TTS_VOICE_ID, TTS_MODEL_ID, TTS_OUTPUT_FORMAT, TTS_LANGUAGE_CODE))
+    return keys
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Precompute answers for a question corpus.")
+    parser.add_argument("questions", help="text file with one question per line, or a CSV such as medquad.csv")
+    parser.add_argument("--column", default="question", help="question column of a CSV corpus")
+    parser.add_argument("--limit", type=int, help="only the most frequent N questions")
+    parser.add_argument("--output", default=PRECOMPUTED_ANSWERS_PATH, help="answer table to write")
+    parser.add_argument("--concurrency", type=int, default=PRECOMPUTE_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=PRECOMPUTE_RATE_PER_MINUTE,
+                        help="questions started per minute (0 for no pacing)")
+    parser.add_argument("--voice", action="store_true", help="also answer the voice endpoints' variant")
+    parser.add_argument("--tts", action="store_true", help="also synthesize the spoken answers (implies --voice)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from diabetes_rag_agent import rag_agent
+
+    questions = load_question_corpus(args.questions, args.column, args.limit)
+    result = precompute_answers(rag_agent, questions, PrecomputedAnswers(args.output),
+                                concurrency=args.concurrency, rate_per_minute=args.rate,
+                                voice=args.voice, tts=args.tts)
+    logger.info("Precompute done: %s", json.dumps(result))
+    return 0 if not result["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import os
+import time
+import asyncio
+import inspect
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Tuple, Callable
+
+from langchain_core.embeddings import Embeddings
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# How long the first query of a batch waits for others to join it
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", 5))
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", 64))
+# Batched calls allowed in flight at once
+QUERY_EMBED_CONCURRENCY = int(os.getenv("QUERY_EMBED_CONCURRENCY", 4))
+# Recent query vectors kept in memory; 0 disables the cache
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 2048))
+
+
+class QueryEmbeddingBatcher(Embeddings):
+    """
+    Embeddings wrapper that coalesces concurrent ``embed_query`` calls.
+
+    Queries arriving within ``window_ms`` of the first one waiting (or until
+    ``max_batch`` are waiting) are embedded in one batched call and the
+    vectors handed back to each caller; identical queries in flight share
+    one slot.  An LRU of recent query vectors answers repeats without a
+    call.  ``embed_documents`` passes straight through, since ingestion has
+    its own ``EmbeddingBatcher``.
+
+    ``embeddings`` may also be a zero-argument factory, called on first use,
+    with ``model`` naming the model it will build.
+    """
+
+    def __init__(self, embeddings, window_ms: float = QUERY_BATCH_WINDOW_MS,
+                 max_batch: int = QUERY_BATCH_MAX_SIZE,
+                 concurrency: int = QUERY_EMBED_CONCURRENCY,
+                 cache_size: int = QUERY_CACHE_SIZE,
+                 model: Optional[str] = None):
+        lazy = callable(embeddings) and not isinstance(embeddings, Embeddings)
+        self._factory: Optional[Callable[[], Any]] = embeddings if lazy else None
+        self._embeddings = None if lazy else embeddings
+        self._query_kwargs: Optional[Dict[str, Any]] = None
+        # Seen by the knowledge-base manifest; the wrapper doesn't change the vectors
+        self.model = model or getattr(embeddings, "model", type(embeddings).__name__)
+        self.window = max(0.0, window_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self.cache_size = cache_size
+        self._client_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        # text -> (future, enqueued at); also holds texts whose batch is in flight
+        self._waiting: Dict[str, Tuple[Future, float]] = {}
+        self._queue: List[str] = []
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="query-embed")
+        self._collector: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.texts = 0
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            with self._client_lock:
+                if self._embeddings is None:
+                    self._embeddings = self._factory()
+        return self._embeddings
+
+    # ------------------------------------------------------------- Embeddings
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector, future = self._lookup(text)
+        return vector if future is None else future.result()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector, future = self._lookup(text)
+        return vector if future is None else await asyncio.wrap_future(future)
+
+    # ---------------------------------------------------------------- batching
+    def _lookup(self, text: str) -> Tuple[Optional[List[float]], Optional[Future]]:
+        with self._lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+                self.hits += 1
+                return vector, None
+            self.misses += 1
+            waiting = self._waiting.get(text)
+            if waiting is not None:
+                self.coalesced += 1
+                return None, waiting[0]
+            future = Future()
+            self._waiting[text] = (future, time.perf_counter())
+            self._queue.append(text)
+            if self._collector is None:
+                self._collector = threading.Thread(target=self._collect, name="query-embed-batcher", daemon=True)
+                self._collector.start()
+            self._wakeup.notify()
+        return None, future
+
+    def _collect(self) -> None:
+        while True:
+            with self._lock:
+                while not self._queue:
+                    self._wakeup.wait()
+                deadline = self._waiting[self._queue[0]][1] + self.window
+                while len(self._queue) < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._wakeup.wait(remaining)
+                batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+                now = time.perf_counter()
+                for text in batch:
+                    metrics.QUERY_EMBED_QUEUE_SECONDS.observe(now - self._waiting[text][1])
+            metrics.QUERY_EMBED_BATCH_SIZE.observe(len(batch))
+            self._pool.submit(self._run, batch)
+
+    def _run(self, batch: List[str]) -> None:
+        try:
+            vectors = self._embed_batch(batch)
+            error = None
+        except Exception as err:
+            logger.warning("Query embedding batch of %d failed: %s", len(batch), err)
+            vectors, error = None, err
+        with self._lock:
+            futures = [self._waiting.pop(text)[0] for text in batch]
+            if error is None:
+                self.batches += 1
+                self.texts += len(batch)
+                if self.cache_size > 0:
+                    for text, vector in zip(batch, vectors):
+                        self._cache[text] = vector
+                        self._cache.move_to_end(text)
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+        for i, future in enumerate(futures):
+            if error is None:
+                future.set_result(vectors[i])
+            else:
+                future.set_exception(error)
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        metrics.EMBEDDED_TEXTS.inc("query", amount=len(texts))
+        if len(texts) == 1:
+            with metrics.vendor_call("gemini", "embed_query"):
+                return [self.embeddings.embed_query(texts[0])]
+        if self._query_kwargs is None:
+            self._query_kwargs = _query_task_kwargs(self.embeddings)
+        with metrics.vendor_call("gemini", "embed_query_batch"):
+            return self.embeddings.embed_documents(texts, **self._query_kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": self.hits / lookups if lookups else 0.0,
+                "coalesced": self.coalesced,
+                "batches": self.batches,
+                "texts": self.texts,
+                "meanBatchSize": self.texts / self.batches if self.batches else 0.0,
+            }
+
+
+def _query_task_kwargs(embeddings) -> Dict[str, Any]:
+    """
+    Batches go through ``embed_documents``; ask for query-type vectors when
+    the provider distinguishes them (Gemini's ``task_type``).
+    """
+    try:
+        parameters = inspect.signature(embeddings.embed_documents).parameters
+    except (TypeError, ValueError):
+        return {}
+    return {"task_type": "RETRIEVAL_QUERY"} if "task_type" in parameters else {}
@@ -0,0 +1,98 @@
+import os
+import logging
+import threading
+from typing import Optional, List, Dict, Any, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ROUTER_K = int(os.getenv("ROUTER_K", 10))
+# Share of the k nearest chunks' similarity mass the winning category needs;
+# below it the router abstains and the LLM categorizes instead.
+ROUTER_MIN_CONFIDENCE = float(os.getenv("ROUTER_MIN_CONFIDENCE", 0.6))
+
+
+class QuestionRouter:
+    """
+    Local kNN question classifier over the knowledge-base chunk embeddings.
+
+    ``fit`` reads the already-stored chunk vectors of every category (no
+    embedding calls); ``classify`` embeds the question once and lets its
+    ``k`` nearest chunks vote for their category, weighted by similarity.
+    """
+
+    def __init__(self, embeddings, k: int = ROUTER_K,
+                 min_confidence: float = ROUTER_MIN_CONFIDENCE):
+        self.embeddings = embeddings
+        self.k = k
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._labels: Optional[np.ndarray] = None
+        self._categories: List[str] = []
+
+    @property
+    def is_ready(self) -> bool:
+        return self._matrix is not None
+
+    def fit(self, vector_stores: Dict[str, Any]) -> None:
+        categories, blocks, labels = [], [], []
+        for category, store in vector_stores.items():
+            try:
+                vectors = store.get(include=["embeddings"])["embeddings"]
+            except Exception as err:
+                logger.warning("Router could not read embeddings for '%s': %s", category, err)
+                continue
+            if vectors is None or len(vectors) == 0:
+                continue
+            categories.append(category)
+            blocks.append(_normalize(np.asarray(vectors, dtype=np.float32)))
+            labels.append(np.full(len(vectors), len(categories) - 1, dtype=np.int32))
+        with self._lock:
+            if blocks:
+                self._matrix = np.vstack(blocks)
+                self._labels = np.concatenate(labels)
+            else:
+                self._matrix = self._labels = None
+            self._categories = categories
+        logger.info("Question router fitted on %d chunks across %d categories",
+                    0 if self._matrix is None else len(self._matrix), len(categories))
+
+    def embed(self, question: str) -> List[float]:
+        return self.embeddings.embed_query(question)
+
+    async def aembed(self, question: str) -> List[float]:
+        return await self.embeddings.aembed_query(question)
+
+    def classify(self, question: str, vector: Optional[List[float]] = None) -> Tuple[Optional[str], float]:
+        """
+        Return ``(category, confidence)``; category is None when the router is
+        not fitted or the vote is below ``min_confidence``.
+        """
+        with self._lock:
+            matrix, labels, categories = self._matrix, self._labels, self._categories
+        if matrix is None:
+            return None, 0.0
+        if vector is None:
+            vector = self.embed(question)
+        query = _normalize(np.asarray(vector, dtype=np.float32)[None, :])[0]
+        scores = matrix @ query
+        k = min(self.k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        weights = np.clip(scores[top], 0, None)
+        votes = np.bincount(labels[top], weights=weights, minlength=len(categories))
+        total = float(votes.sum())
+        if total <= 0:
+            return None, 0.0
+        best = int(np.argmax(votes))
+        confidence = float(votes[best]) / total
+        if confidence < self.min_confidence:
+            return None, confidence
+        return categories[best], confidence
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
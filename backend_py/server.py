@@ -1,11 +1,26 @@
 import os
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from dotenv import load_dotenv
-from diabetes_rag_agent import rag_agent
-from voice_chat_api import voice_agent
+from diabetes_rag_agent import NotReady, rag_agent
+from voice_chat_api import voice_agent, stream_voice_agent, audio_cache
+from session_store import session_id_of
+from latency_control import BREAKER_COOLDOWN_SECONDS, UPSTREAMS, CircuitOpen
 import socket
+import metrics
 import base64
+import json
+from urllib.parse import quote
+from audio_transport import (
+    MAX_AUDIO_BYTES,
+    AudioPayloadTooLarge,
+    counted,
+    multipart_body,
+    primed,
+    read_audio_request,
+    transport_stats,
+    wants,
+)
 
 # Add this import:
 from flask_cors import CORS
@@ -19,6 +34,10 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 PORT = int(os.getenv("PORT", 5000))
+# Seconds clients are told to wait when the category they asked about is still loading
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", 5))
+# Whole-request cap; the legacy JSON integer-list audio encoding needs ~4x the audio size
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_REQUEST_BYTES", 5 * MAX_AUDIO_BYTES))
 
 allowed_origins = [
     "https://diabe-ai-buddy-frontend.onrender.com",
@@ -62,43 +81,162 @@ def answer_question():
     question = data.get('question')
     category = data.get('category')
     conversation_history = data.get('conversationHistory')
+    session_id = session_id_of(request, data)
     try:
         result = rag_agent.answer_question(
                 question=question,
             category=category,
-            conversation_history=conversation_history
+            conversation_history=conversation_history,
+            session_id=session_id
         )
         return jsonify(result), 200
+    except NotReady as e:
+        return not_ready(e)
     except Exception as e:
         logger.exception(f"Error processing question: {e}")
         return jsonify({'error': 'Failed to process the question.'}), 500
-    
-    
-@app.route('/api/answerQuestionWithAudio', methods=['POST'])
-def answer_question_with_audio():
+
+
+
+def format_sse(event: str, data) -> str:
+    """Serialize one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def not_ready_body(e: NotReady) -> dict:
+    return {'error': str(e), 'retryAfter': RETRY_AFTER_SECONDS, **rag_agent.readiness()}
+
+
+def not_ready(e: NotReady):
+    return jsonify(not_ready_body(e)), 503, {'Retry-After': str(RETRY_AFTER_SECONDS)}
+
+
+def unavailable_body(e: CircuitOpen) -> dict:
+    return {'error': f'{e.upstream} is unavailable', 'retryAfter': int(BREAKER_COOLDOWN_SECONDS)}
+
+
+def unavailable(e: CircuitOpen):
+    # An open circuit is retried after its cooldown, so clients need not come back sooner
+    return jsonify(unavailable_body(e)), 503, {'Retry-After': str(int(BREAKER_COOLDOWN_SECONDS))}
+
+
+def is_ready(readiness: dict, category) -> bool:
+    """
+    Whether ``category`` (or, without one, every category) has loaded.
+    Failed categories count: they are served, without documents.
+    """
+    if category:
+        return readiness['categories'].get(category, {}).get('state') in ('ready', 'failed')
+    return readiness['status'] != 'warming'
+
+
+@app.route('/api/answerQuestionStream', methods=['POST'])
+def answer_question_stream():
     data = request.get_json()
-    audio_bytes = data.get('audioBytes')
+    question = data.get('question')
     category = data.get('category')
     conversation_history = data.get('conversationHistory')
+    session_id = session_id_of(request, data)
+
+    def generate():
+        try:
+            for event, payload in rag_agent.stream_answer(
+                question=question,
+                category=category,
+                conversation_history=conversation_history,
+                session_id=session_id
+            ):
+                yield format_sse(event, payload)
+        except NotReady as e:
+            yield format_sse('error', not_ready_body(e))
+        except Exception as e:
+            logger.exception(f"Error streaming answer: {e}")
+            yield format_sse('error', {'error': 'Failed to process the question.'})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@app.route('/api/answerQuestionWithAudio', methods=['POST'])
+def answer_question_with_audio():
+    audio_bytes, category, conversation_history, session_id = read_audio_request(request)
     try:
+        # Binary replies stream the MP3 (straight from the TTS cache on a hit)
+        stream_audio = wants(request, 'multipart/form-data') or wants(request, 'audio/mpeg')
         # Get raw audio, follow-ups, and transcripts
         raw_audio, followups, question_text, answer_text = voice_agent(
             audio_bytes=audio_bytes,
             category=category,
-            conversation_history=conversation_history
+            conversation_history=conversation_history,
+            session_id=session_id,
+            stream_audio=stream_audio
         )
-        # Encode audio bytes to base64 string for JSON
-        audio_b64 = base64.b64encode(raw_audio).decode('utf-8')
-        return jsonify({
-            'audio': audio_b64,
+        if stream_audio:
+            # Starts TTS here: once the 200 and the first part are sent, a failure can only truncate the body
+            raw_audio = primed(raw_audio)
+        metadata = {
             'followups': followups,
             'question_text': question_text,
             'answer_text': answer_text
-        }), 200
+        }
+        if wants(request, 'multipart/form-data'):
+            # JSON metadata part + binary MP3 part, readable with Response.formData()
+            parts, content_type, _ = multipart_body(metadata, raw_audio)
+            return Response(counted(parts, len(audio_bytes)), content_type=content_type), 200
+        if wants(request, 'audio/mpeg'):
+            # Raw MP3 body with the metadata in percent-encoded headers
+            return Response(counted(raw_audio, len(audio_bytes)), mimetype='audio/mpeg', headers={
+                'X-Question-Text': quote(question_text),
+                'X-Answer-Text': quote(answer_text),
+                'X-Followups': quote(json.dumps(followups)),
+                'Access-Control-Expose-Headers': 'X-Question-Text, X-Answer-Text, X-Followups',
+            }), 200
+        # Encode audio bytes to base64 string for JSON
+        audio_b64 = base64.b64encode(raw_audio).decode('utf-8')
+        transport_stats.record(len(audio_bytes), len(audio_b64))
+        return jsonify({'audio': audio_b64, **metadata}), 200
+    except NotReady as e:
+        return not_ready(e)
+    except CircuitOpen as e:
+        return unavailable(e)
     except Exception as e:
         logger.exception(f"Error processing audio question: {e}")
         return jsonify({'error': 'Failed to process the audio question.'}), 500
 
+@app.route('/api/answerQuestionWithAudioStream', methods=['POST'])
+def answer_question_with_audio_stream():
+    audio_bytes, category, conversation_history, session_id = read_audio_request(request)
+    transport_stats.record(len(audio_bytes))
+
+    def generate():
+        try:
+            for event, payload in stream_voice_agent(
+                audio_bytes=audio_bytes,
+                category=category,
+                conversation_history=conversation_history,
+                session_id=session_id
+            ):
+                if event == 'audio':
+                    # SSE is a text protocol, so each sentence's MP3 is sent base64 encoded
+                    payload = {**payload, 'audio': base64.b64encode(payload['audio']).decode('utf-8')}
+                yield format_sse(event, payload)
+        except NotReady as e:
+            yield format_sse('error', not_ready_body(e))
+        except CircuitOpen as e:
+            yield format_sse('error', unavailable_body(e))
+        except Exception as e:
+            logger.exception(f"Error streaming audio answer: {e}")
+            yield format_sse('error', {'error': 'Failed to process the audio question.'})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
 @app.route('/', methods=['GET'])
 def home():
     logger.info('GET / - Home route accessed')
@@ -110,14 +248,45 @@ def health():
     return jsonify({
         'status': 'OK',
         'timestamp': __import__('datetime').datetime.utcnow().isoformat() + 'Z',
-        'uptime': float(os.times()[4])
+        'uptime': float(os.times()[4]),
+        'knowledgeBase': rag_agent.readiness(),
+        'answerCache': rag_agent.answer_cache.stats(),
+        'precomputedAnswers': rag_agent.precomputed.stats(),
+        'audioTransport': transport_stats.snapshot(),
+        'ttsCache': audio_cache.stats(),
+        'queryEmbeddings': rag_agent.embeddings.stats(),
+        'sessions': rag_agent.sessions.stats(),
+        'upstreams': {name: breaker.stats() for name, breaker in UPSTREAMS.items()},
     }), 200
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    # A probe also starts the warmup when nothing else did (e.g. under gunicorn)
+    rag_agent.start_warmup()
+    readiness = rag_agent.readiness()
+    return jsonify(readiness), 200 if is_ready(readiness, request.args.get('category')) else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.errorhandler(404)
 def not_found(e):
     logger.warning(f'404 - Route not found: {request.method} {request.url}')
     return jsonify({'error': 'Route not found'}), 404
 
+@app.errorhandler(400)
+def bad_request(e):
+    logger.warning(f'400 - Bad request: {request.method} {request.url}: {e.description}')
+    return jsonify({'error': 'Bad request', 'message': e.description}), 400
+
+@app.errorhandler(413)
+@app.errorhandler(AudioPayloadTooLarge)
+def payload_too_large(e):
+    transport_stats.record_rejected()
+    logger.warning(f'413 - Payload too large: {request.method} {request.url}')
+    return jsonify({'error': 'Audio payload too large', 'maxAudioBytes': MAX_AUDIO_BYTES}), 413
+
 @app.errorhandler(Exception)
 def handle_exception(e):
     logger.exception('Global error handler:')
@@ -126,18 +295,43 @@ def handle_exception(e):
         'message': str(e) if os.getenv('FLASK_ENV') == 'development' else None
     }), 500
 
-def preload_documents():
-    logger.info('Preloading diabetes documents and vector stores...')
-    rag_agent.preload_documents()
-    logger.info('Documents loaded.')
+def _hit_ratio(stats):
+    lookups = stats['hits'] + stats['misses']
+    return stats['hits'] / lookups if lookups else 0.0
+
+# Cache and transport counters kept by their own stats objects, read at scrape time
+_cache_stats = {'answer': lambda: rag_agent.answer_cache.stats(), 'tts': lambda: audio_cache.stats(),
+                'query_embedding': lambda: rag_agent.embeddings.stats(),
+                'precomputed_answer': lambda: rag_agent.precomputed.stats()}
+metrics.export_stats('diabe_cache_hits_total', 'Cache hits.', 'cache', _cache_stats, 'hits', kind='counter')
+metrics.export_stats('diabe_cache_misses_total', 'Cache misses.', 'cache', _cache_stats, 'misses', kind='counter')
+metrics.export_stats('diabe_cache_hit_ratio', 'Cache hits over lookups since start.', 'cache',
+                     {name: (lambda stats=stats: {'ratio': _hit_ratio(stats())}) for name, stats in _cache_stats.items()},
+                     'ratio')
+metrics.export_stats('diabe_audio_transport_bytes_total', 'Audio bytes received and sent by the voice endpoints.',
+                     'direction', {'in': lambda: {'bytes': transport_stats.snapshot()['bytesIn']},
+                                   'out': lambda: {'bytes': transport_stats.snapshot()['bytesOut']}},
+                     'bytes', kind='counter')
+metrics.export_stats('diabe_category_ready', 'Whether the knowledge base of a category has loaded (1) or not (0).',
+                     'category', {category: (lambda category=category: {
+                         'ready': int(rag_agent.category_state[category]['state'] == 'ready')})
+                         for category in rag_agent.category_state},
+                     'ready')
+metrics.export_stats('diabe_circuit_open', 'Whether calls to an upstream are being refused (1) or not (0).',
+                     'upstream', {name: breaker.stats for name, breaker in UPSTREAMS.items()}, 'open')
+metrics.export_stats('diabe_hedged_calls_total', 'Second calls sent because the first was slow.',
+                     'upstream', {name: breaker.stats for name, breaker in UPSTREAMS.items()}, 'hedged',
+                     kind='counter')
+app.wsgi_app = metrics.WSGIMetrics(app.wsgi_app, {rule.rule for rule in app.url_map.iter_rules()})
+
+def start_warmup():
+    logger.info('Loading diabetes documents and vector stores in the background; see /ready')
+    rag_agent.start_warmup()
 
 if __name__ == '__main__':
-    try:
-        preload_documents()
-        print("Preloading documents...")
-    except Exception as err:
-        logger.error(f'Failed to preload documents: {err}')
-        exit(1)
+    # The debug reloader's parent process only watches files; the child it starts serves
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_warmup()
     local_ips = get_local_ips()
     logger.info('\nServer is running on:')
     logger.info(f'• Local:            http://localhost:{PORT}')
@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Optional, List, Dict, Any, Callable
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+# Sessions kept in memory; older ones are dropped (or reloaded from disk)
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", 10000))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", 7 * 24 * 3600))
+# Optional directory persisting sessions across restarts; empty keeps them in memory only
+SESSION_STORE_DIR = os.getenv("SESSION_STORE_DIR", "")
+# Most recent messages (user and assistant) kept verbatim; older ones are summarized
+SESSION_WINDOW_MESSAGES = int(os.getenv("SESSION_WINDOW_MESSAGES", 6))
+# Prompt tokens the conversation context may take in generate_answer, summary included
+SESSION_CONTEXT_TOKENS = int(os.getenv("SESSION_CONTEXT_TOKENS", 1024))
+SESSION_SUMMARY_TOKENS = int(os.getenv("SESSION_SUMMARY_TOKENS", 256))
+SESSION_SUMMARY_WORKERS = int(os.getenv("SESSION_SUMMARY_WORKERS", 2))
+
+ROLES = {"user": "User", "assistant": "Assistant"}
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; close enough for a budget
+    return (len(text) + 3) // 4
+
+
+def clip(text: str, tokens: int, keep: str = "head") -> str:
+    """
+    Cut ``text`` to about ``tokens`` tokens at a word boundary, keeping the
+    start (``head``) or the end (``tail``).
+    """
+    limit = max(0, tokens) * 4
+    if len(text) <= limit:
+        return text
+    if keep == "tail":
+        cut = text[len(text) - limit:]
+        return "..." + cut[cut.find(" ") + 1:] if " " in cut else cut
+    cut = text[:limit]
+    return (cut[:cut.rfind(" ")] if " " in cut else cut) + "..."
+
+
+def clean_history(history: Optional[List[Dict[str, Any]]]) -> List[Dict[str, str]]:
+    """
+    User and assistant messages of a client-supplied ``conversationHistory``.
+    """
+    messages = []
+    for message in history or []:
+        if not isinstance(message, dict):
+            continue
+        role, content = message.get("role"), message.get("content")
+        if role in ROLES and isinstance(content, str) and content.strip():
+            messages.append({"role": role, "content": content.strip()})
+    return messages
+
+
+def render_context(summary: str, messages: List[Dict[str, str]],
+                   budget: int = SESSION_CONTEXT_TOKENS,
+                   summary_budget: int = SESSION_SUMMARY_TOKENS) -> str:
+    """
+    Conversation context for the answer prompt, within ``budget`` tokens:
+    the summary (at most ``summary_budget``), then as many of the most
+    recent messages as fit, the oldest of them clipped to what is left.
+    """
+    summary = clip(summary, min(summary_budget, budget), keep="tail") if summary else ""
+    # Leave room for the two headings
+    remaining = budget - estimate_tokens(summary) - 16
+    lines: List[str] = []
+    for message in reversed(messages):
+        line = f"{ROLES[message['role']]}: {message['content']}"
+        cost = estimate_tokens(line) + 1
+        if cost > remaining:
+            if remaining > 16:
+                lines.append(clip(line, remaining - 1))
+            break
+        lines.append(line)
+        remaining -= cost
+    parts = []
+    if summary:
+        parts.append(f"Summary of the earlier conversation: {summary}")
+    if lines:
+        parts.append("Recent messages:\n" + "\n".join(reversed(lines)))
+    return "\n\n".join(parts)
+
+
+@dataclass
+class Session:
+    session_id: str
+    summary: str = ""
+    # Recent messages kept verbatim, oldest first
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    # Messages pushed out of the window and not yet folded into the summary
+    overflow: List[Dict[str, str]] = field(default_factory=list)
+    turns: int = 0
+    updated_at: float = field(default_factory=time.time)
+
+
+class SessionStore:
+    """
+    Server-side conversation state keyed by session id.
+
+    Sessions live in an in-memory LRU of ``max_sessions``, optionally
+    written through to one JSON file per session under ``store_dir``.  Each
+    keeps the last ``window`` messages verbatim; older ones are folded into
+    a running summary by ``summarize(summary, messages) -> str`` on a small
+    background pool, so compaction never delays an answer.  ``context``
+    renders summary and window within the token budget.
+    """
+
+    def __init__(self, summarize: Optional[Callable[[str, List[Dict[str, str]]], str]] = None,
+                 store_dir: str = SESSION_STORE_DIR,
+                 max_sessions: int = SESSION_MAX_SESSIONS,
+                 ttl_seconds: float = SESSION_TTL_SECONDS,
+                 window: int = SESSION_WINDOW_MESSAGES,
+                 context_tokens: int = SESSION_CONTEXT_TOKENS,
+                 summary_tokens: int = SESSION_SUMMARY_TOKENS):
+        self.summarize = summarize
+        self.store_dir = store_dir
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.window = max(2, window)
+        self.context_tokens = context_tokens
+        self.summary_tokens = summary_tokens
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._compacting: set = set()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, SESSION_SUMMARY_WORKERS),
+                                        thread_name_prefix="session-summary")
+        self.loaded = 0
+        self.expired = 0
+        self.compactions = 0
+        self.compaction_failures = 0
+        if store_dir:
+            os.makedirs(store_dir, exist_ok=True)
+
+    # ---------------------------------------------------------------- access
+    def context(self, session_id: str) -> str:
+        with self._lock:
+            session = self._get(session_id)
+            if session is None:
+                return ""
+            summary = session.summary
+            # Messages awaiting compaction still count, oldest first, budget permitting
+            messages = session.overflow + session.messages
+        return render_context(summary, messages, self.context_tokens, self.summary_tokens)
+
+    def append(self, session_id: str, question: str, answer: str) -> None:
+        """
+        Record one question/answer turn and schedule compaction of whatever
+        no longer fits the window.
+        """
+        with self._lock:
+            session = self._get(session_id) or Session(session_id)
+            session.messages.append({"role": "user", "content": question})
+            session.messages.append({"role": "assistant", "content": answer})
+            session.turns += 1
+            session.updated_at = time.time()
+            if len(session.messages) > self.window:
+                cut = len(session.messages) - self.window
+                session.overflow.extend(session.messages[:cut])
+                session.messages = session.messages[cut:]
+            self._put(session)
+            schedule = bool(session.overflow) and session_id not in self._compacting
+            if schedule:
+                self._compacting.add(session_id)
+            snapshot = self._snapshot(session)
+        self._save(snapshot)
+        if schedule:
+            self._pool.submit(self._compact, session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "loaded": self.loaded,
+                "expired": self.expired,
+                "compactions": self.compactions,
+                "compactionFailures": self.compaction_failures,
+                "compacting": len(self._compacting),
+            }
+
+    # ------------------------------------------------------------- compaction
+    def _compact(self, session_id: str) -> None:
+        while True:
+            with self._lock:
+                session = self._get(session_id)
+                if session is None or not session.overflow:
+                    self._compacting.discard(session_id)
+                    return
+                summary, batch = session.summary, list(session.overflow)
+            try:
+                new_summary = self.summarize(summary, batch) if self.summarize else ""
+                failed = not new_summary
+            except Exception as err:
+                logger.warning("Summarizing session %s failed: %s", session_id, err)
+                failed = True
+            if failed:
+                # Keep the gist without the model: the questions asked, oldest dropped first
+                asked = "; ".join(m["content"] for m in batch if m["role"] == "user")
+                new_summary = f"{summary} Earlier questions: {asked}." if summary else f"Earlier questions: {asked}."
+            new_summary = clip(new_summary.strip(), self.summary_tokens, keep="tail")
+            with self._lock:
+                session = self._get(session_id)
+                if session is None:
+                    self._compacting.discard(session_id)
+                    return
+                session.summary = new_summary
+                session.overflow = session.overflow[len(batch):]
+                self.compactions += 1
+                self.compaction_failures += 1 if failed else 0
+                snapshot = self._snapshot(session)
+            self._save(snapshot)
+
+    # ---------------------------------------------------------------- storage
+    def _get(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._load(session_id)
+            if session is None:
+                return None
+            self.loaded += 1
+            self._put(session)
+        if time.time() - session.updated_at > self.ttl_seconds:
+            self.expired += 1
+            self._sessions.pop(session_id, None)
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _put(self, session: Session) -> None:
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    @staticmethod
+    def _snapshot(session: Session) -> Dict[str, Any]:
+        return asdict(session)
+
+    def _path(self, session_id: str) -> str:
+        # Session ids come from clients, so never use them as file names directly
+        name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.store_dir, f"{name}.json")
+
+    def _load(self, session_id: str) -> Optional[Session]:
+        if not self.store_dir:
+            return None
+        try:
+            with open(self._path(session_id), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as err:
+            logger.warning("Could not read session %s: %s", session_id, err)
+            return None
+        return Session(**data)
+
+    def _save(self, snapshot: Dict[str, Any]) -> None:
+        if not self.store_dir:
+            return
+        path = self._path(snapshot["session_id"])
+        tmp_path = f"{path}.{uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, path)
+        except OSError as err:
+            logger.warning("Could not write session %s: %s", snapshot["session_id"], err)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def session_id_of(request, fields: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    Session id a Flask or Quart request names: ``sessionId`` in its JSON body
+    or form ``fields``, the ``X-Session-Id`` header or the query string.
+    """
+    value = (fields or {}).get("sessionId") or request.headers.get("X-Session-Id") or request.args.get("sessionId")
+    if not isinstance(value, str) or not value.strip():
+        return None
+    return value.strip()[:128]
@@ -0,0 +1,71 @@
+import re
+from typing import List, Dict, Any, Iterable
+
+from pydantic import BaseModel, Field, ValidationError, ValidationInfo, field_validator
+
+# Followup questions kept from one structured answer
+MAX_FOLLOWUPS = 3
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+class InvalidStructuredAnswer(ValueError):
+    """
+    The model's reply is not a JSON object matching ``StructuredAnswer``.
+    """
+
+
+class StructuredAnswer(BaseModel):
+    """
+    Category, answer and followups returned together by the single
+    generation call.
+    """
+
+    category: str
+    answer: str
+    followupQuestions: List[str] = Field(default_factory=list)
+
+    @field_validator("category")
+    @classmethod
+    def _known_category(cls, value: str, info: ValidationInfo) -> str:
+        value = value.strip().lower()
+        categories = (info.context or {}).get("categories")
+        if categories and value not in categories:
+            raise ValueError(f"unknown category '{value}'")
+        return value
+
+    @field_validator("answer")
+    @classmethod
+    def _not_empty(cls, value: str) -> str:
+        value = value.strip()
+        if not value:
+            raise ValueError("empty answer")
+        return value
+
+    @field_validator("followupQuestions")
+    @classmethod
+    def _clean_followups(cls, value: List[str]) -> List[str]:
+        questions = [q.replace("**", "").strip() for q in value]
+        return [q for q in questions if q][:MAX_FOLLOWUPS]
+
+
+def response_schema(categories: Iterable[str]) -> Dict[str, Any]:
+    """
+    JSON schema of ``StructuredAnswer`` with the category limited to
+    ``categories``, for providers that constrain their output to one.
+    """
+    schema = StructuredAnswer.model_json_schema()
+    schema["properties"]["category"]["enum"] = list(categories)
+    schema["properties"]["followupQuestions"]["maxItems"] = MAX_FOLLOWUPS
+    return schema
+
+
+def parse_structured_answer(text: str, categories: Iterable[str]) -> StructuredAnswer:
+    """
+    Validate a model reply (a JSON object, possibly in a Markdown code
+    fence) against ``StructuredAnswer``.
+    """
+    try:
+        return StructuredAnswer.model_validate_json(_FENCE.sub("", text.strip()),
+                                                    context={"categories": list(categories)})
+    except ValidationError as err:
+        raise InvalidStructuredAnswer(str(err)) from err
@@ -0,0 +1,18 @@
+from typing import Any, Dict, List, Optional
+
+
+class FakeStore:
+    """
+    The slice of the Chroma store API that the indexes read: ``get``.
+    """
+
+    def __init__(self, documents: List[str], embeddings: Optional[List[List[float]]] = None,
+                 source: str = "test"):
+        self.documents = documents
+        self.embeddings = embeddings
+        self.ids = [f"{source}-{i}" for i in range(len(documents))]
+        self.metadatas = [{"source": source, "chunk_id": chunk_id} for chunk_id in self.ids]
+
+    def get(self, include: Optional[List[str]] = None) -> Dict[str, Any]:
+        return {"ids": self.ids, "documents": self.documents, "metadatas": self.metadatas,
+                "embeddings": self.embeddings}
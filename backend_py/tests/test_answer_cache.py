@@ -0,0 +1,41 @@
+import time
+
+from answer_cache import AnswerCache
+
+ANSWER = {"answer": "Eat regular meals.", "followupQuestions": ["What about snacks?"]}
+
+
+def test_hit_on_normalized_question_within_category():
+    cache = AnswerCache(max_entries=10)
+    cache.put("What should I eat?", "meal", ANSWER)
+    assert cache.get("  what should I EAT ", "meal") == ANSWER
+    assert cache.get("What should I eat?", "glucose") is None
+
+
+def test_returned_answers_are_copies():
+    cache = AnswerCache(max_entries=10)
+    cache.put("q", None, ANSWER)
+    cache.get("q")["followupQuestions"].append("mutated")
+    assert cache.get("q") == ANSWER
+
+
+def test_lru_eviction_by_entry_count():
+    cache = AnswerCache(max_entries=2)
+    cache.put("one", None, ANSWER)
+    cache.put("two", None, ANSWER)
+    cache.get("one")
+    cache.put("three", None, ANSWER)
+    assert cache.get("two") is None
+    assert cache.get("one") == ANSWER and cache.get("three") == ANSWER
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_and_invalidate_clears():
+    cache = AnswerCache(max_entries=10, ttl_seconds=0.05)
+    cache.put("q", None, ANSWER)
+    time.sleep(0.1)
+    assert cache.get("q") is None
+    cache = AnswerCache(max_entries=10)
+    cache.put("q", None, ANSWER)
+    cache.invalidate()
+    assert cache.get("q") is None and cache.stats()["bytes"] == 0
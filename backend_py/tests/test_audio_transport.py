@@ -0,0 +1,125 @@
+import io
+import asyncio
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import server
+import asgi_server
+from latency_control import CircuitOpen
+
+ROUTES = ["/api/answerQuestionWithAudio", "/api/answerQuestionWithAudioStream"]
+BAD_BYTES = [[300], ["a"], [-1], "abc", 12]
+BAD_HISTORY = ["{not json", '"a string"']
+
+
+def assert_bad_request(status: int, body) -> None:
+    assert status == 400
+    assert body["error"] == "Bad request"
+    assert body["message"]
+
+
+@pytest.mark.parametrize("route", ROUTES)
+@pytest.mark.parametrize("audio_bytes", BAD_BYTES)
+def test_flask_rejects_bad_legacy_audio_bytes(route, audio_bytes):
+    response = server.app.test_client().post(route, json={"audioBytes": audio_bytes})
+    assert_bad_request(response.status_code, response.get_json())
+
+
+@pytest.mark.parametrize("route", ROUTES)
+@pytest.mark.parametrize("history", BAD_HISTORY)
+def test_flask_rejects_bad_multipart_history(route, history):
+    response = server.app.test_client().post(
+        route, data={"audio": (io.BytesIO(b"RIFF"), "a.webm"), "conversationHistory": history},
+        content_type="multipart/form-data")
+    assert_bad_request(response.status_code, response.get_json())
+
+
+@pytest.mark.parametrize("route", ROUTES)
+@pytest.mark.parametrize("history", ["a string", {"role": "user"}])
+def test_flask_rejects_bad_json_history(route, history):
+    response = server.app.test_client().post(route, json={"audioBytes": [1, 2], "conversationHistory": history})
+    assert_bad_request(response.status_code, response.get_json())
+
+
+@pytest.mark.parametrize("route", ROUTES)
+def test_flask_rejects_upload_without_audio_part(route):
+    response = server.app.test_client().post(route, data={"other": (io.BytesIO(b"RIFF"), "a.webm")},
+                                             content_type="multipart/form-data")
+    assert_bad_request(response.status_code, response.get_json())
+
+
+@pytest.mark.parametrize("route", ROUTES)
+def test_asgi_rejects_bad_requests(route):
+    async def main():
+        client = asgi_server.app.test_client()
+        for audio_bytes in BAD_BYTES:
+            response = await client.post(route, json={"audioBytes": audio_bytes})
+            assert_bad_request(response.status_code, await response.get_json())
+        for history in BAD_HISTORY:
+            response = await client.post(route, form={"conversationHistory": history},
+                                         files={"audio": FileStorage(io.BytesIO(b"RIFF"), "a.webm")})
+            assert_bad_request(response.status_code, await response.get_json())
+        response = await client.post(route, form={"category": "meal"},
+                                     files={"other": FileStorage(io.BytesIO(b"RIFF"), "a.webm")})
+        assert_bad_request(response.status_code, await response.get_json())
+
+    asyncio.run(main())
+
+
+def failing_stream(error: Exception):
+    raise error
+    yield b""
+
+
+def voice_reply(chunks):
+    return chunks, ["What next?"], "question", "answer"
+
+
+@pytest.mark.parametrize("accept", ["multipart/form-data", "audio/mpeg"])
+@pytest.mark.parametrize("error, status", [(CircuitOpen("elevenlabs"), 503), (RuntimeError("tts failed"), 500)])
+def test_flask_binary_reply_reports_tts_failure_status(monkeypatch, accept, error, status):
+    monkeypatch.setattr(server, "voice_agent", lambda **kwargs: voice_reply(failing_stream(error)))
+    response = server.app.test_client().post(ROUTES[0], data=b"RIFF", content_type="audio/webm",
+                                             headers={"Accept": accept})
+    assert response.status_code == status
+
+
+@pytest.mark.parametrize("accept", ["multipart/form-data", "audio/mpeg"])
+def test_flask_binary_reply_keeps_the_first_chunk(monkeypatch, accept):
+    monkeypatch.setattr(server, "voice_agent", lambda **kwargs: voice_reply(iter([b"ID3", b"mp3"])))
+    response = server.app.test_client().post(ROUTES[0], data=b"RIFF", content_type="audio/webm",
+                                             headers={"Accept": accept})
+    assert response.status_code == 200
+    assert b"ID3mp3" in response.get_data()
+
+
+@pytest.mark.parametrize("accept", ["multipart/form-data", "audio/mpeg"])
+def test_asgi_binary_reply_reports_tts_failure_status(monkeypatch, accept):
+    async def failing_astream():
+        raise CircuitOpen("elevenlabs")
+        yield b""
+
+    async def chunks():
+        for chunk in (b"ID3", b"mp3"):
+            yield chunk
+
+    async def main():
+        client = asgi_server.app.test_client()
+        monkeypatch.setattr(asgi_server, "avoice_agent", fake_avoice_agent(failing_astream()))
+        response = await client.post(ROUTES[0], data=b"RIFF", headers={"Content-Type": "audio/webm",
+                                                                        "Accept": accept})
+        assert response.status_code == 503
+        monkeypatch.setattr(asgi_server, "avoice_agent", fake_avoice_agent(chunks()))
+        response = await client.post(ROUTES[0], data=b"RIFF", headers={"Content-Type": "audio/webm",
+                                                                        "Accept": accept})
+        assert response.status_code == 200
+        assert b"ID3mp3" in await response.get_data()
+
+    asyncio.run(main())
+
+
+def fake_avoice_agent(chunks):
+    async def avoice_agent(**kwargs):
+        return voice_reply(chunks)
+    return avoice_agent
@@ -0,0 +1,29 @@
+from langchain_core.documents import Document
+
+from context_packer import merge_chunks, pack_context
+from session_store import estimate_tokens
+
+LONG = " ".join(f"word{i}" for i in range(400))
+
+
+def chunk(text: str, source: str = "guide", **metadata) -> Document:
+    return Document(page_content=text, metadata={"source": source, **metadata})
+
+
+def test_overlapping_chunks_of_one_source_are_merged():
+    first = "Check your blood sugar before breakfast and before bed every day."
+    second = "before breakfast and before bed every day. Write the readings in a log."
+    passages = merge_chunks([chunk(first), chunk(second), chunk(second, source="other")])
+    assert [p.chunks for p in passages] == [2, 1]
+    assert passages[0].text == first + " Write the readings in a log."
+
+
+def test_context_stays_within_budget():
+    context = pack_context([chunk(LONG, source="a"), chunk(LONG, source="b")], budget=120)
+    assert 0 < estimate_tokens(context) <= 120
+
+
+def test_pinned_chunk_comes_first():
+    context = pack_context([chunk("Retrieved prose about meals."),
+                            chunk("Nutrition facts: apples", source="nutrition", pinned=True)], budget=200)
+    assert context.startswith("Nutrition facts")
@@ -0,0 +1,26 @@
+import metrics
+from embedding_batcher import EmbeddingBatcher
+
+
+class FlakyEmbeddings:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError("rate limited")
+        return [[float(len(text))] for text in texts]
+
+
+def test_retried_batch_is_counted_once():
+    before = metrics.EMBEDDED_TEXTS.snapshot().get(("documents",), 0)
+    embeddings = FlakyEmbeddings(failures=2)
+    batcher = EmbeddingBatcher(embeddings, batch_size=8, max_retries=3, backoff_seconds=0.001)
+    futures = batcher.submit(["a", "bb"])
+    batcher.close()
+    assert [future.result() for future in futures] == [[1.0], [2.0]]
+    assert embeddings.calls == 3
+    assert batcher.retries == 2
+    assert metrics.EMBEDDED_TEXTS.snapshot()[("documents",)] - before == 2
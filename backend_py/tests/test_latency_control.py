@@ -0,0 +1,109 @@
+import time
+import asyncio
+
+import pytest
+
+from latency_control import CircuitBreaker, CircuitOpen, abounded_call, aguarded_stream, guarded_stream
+
+COOLDOWN = 0.05
+
+
+def half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failures=1, cooldown=COOLDOWN)
+    breaker.failure()
+    time.sleep(COOLDOWN * 1.5)
+    return breaker
+
+
+def test_probe_refuses_other_calls_until_it_ends():
+    breaker = half_open_breaker()
+    assert breaker.check() is True
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    breaker.success()
+    assert breaker.check() is False
+
+
+def test_cancelled_probe_admits_a_new_probe():
+    breaker = half_open_breaker()
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def main():
+        task = asyncio.ensure_future(abounded_call(slow, timeout=5, breaker=breaker, name="probe"))
+        await asyncio.sleep(0.01)
+        with pytest.raises(CircuitOpen):
+            breaker.check()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert breaker.stats()["state"] == "half_open"
+    assert breaker.stats()["inflight"] == 0
+    assert breaker.check() is True
+
+
+def test_closed_probe_stream_admits_a_new_probe():
+    breaker = half_open_breaker()
+    stream = guarded_stream(lambda: iter([b"a", b"b", b"c"]), breaker)
+    assert next(stream) == b"a"
+    stream.close()
+    assert breaker.check() is True
+
+
+def test_closed_async_probe_stream_admits_a_new_probe():
+    breaker = half_open_breaker()
+
+    async def chunks():
+        for chunk in (b"a", b"b", b"c"):
+            yield chunk
+
+    async def main():
+        stream = aguarded_stream(chunks, breaker)
+        assert await stream.__anext__() == b"a"
+        await stream.aclose()
+
+    asyncio.run(main())
+    assert breaker.check() is True
+
+
+def test_cancelled_call_while_closed_keeps_the_circuit_closed():
+    breaker = CircuitBreaker("test", failures=1, cooldown=COOLDOWN)
+
+    async def main():
+        task = asyncio.ensure_future(abounded_call(lambda: asyncio.sleep(10), timeout=5, breaker=breaker))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert breaker.stats()["failures"] == 0
+    assert breaker.check() is False
+
+
+def test_open_circuit_never_opens_the_stream():
+    breaker = CircuitBreaker("test", failures=1, cooldown=60)
+    breaker.failure()
+    opened = []
+
+    def open_stream():
+        opened.append(True)
+        return iter([b"a"])
+
+    with pytest.raises(CircuitOpen):
+        next(guarded_stream(open_stream, breaker))
+    assert opened == []
+
+
+def test_failure_to_open_the_stream_counts_against_the_breaker():
+    breaker = CircuitBreaker("test", failures=1, cooldown=60)
+
+    def open_stream():
+        raise ConnectionError("refused")
+
+    with pytest.raises(ConnectionError):
+        next(guarded_stream(open_stream, breaker))
+    assert breaker.is_open
@@ -0,0 +1,43 @@
+from langchain_core.documents import Document
+
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+from fakes import FakeStore
+
+STORES = {
+    "medication": FakeStore(["Metformin tablets are taken with meals to limit stomach upset.",
+                             "Insulin doses are adjusted to the carbohydrate in each meal.",
+                             "Store insulin pens in the fridge until first use."], source="medication"),
+    "wellness": FakeStore(["Stress and poor sleep can raise blood sugar.",
+                           "Check your feet every day for cuts and blisters."], source="wellness"),
+}
+
+
+def doc(key: str) -> Document:
+    return Document(page_content=f"text of {key}", metadata={"chunk_id": key})
+
+
+def test_tokenize_drops_stopwords_and_plural_s():
+    assert tokenize("How should I take my Metformin tablets?") == ["take", "metformin", "tablet"]
+
+
+def test_search_ranks_the_matching_chunk_first():
+    index = LexicalIndex()
+    index.fit(STORES)
+    results = index.search("medication", "When do I take metformin tablets?", k=2)
+    assert results[0].page_content.startswith("Metformin")
+    assert index.search("meal", "metformin") == []
+
+
+def test_classify_votes_for_the_category_and_abstains_without_matches():
+    index = LexicalIndex()
+    index.fit(STORES)
+    assert index.classify("Where should I store my insulin pens?")[0] == "medication"
+    assert index.classify("foot blisters and cuts")[0] == "wellness"
+    assert index.classify("quantum chromodynamics") == (None, 0.0)
+
+
+def test_rrf_rewards_chunks_ranked_by_both_lists_and_dedupes():
+    fused = reciprocal_rank_fusion([[doc("a"), doc("b"), doc("c")], [doc("c"), doc("d"), doc("b")]], k=3)
+    keys = [d.metadata["chunk_id"] for d in fused]
+    assert keys == ["c", "b", "a"]
+    assert len(reciprocal_rank_fusion([[doc("a")], [doc("a")]], k=5)) == 1
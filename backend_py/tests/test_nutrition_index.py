@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from nutrition_index import NutritionTable
+
+NUTRITION_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "benchmark_data", "nutrition.csv")
+
+
+@pytest.fixture(scope="module")
+def table() -> NutritionTable:
+    return NutritionTable.from_csv(NUTRITION_CSV)
+
+
+def names(table: NutritionTable, question: str):
+    return [table.names[row] for row in table.match_words(question)]
+
+
+@pytest.mark.parametrize("question", [
+    "How long should a dry cough last?",
+    "Is it fine to skip the skin care routine?",
+    "Should I check my sugar when I feel regular?",
+])
+def test_near_miss_questions_match_no_food(table, question):
+    assert names(table, question) == []
+    assert table.search(question).size == 0
+
+
+def test_food_and_descriptor_words_narrow_the_match(table):
+    assert names(table, "How many carbs are in brown rice?") == ["Rice, brown, long-grain, cooked"]
+
+
+def test_food_named_after_its_group(table):
+    assert names(table, "Is salmon good for me?") == ["Fish, salmon, Atlantic, farmed, cooked, dry heat"]
+
+
+def test_foods_not_sharing_a_row_are_each_matched(table):
+    matched = names(table, "Is rice or bread better at dinner?")
+    assert {name.split(",")[0] for name in matched} == {"Rice", "Bread"}
+    assert len(matched) == 4
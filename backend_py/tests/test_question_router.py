@@ -0,0 +1,34 @@
+from question_router import QuestionRouter
+from fakes import FakeStore
+
+
+class AxisEmbeddings:
+    def embed_query(self, text):
+        return [1.0, 0.1] if "insulin" in text else [0.1, 1.0]
+
+
+def fitted_router(**kwargs) -> QuestionRouter:
+    router = QuestionRouter(AxisEmbeddings(), k=3, **kwargs)
+    router.fit({
+        "medication": FakeStore(["a", "b"], embeddings=[[1.0, 0.0], [0.9, 0.1]]),
+        "wellness": FakeStore(["c", "d"], embeddings=[[0.0, 1.0], [0.1, 0.9]]),
+        "meal": FakeStore([], embeddings=[]),
+    })
+    return router
+
+
+def test_unfitted_router_abstains():
+    assert QuestionRouter(AxisEmbeddings()).classify("anything") == (None, 0.0)
+
+
+def test_nearest_chunks_vote_for_the_category():
+    router = fitted_router(min_confidence=0.5)
+    category, confidence = router.classify("how much insulin")
+    assert category == "medication" and 0.5 <= confidence < 1.0
+    assert router.classify("sleep")[0] == "wellness"
+
+
+def test_low_confidence_vote_abstains():
+    router = fitted_router(min_confidence=0.99)
+    category, confidence = router.classify("how much insulin")
+    assert category is None and confidence > 0
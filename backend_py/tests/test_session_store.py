@@ -0,0 +1,51 @@
+import time
+
+from session_store import SessionStore
+
+
+def wait_for(condition, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def summarize(summary, messages):
+    asked = [m["content"] for m in messages if m["role"] == "user"]
+    return " ".join(filter(None, [summary, *(f"Asked: {q}" for q in asked)]))
+
+
+def test_window_overflow_is_folded_into_the_summary():
+    store = SessionStore(summarize=summarize, store_dir="", window=4)
+    for i in range(4):
+        store.append("s1", f"question {i}", f"answer {i}")
+    wait_for(lambda: store.stats()["compacting"] == 0 and store.stats()["compactions"] >= 1)
+    context = store.context("s1")
+    assert "Asked: question 0" in context and "Asked: question 1" in context
+    assert "question 3" in context and "answer 0" not in context
+
+
+def test_failed_summary_keeps_the_questions():
+    def broken(summary, messages):
+        raise RuntimeError("model down")
+
+    store = SessionStore(summarize=broken, store_dir="", window=2)
+    store.append("s1", "first question", "first answer")
+    store.append("s1", "second question", "second answer")
+    wait_for(lambda: store.stats()["compactionFailures"] == 1)
+    assert "Earlier questions: first question" in store.context("s1")
+
+
+def test_sessions_survive_a_restart_on_disk(tmp_path):
+    SessionStore(store_dir=str(tmp_path)).append("s1", "what is a1c", "a three-month average")
+    store = SessionStore(store_dir=str(tmp_path))
+    assert "what is a1c" in store.context("s1")
+    assert store.context("unknown") == ""
+
+
+def test_expired_sessions_are_dropped():
+    store = SessionStore(store_dir="", ttl_seconds=0.05)
+    store.append("s1", "q", "a")
+    time.sleep(0.1)
+    assert store.context("s1") == ""
+    assert store.stats()["expired"] == 1
@@ -0,0 +1,49 @@
+import diabetes_rag_agent
+import voice_chat_api
+from tts_cache import AudioCache, warm_tts_cache
+from voice_chat_api import split_sentences
+
+ANSWER = ("Check your blood sugar before meals. Keep a log of the readings for your doctor. "
+          "Please consult your healthcare provider.")
+
+
+class FakeAgent:
+    def preload_documents(self):
+        pass
+
+    def answer_question(self, question):
+        return {"answer": ANSWER, "followupQuestions": ["How often should I check?"]}
+
+
+def test_warm_covers_the_streamed_sentences(monkeypatch):
+    synthesized = []
+    monkeypatch.setattr(diabetes_rag_agent, "rag_agent", FakeAgent())
+    monkeypatch.setattr(voice_chat_api, "text_to_speech", synthesized.append)
+    warmed = warm_tts_cache(["How do I manage my sugar?"])
+    sentences = split_sentences(ANSWER, final=True)[0]
+    assert len(sentences) == 3
+    assert synthesized == [ANSWER, *sentences, "How often should I check?"]
+    assert warmed == len(synthesized)
+
+
+def test_write_through_commits_only_complete_streams(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=1024)
+    key = AudioCache.key("hello", "voice", "model", "mp3")
+    partial = cache.write_through(key, iter([b"ab", b"cd"]))
+    next(partial)
+    partial.close()
+    assert cache.open(key) is None
+    assert b"".join(cache.write_through(key, iter([b"ab", b"cd"]))) == b"abcd"
+    assert b"".join(cache.open(key)) == b"abcd"
+    assert AudioCache(str(tmp_path)).stats()["files"] == 1
+
+
+def test_least_recently_used_audio_is_evicted(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=10)
+    keys = [AudioCache.key(text, "voice", "model", "mp3") for text in ("a", "b", "c")]
+    for key in keys[:2]:
+        list(cache.write_through(key, iter([b"12345"])))
+    b"".join(cache.open(keys[0]))
+    list(cache.write_through(keys[2], iter([b"12345"])))
+    assert cache.open(keys[1]) is None
+    assert cache.open(keys[0]) is not None and cache.stats()["evictions"] == 1
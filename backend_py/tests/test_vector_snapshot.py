@@ -0,0 +1,68 @@
+import os
+import threading
+
+import numpy as np
+
+import vector_snapshot
+from vector_snapshot import HEADER_NAME, SnapshotVectorStore, write_snapshot
+
+
+class UnitEmbeddings:
+    def embed_query(self, text):
+        return [1.0, 0.0]
+
+
+def write(directory: str, tag: str):
+    ids = [f"{tag}-0", f"{tag}-1"]
+    return write_snapshot(directory, ids, [[1.0, 0.0], [0.0, 2.0]], [f"{tag} first", f"{tag} second"],
+                          [{"source": tag}, {"source": tag}], fingerprint=f"{tag:0<16}", embedding_model="unit")
+
+
+def test_written_snapshot_opens_and_searches(tmp_path):
+    header = write(str(tmp_path), "a")
+    store = SnapshotVectorStore.open(str(tmp_path), UnitEmbeddings())
+    assert store is not None and store.header["vectors"] == header["vectors"]
+    assert np.allclose(np.linalg.norm(store.vectors, axis=1), 1.0)
+    assert store.similarity_search("anything", k=1)[0].page_content == "a first"
+
+
+def test_rewrite_removes_the_superseded_version(tmp_path):
+    first = write(str(tmp_path), "a")
+    second = write(str(tmp_path), "b")
+    assert sorted(os.listdir(tmp_path)) == sorted([HEADER_NAME, second["vectors"], second["chunks"],
+                                                   ".snapshot.lock"])
+    assert first["vectors"] not in os.listdir(tmp_path)
+
+
+def test_concurrent_writers_leave_a_header_pointing_at_files_that_exist(tmp_path, monkeypatch):
+    # Hold every writer between writing its files and replacing the header, so that
+    # without exclusion each one's cleanup would run against the others' fresh files
+    replace_with = vector_snapshot._replace_with
+    barrier = threading.Barrier(4, timeout=0.5)
+
+    def slow_replace_with(path, write_file, binary=False):
+        if path.endswith(HEADER_NAME):
+            try:
+                barrier.wait()
+            except threading.BrokenBarrierError:
+                pass
+        replace_with(path, write_file, binary)
+
+    monkeypatch.setattr(vector_snapshot, "_replace_with", slow_replace_with)
+    errors = []
+
+    def run(tag):
+        try:
+            write(str(tmp_path), tag)
+        except Exception as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=run, args=(tag,)) for tag in "abcd"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    store = SnapshotVectorStore.open(str(tmp_path), UnitEmbeddings())
+    assert store is not None and len(store.ids) == 2
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("vectors-")]) == 1
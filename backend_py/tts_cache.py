@@ -0,0 +1,230 @@
+import os
+import sys
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, AsyncIterable, AsyncIterator, Iterable, Iterator
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+TTS_CACHE_DIR = os.getenv(
+    "TTS_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_cache"),
+)
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class AudioCache:
+    """
+    On-disk, content-addressed cache of synthesized speech.
+
+    Files are named by the sha256 of everything that determines the audio
+    (text, voice, model, output format, language) and sharded by the first
+    two hex digits.  Total size is bounded by ``max_bytes`` with LRU
+    eviction; recency survives restarts through the files' mtimes.
+    """
+
+    def __init__(self, cache_dir: str = TTS_CACHE_DIR, max_bytes: int = TTS_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load_index()
+
+    @staticmethod
+    def key(text: str, voice_id: str, model_id: str, output_format: str,
+            language_code: Optional[str] = None) -> str:
+        material = "\x00".join([text, voice_id, model_id, output_format, language_code or ""])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _load_index(self) -> None:
+        if not os.path.isdir(self.cache_dir):
+            return
+        found = []
+        for shard in os.listdir(self.cache_dir):
+            shard_dir = os.path.join(self.cache_dir, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if ".tmp" in name:
+                    continue
+                stat = os.stat(os.path.join(shard_dir, name))
+                found.append((stat.st_mtime, name, stat.st_size))
+        for _, key, size in sorted(found):
+            self._index[key] = size
+            self.total_bytes += size
+        logger.info("TTS cache: %d files, %d bytes in %s", len(self._index), self.total_bytes, self.cache_dir)
+
+    def open(self, key: str) -> Optional[Iterator[bytes]]:
+        """
+        Return an iterator streaming the cached audio, or None on a miss.
+        """
+        handle = self._open_handle(key)
+        return _read_file(handle) if handle is not None else None
+
+    def aopen(self, key: str) -> Optional[AsyncIterator[bytes]]:
+        """
+        Async ``open``: file reads happen on a worker thread.
+        """
+        handle = self._open_handle(key)
+        return _aread_file(handle) if handle is not None else None
+
+    def _open_handle(self, key: str):
+        path = self._path(key)
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+        try:
+            os.utime(path)
+            return open(path, "rb")
+        except OSError:
+            with self._lock:
+                self.total_bytes -= self._index.pop(key, 0)
+            return None
+
+    def write_through(self, key: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Pass ``chunks`` through to the caller while writing them to the cache.
+        The file is only committed once the stream was consumed completely.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid4().hex}.tmp"
+        size = 0
+        completed = False
+        try:
+            with open(tmp_path, "wb") as out:
+                for chunk in chunks:
+                    out.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            if completed and size:
+                os.replace(tmp_path, path)
+                self._add(key, size)
+            else:
+                _unlink(tmp_path)
+
+    async def awrite_through(self, key: str, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        """
+        Async ``write_through`` for vendor streams consumed on the event loop.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid4().hex}.tmp"
+        size = 0
+        completed = False
+        try:
+            with open(tmp_path, "wb") as out:
+                async for chunk in chunks:
+                    out.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            if completed and size:
+                os.replace(tmp_path, path)
+                self._add(key, size)
+            else:
+                _unlink(tmp_path)
+
+    def _add(self, key: str, size: int) -> None:
+        evicted = []
+        with self._lock:
+            self.total_bytes -= self._index.pop(key, 0)
+            self._index[key] = size
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self._index) > 1:
+                old_key, old_size = self._index.popitem(last=False)
+                self.total_bytes -= old_size
+                self.evictions += 1
+                evicted.append(old_key)
+        for old_key in evicted:
+            _unlink(self._path(old_key))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "files": len(self._index),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def _read_file(handle) -> Iterator[bytes]:
+    with handle:
+        while True:
+            chunk = handle.read(READ_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def _aread_file(handle) -> AsyncIterator[bytes]:
+    with handle:
+        while True:
+            chunk = await asyncio.to_thread(handle.read, READ_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def warm_tts_cache(questions: Iterable[str], include_followups: bool = True) -> int:
+    """
+    Pre-synthesize the spoken answers (and followups) for frequently asked
+    questions, exactly as the voice endpoints would phrase them: whole, and
+    sentence by sentence as the streaming endpoint requests them.  Returns
+    the number of texts synthesized or confirmed cached.
+    """
+    from voice_chat_api import SHORT_ANSWER_SUFFIX, spoken_texts, text_to_speech
+    from diabetes_rag_agent import rag_agent
+
+    # Answering no longer loads the knowledge base on demand; load all of it first
+    rag_agent.preload_documents()
+    warmed = 0
+    for question in questions:
+        question = question.strip()
+        if not question:
+            continue
+        result = rag_agent.answer_question(question=f"{question}{SHORT_ANSWER_SUFFIX}")
+        texts = spoken_texts(result["answer"]) if result["answer"] else []
+        if include_followups:
+            texts.extend(result["followupQuestions"])
+        for text in texts:
+            if text:
+                text_to_speech(text)
+                warmed += 1
+        logger.info("Warmed TTS cache for: %s", question)
+    return warmed
+
+
+if __name__ == "__main__":
+    # Usage: python tts_cache.py questions.txt  (one question per line, most frequent first)
+    logging.basicConfig(level=logging.INFO)
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        count = warm_tts_cache(f.readlines())
+    logger.info("TTS cache warm-up done: %d texts", count)
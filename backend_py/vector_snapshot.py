@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import fcntl
+import logging
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any, Tuple
+from uuid import uuid4
+
+import numpy as np
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+HEADER_NAME = "snapshot.json"
+# Held by a writer for its whole export, so one writer's cleanup never sees another's files
+LOCK_NAME = ".snapshot.lock"
+
+
+class SnapshotVectorStore:
+    """
+    Read-only vector store over a snapshot of one category's chunks.
+
+    The chunk embeddings are L2-normalized float32 rows of one ``.npy``
+    file, memory-mapped read-only, so opening a snapshot costs no parsing
+    and every worker process on the host shares the same page-cache copy.
+    Search is a single matrix-vector product plus ``argpartition``.  Only
+    the subset of the Chroma API the agent uses is provided.
+    """
+
+    def __init__(self, embeddings, vectors: np.ndarray, ids: List[str], documents: List[str],
+                 metadatas: List[Dict[str, Any]], header: Optional[Dict[str, Any]] = None):
+        self.embeddings = embeddings
+        self.vectors = vectors
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.header = header or {}
+
+    @classmethod
+    def empty(cls, embeddings) -> "SnapshotVectorStore":
+        return cls(embeddings, np.zeros((0, 0), dtype=np.float32), [], [], [])
+
+    @classmethod
+    def open(cls, directory: str, embeddings) -> Optional["SnapshotVectorStore"]:
+        """
+        Map the snapshot in ``directory``; None if there is none or it is
+        unreadable.
+        """
+        try:
+            with open(os.path.join(directory, HEADER_NAME), "r", encoding="utf-8") as f:
+                header = json.load(f)
+            if header.get("format") != SNAPSHOT_FORMAT:
+                logger.info("Ignoring snapshot in %s with format %s", directory, header.get("format"))
+                return None
+            with open(os.path.join(directory, header["chunks"]), "r", encoding="utf-8") as f:
+                chunks = json.load(f)
+            vectors = np.load(os.path.join(directory, header["vectors"]), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as err:
+            logger.warning("Unreadable vector snapshot in %s: %s", directory, err)
+            return None
+        if vectors.shape[0] != len(chunks["ids"]):
+            logger.warning("Vector snapshot in %s has %d vectors for %d chunks, ignoring",
+                           directory, vectors.shape[0], len(chunks["ids"]))
+            return None
+        return cls(embeddings, vectors, chunks["ids"], chunks["documents"], chunks["metadatas"], header)
+
+    # --------------------------------------------------------------- Chroma API
+    def get(self, include: Optional[List[str]] = None) -> Dict[str, Any]:
+        include = ["documents", "metadatas"] if include is None else include
+        result: Dict[str, Any] = {"ids": list(self.ids)}
+        if "embeddings" in include:
+            result["embeddings"] = self.vectors
+        if "documents" in include:
+            result["documents"] = list(self.documents)
+        if "metadatas" in include:
+            result["metadatas"] = list(self.metadatas)
+        return result
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> List[Document]:
+        if not self.ids:
+            return []
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        """
+        The ``k`` chunks with the highest cosine similarity, best first.
+        """
+        if not self.ids or k <= 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm:
+            query = query / norm
+        scores = self.vectors @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self._document(int(row)), float(scores[row])) for row in top]
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs) -> List[Document]:
+        if not self.ids:
+            return []
+        return self.similarity_search_by_vector(await self.embeddings.aembed_query(query), k)
+
+    async def asimilarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs) -> List[Document]:
+        return self.similarity_search_by_vector(embedding, k)
+
+    def _document(self, row: int) -> Document:
+        return Document(page_content=self.documents[row], metadata=dict(self.metadatas[row] or {}))
+
+
+def write_snapshot(directory: str, ids: List[str], vectors, documents: List[str],
+                   metadatas: List[Dict[str, Any]], fingerprint: str, embedding_model: str) -> Dict[str, Any]:
+    """
+    Write a new snapshot version into ``directory`` and point the header at
+    it.  The header is replaced last, so readers see either the old or the
+    new snapshot; superseded files are removed (processes that still map
+    them keep their copy).  Concurrent writers, in this process or others,
+    take turns on the directory's lock file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with _exclusive(directory):
+        return _write_snapshot(directory, ids, vectors, documents, metadatas, fingerprint, embedding_model)
+
+
+@contextmanager
+def _exclusive(directory: str):
+    with open(os.path.join(directory, LOCK_NAME), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write_snapshot(directory: str, ids: List[str], vectors, documents: List[str],
+                    metadatas: List[Dict[str, Any]], fingerprint: str, embedding_model: str) -> Dict[str, Any]:
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix = np.ascontiguousarray(matrix / norms)
+
+    version = f"{fingerprint[:16]}-{uuid4().hex[:8]}"
+    vectors_name, chunks_name = f"vectors-{version}.npy", f"chunks-{version}.json"
+    _replace_with(os.path.join(directory, vectors_name), lambda f: np.save(f, matrix), binary=True)
+    _replace_with(os.path.join(directory, chunks_name),
+                  lambda f: json.dump({"ids": ids, "documents": documents, "metadatas": metadatas}, f))
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "fingerprint": fingerprint,
+        "embedding_model": embedding_model,
+        "count": len(ids),
+        "dim": int(matrix.shape[1]) if len(ids) else 0,
+        "created_at": time.time(),
+        "vectors": vectors_name,
+        "chunks": chunks_name,
+    }
+    _replace_with(os.path.join(directory, HEADER_NAME), lambda f: json.dump(header, f, indent=2))
+    for name in os.listdir(directory):
+        # Anything but this version is superseded: no other writer holds the lock
+        if name.startswith(("vectors-", "chunks-")) and name not in (vectors_name, chunks_name):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    return header
+
+
+def _replace_with(path: str, write, binary: bool = False) -> None:
+    tmp_path = f"{path}.{uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "wb" if binary else "w", **({} if binary else {"encoding": "utf-8"})) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -1,83 +1,441 @@
 import os
 from dotenv import load_dotenv
 from io import BytesIO
-import requests
-from elevenlabs.client import ElevenLabs
-from elevenlabs import play
-import uuid
+from elevenlabs.client import AsyncElevenLabs, ElevenLabs
 from diabetes_rag_agent import rag_agent
-from typing import Optional, List, Dict, Any, Tuple
+from context_packer import VOICE_CONTEXT_TOKENS
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterable, AsyncIterator, Iterable, Iterator
 import re
+import time
+import queue
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from tts_cache import AudioCache
+from latency_control import ELEVENLABS_TIMEOUT_SECONDS, UPSTREAMS, aguarded_stream, guarded, guarded_stream
+import metrics
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
-client = ElevenLabs(
-  api_key=os.getenv("ELEVENLABS_API_KEY"),
-)
+# Built on first use (see _client/_aclient) so importing the servers stays cheap
+client: Optional[ElevenLabs] = None
+# Non-blocking client for the async serving mode
+aclient: Optional[AsyncElevenLabs] = None
+# Concurrent ElevenLabs calls from the async serving mode
+ELEVENLABS_CONCURRENCY = int(os.getenv("ELEVENLABS_CONCURRENCY", 16))
+elevenlabs_semaphore = asyncio.Semaphore(ELEVENLABS_CONCURRENCY)
+# Repeated failures or timeouts (ELEVENLABS_TIMEOUT_SECONDS) make calls fail fast for a while
+elevenlabs_breaker = UPSTREAMS["elevenlabs"]
+
+TTS_VOICE_ID = "EXAVITQu4vr4xnSDxMaL"
+TTS_MODEL_ID = "eleven_turbo_v2_5"    # newer model that supports language_code
+TTS_OUTPUT_FORMAT = "mp3_44100_128"  # ensure MP3 format
+TTS_LANGUAGE_CODE = "en"              # force English pronunciation
+audio_cache = AudioCache()
+
+# Concurrent sentence syntheses per streamed voice answer
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", 3))
+# Sentences shorter than this are merged with the next one before synthesis
+MIN_TTS_SENTENCE_CHARS = int(os.getenv("MIN_TTS_SENTENCE_CHARS", 20))
+SHORT_ANSWER_SUFFIX = ". Please provide a short answer, less than 50 words."
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def _client() -> ElevenLabs:
+    global client
+    if client is None:
+        client = ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"), timeout=ELEVENLABS_TIMEOUT_SECONDS)
+    return client
+
+def _aclient() -> AsyncElevenLabs:
+    global aclient
+    if aclient is None:
+        aclient = AsyncElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"), timeout=ELEVENLABS_TIMEOUT_SECONDS)
+    return aclient
 
 def speech_to_text(audio_bytes: bytes) -> str:
     audio_data = BytesIO(audio_bytes)
-    transcription = client.speech_to_text.convert(
-        file=audio_data,
-        model_id="scribe_v1",  # Model to use, for now only "scribe_v1" is supported
-        tag_audio_events=False,  # Disable tagging non-speech events
-        language_code="eng",  # Language of the audio file. If set to None, the model will detect the language automatically.
-        diarize=True,  # Whether to annotate who is speaking
-    )
+    metrics.VENDOR_BYTES.inc("elevenlabs", "speech_to_text", "out", amount=len(audio_bytes))
+    with guarded(elevenlabs_breaker), metrics.vendor_call("elevenlabs", "speech_to_text"):
+        transcription = _client().speech_to_text.convert(
+            file=audio_data,
+            model_id="scribe_v1",  # Model to use, for now only "scribe_v1" is supported
+            tag_audio_events=False,  # Disable tagging non-speech events
+            language_code="eng",  # Language of the audio file. If set to None, the model will detect the language automatically.
+            diarize=True,  # Whether to annotate who is speaking
+        )
     return transcription
 
+async def aspeech_to_text(audio_bytes: bytes) -> str:
+    metrics.VENDOR_BYTES.inc("elevenlabs", "speech_to_text", "out", amount=len(audio_bytes))
+    async with elevenlabs_semaphore:
+        with guarded(elevenlabs_breaker), metrics.vendor_call("elevenlabs", "speech_to_text"):
+            return await _aclient().speech_to_text.convert(
+                file=BytesIO(audio_bytes),
+                model_id="scribe_v1",
+                tag_audio_events=False,
+                language_code="eng",
+                diarize=True,
+            )
+
+def text_to_speech_stream(text: str) -> Iterator[bytes]:
+    """
+    Stream synthesized speech, straight from the audio cache on a hit;
+    on a miss the ElevenLabs stream is written through to the cache.
+    """
+    key = audio_cache.key(text, TTS_VOICE_ID, TTS_MODEL_ID, TTS_OUTPUT_FORMAT, TTS_LANGUAGE_CODE)
+    cached = audio_cache.open(key)
+    if cached is not None:
+        return cached
+    def open_stream() -> Iterable[bytes]:
+        audio_stream = _client().text_to_speech.convert(
+            text=text,
+            voice_id=TTS_VOICE_ID,
+            model_id=TTS_MODEL_ID,
+            output_format=TTS_OUTPUT_FORMAT,
+            language_code=TTS_LANGUAGE_CODE,
+        )
+        return [bytes(audio_stream)] if isinstance(audio_stream, (bytes, bytearray)) else audio_stream
+
+    # The breaker is consulted before convert() is called
+    audio_stream = guarded_stream(open_stream, elevenlabs_breaker)
+    return audio_cache.write_through(key, metrics.timed_stream(audio_stream, "elevenlabs", "text_to_speech"))
+
+async def atext_to_speech_stream(text: str) -> AsyncIterator[bytes]:
+    """
+    Async ``text_to_speech_stream``; holds an ElevenLabs slot while streaming a miss.
+    """
+    key = audio_cache.key(text, TTS_VOICE_ID, TTS_MODEL_ID, TTS_OUTPUT_FORMAT, TTS_LANGUAGE_CODE)
+    cached = audio_cache.aopen(key)
+    if cached is not None:
+        async for chunk in cached:
+            yield chunk
+        return
+    def open_stream() -> AsyncIterable[bytes]:
+        return _aclient().text_to_speech.convert(
+            text=text,
+            voice_id=TTS_VOICE_ID,
+            model_id=TTS_MODEL_ID,
+            output_format=TTS_OUTPUT_FORMAT,
+            language_code=TTS_LANGUAGE_CODE,
+        )
+
+    async with elevenlabs_semaphore:
+        async for chunk in audio_cache.awrite_through(
+                key, metrics.atimed_stream(aguarded_stream(open_stream, elevenlabs_breaker),
+                                           "elevenlabs", "text_to_speech")):
+            yield chunk
+
+async def atext_to_speech(text: str) -> bytes:
+    buffer = BytesIO()
+    with metrics.span("text_to_speech"):
+        async for chunk in atext_to_speech_stream(text):
+            buffer.write(chunk)
+    return buffer.getvalue()
+
 def text_to_speech(text: str) -> bytes:
-    audio_stream = client.text_to_speech.convert(
-        text=text,
-        voice_id="EXAVITQu4vr4xnSDxMaL",
-        model_id="eleven_turbo_v2_5",    # newer model that supports language_code
-        output_format="mp3_44100_128",  # ensure MP3 format
-        language_code="en",              # force English pronunciation
-    )
-    # Collect chunks into a single bytes object if the response is a generator
-    if not isinstance(audio_stream, (bytes, bytearray)):
-        buffer = BytesIO()
-        for chunk in audio_stream:
+    # Collect chunks into a single bytes object
+    buffer = BytesIO()
+    with metrics.span("text_to_speech"):
+        for chunk in text_to_speech_stream(text):
             buffer.write(chunk)
-        return buffer.getvalue()
-    return audio_stream
+    return buffer.getvalue()
 
-def voice_agent(audio_bytes: bytes,
-                category: Optional[str] = None,
-                conversation_history: Optional[List[Dict[str, str]]] = None
-) -> Tuple[bytes, List[str], str, str]:
-    
+def _clean_transcript(transcription_data) -> str:
+    # Extract text string (handle objects with .text attribute)
+    raw_text = transcription_data.text if hasattr(transcription_data, 'text') else transcription_data
+    # Remove any parenthetical event tags e.g. "(laughter)", "(techno music)"
+    return re.sub(r"\([^)]*\)", "", raw_text).strip()
+
+def transcribe(audio_bytes) -> str:
+    """
+    Speech to text, with parenthetical event tags such as "(laughter)" removed.
+    """
     # Ensure audio_bytes is actual bytes (convert from list if needed)
     if isinstance(audio_bytes, list):
         audio_bytes = bytes(audio_bytes)
+    with metrics.span("speech_to_text"):
+        return _clean_transcript(speech_to_text(audio_bytes))
+
+async def atranscribe(audio_bytes) -> str:
+    if isinstance(audio_bytes, list):
+        audio_bytes = bytes(audio_bytes)
+    with metrics.span("speech_to_text"):
+        return _clean_transcript(await aspeech_to_text(audio_bytes))
+
+def split_sentences(text: str, final: bool = False) -> Tuple[List[str], str]:
+    """
+    Split off the complete sentences of a growing answer.
+
+    Returns ``(sentences, rest)``; ``rest`` is the unfinished tail, or empty
+    when ``final`` is set and everything left is flushed as a last sentence.
+    """
+    sentences, current = [], ""
+    parts = _SENTENCE_END.split(text)
+    for part in parts[:-1]:
+        current = f"{current} {part}".strip()
+        if len(current) >= MIN_TTS_SENTENCE_CHARS:
+            sentences.append(current)
+            current = ""
+    rest = f"{current} {parts[-1]}" if current else parts[-1]
+    if final and rest.strip():
+        sentences.append(rest.strip())
+        rest = ""
+    return sentences, rest
+
+def spoken_texts(answer: str) -> List[str]:
+    """
+    Every text the voice endpoints synthesize for an answer: the whole of
+    it, then each sentence the streaming endpoint speaks separately.
+    """
+    texts = [answer]
+    for sentence in split_sentences(answer, final=True)[0]:
+        if sentence not in texts:
+            texts.append(sentence)
+    return texts
+
+def voice_agent(audio_bytes: bytes,
+                category: Optional[str] = None,
+                conversation_history: Optional[List[Dict[str, str]]] = None,
+                session_id: Optional[str] = None,
+                stream_audio: bool = False
+) -> Tuple[Any, List[str], str, str]:
+    """
+    Transcribe, answer and synthesize one spoken question.  With
+    ``stream_audio`` the audio is returned as an iterator of chunks
+    instead of one bytes object.
+    """
     # Convert speech to text
-    transcription_data = speech_to_text(audio_bytes)
-    # Extract text string (handle objects with .text attribute)
-    raw_text = transcription_data.text if hasattr(transcription_data, 'text') else transcription_data
-    # Remove any parenthetical event tags e.g. "(laughter)", "(techno music)"
-    clean_text = re.sub(r"\([^)]*\)", "", raw_text).strip()
-    question_text = clean_text
+    question_text = transcribe(audio_bytes)
     
     # Append a short answer request
-    question = f"{question_text}. Please provide a short answer, less than 50 words."
-    print(f"Transcription: {question}")
+    question = f"{question_text}{SHORT_ANSWER_SUFFIX}"
+    logger.debug(f"Transcription: {question}")
     
     # Do text based RAG
     executor_state = rag_agent.answer_question(
         question=question,
         category=category,
-        conversation_history=conversation_history
+        conversation_history=conversation_history,
+        session_id=session_id,
+        context_tokens=VOICE_CONTEXT_TOKENS
     )
     
-    print(f"executor_state: {executor_state}")
+    logger.debug(f"executor_state: {executor_state}")
     
     answer_text: str = executor_state['answer']
     followup_questions: List[str] = executor_state['followupQuestions']
     
-    print(f"voice agent raw answer and followups: {answer_text}, {followup_questions}")
+    logger.debug(f"voice agent raw answer and followups: {answer_text}, {followup_questions}")
     
     # Generate speech from the combined text
+    if stream_audio:
+        return text_to_speech_stream(answer_text), followup_questions, question_text, answer_text
     audio_bytes = text_to_speech(answer_text)
     
     # return audio, follow-ups, and transcripts
     return audio_bytes, followup_questions, question_text, answer_text
 
+def stream_voice_agent(audio_bytes,
+                       category: Optional[str] = None,
+                       conversation_history: Optional[List[Dict[str, str]]] = None,
+                       session_id: Optional[str] = None
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Streaming counterpart of ``voice_agent``.
+
+    Yields ``transcript`` once speech to text is done, then one ``audio``
+    event per answer sentence (synthesized on a small pool while the answer
+    is still being generated, emitted in order), ``followups`` and finally
+    ``done`` with stage timings and any ``skippedStages``.  Followups are
+    generated while the last sentences are still being synthesized.
+    """
+    started = time.perf_counter()
+    question_text = transcribe(audio_bytes)
+    stt_done = time.perf_counter()
+    yield "transcript", {"question_text": question_text}
+
+    # Items are ("audio", sentence, future), ("event", name, data) or ("error", exc, None)
+    pending: "queue.Queue" = queue.Queue()
+    tts_pool = ThreadPoolExecutor(max_workers=max(1, TTS_WORKERS), thread_name_prefix="tts")
+    skipped: List[Dict[str, str]] = []
+
+    def produce():
+        buffer = ""
+        try:
+            for event, data in rag_agent.stream_answer(
+                question=f"{question_text}{SHORT_ANSWER_SUFFIX}",
+                category=category,
+                conversation_history=conversation_history,
+                session_id=session_id,
+                context_tokens=VOICE_CONTEXT_TOKENS
+            ):
+                if event == "token":
+                    buffer += data["text"]
+                    sentences, buffer = split_sentences(buffer)
+                elif event == "answer":
+                    sentences, buffer = split_sentences(buffer, final=True)
+                    pending.put(("event", "answer", {"answer_text": data["answer"]}))
+                elif event == "followups":
+                    sentences = []
+                    pending.put(("event", "followups", {"followups": data["followupQuestions"]}))
+                else:
+                    skipped.extend(data.get("skippedStages") or [])
+                    sentences = []
+                for sentence in sentences:
+                    pending.put(("audio", sentence, tts_pool.submit(text_to_speech, sentence)))
+        except Exception as err:
+            pending.put(("error", err, None))
+        finally:
+            pending.put(None)
+
+    producer = threading.Thread(target=produce, name="voice-rag", daemon=True)
+    producer.start()
+    first_audio_at = None
+    seq = 0
+    try:
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            kind, name, payload = item
+            if kind == "error":
+                raise name
+            if kind == "event":
+                yield name, payload
+                continue
+            audio = payload.result()
+            if first_audio_at is None:
+                first_audio_at = time.perf_counter()
+            yield "audio", {"seq": seq, "text": name, "audio": audio}
+            seq += 1
+    finally:
+        tts_pool.shutdown(wait=False, cancel_futures=True)
+
+    finished = time.perf_counter()
+    if first_audio_at:
+        metrics.STAGE_SECONDS.observe(first_audio_at - started, "voice_first_audio")
+    timings = {
+        "sttMs": round((stt_done - started) * 1000, 1),
+        "firstAudioMs": round((first_audio_at - started) * 1000, 1) if first_audio_at else None,
+        "totalMs": round((finished - started) * 1000, 1),
+    }
+    logger.info(f"Streamed voice answer: {seq} sentences, time to first audio {timings['firstAudioMs']} ms, "
+                f"total {timings['totalMs']} ms")
+    yield "done", {"timings": timings, **({"skippedStages": skipped} if skipped else {})}
+
+async def avoice_agent(audio_bytes: bytes,
+                       category: Optional[str] = None,
+                       conversation_history: Optional[List[Dict[str, str]]] = None,
+                       session_id: Optional[str] = None,
+                       stream_audio: bool = False
+) -> Tuple[Any, List[str], str, str]:
+    """
+    Non-blocking ``voice_agent`` for the async serving mode.
+    """
+    question_text = await atranscribe(audio_bytes)
+    result = await rag_agent.aanswer_question(
+        question=f"{question_text}{SHORT_ANSWER_SUFFIX}",
+        category=category,
+        conversation_history=conversation_history,
+        session_id=session_id,
+        context_tokens=VOICE_CONTEXT_TOKENS
+    )
+    answer_text: str = result['answer']
+    followup_questions: List[str] = result['followupQuestions']
+    if stream_audio:
+        return atext_to_speech_stream(answer_text), followup_questions, question_text, answer_text
+    return await atext_to_speech(answer_text), followup_questions, question_text, answer_text
+
+async def astream_voice_agent(audio_bytes,
+                              category: Optional[str] = None,
+                              conversation_history: Optional[List[Dict[str, str]]] = None,
+                              session_id: Optional[str] = None
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Non-blocking ``stream_voice_agent``: sentence syntheses run as tasks
+    (at most TTS_WORKERS at a time) while the answer keeps streaming.
+    """
+    started = time.perf_counter()
+    question_text = await atranscribe(audio_bytes)
+    stt_done = time.perf_counter()
+    yield "transcript", {"question_text": question_text}
+
+    pending: "asyncio.Queue" = asyncio.Queue()
+    tts_slots = asyncio.Semaphore(max(1, TTS_WORKERS))
+    tasks: List[asyncio.Task] = []
+    skipped: List[Dict[str, str]] = []
+
+    async def synthesize(sentence: str) -> bytes:
+        async with tts_slots:
+            return await atext_to_speech(sentence)
+
+    def schedule(sentences: List[str]) -> None:
+        for sentence in sentences:
+            task = asyncio.create_task(synthesize(sentence))
+            tasks.append(task)
+            pending.put_nowait(("audio", sentence, task))
+
+    async def produce():
+        buffer = ""
+        try:
+            async for event, data in rag_agent.astream_answer(
+                question=f"{question_text}{SHORT_ANSWER_SUFFIX}",
+                category=category,
+                conversation_history=conversation_history,
+                session_id=session_id,
+                context_tokens=VOICE_CONTEXT_TOKENS
+            ):
+                if event == "token":
+                    buffer += data["text"]
+                    sentences, buffer = split_sentences(buffer)
+                    schedule(sentences)
+                elif event == "answer":
+                    sentences, buffer = split_sentences(buffer, final=True)
+                    schedule(sentences)
+                    pending.put_nowait(("event", "answer", {"answer_text": data["answer"]}))
+                elif event == "followups":
+                    pending.put_nowait(("event", "followups", {"followups": data["followupQuestions"]}))
+                else:
+                    skipped.extend(data.get("skippedStages") or [])
+        except Exception as err:
+            pending.put_nowait(("error", err, None))
+        finally:
+            pending.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    first_audio_at = None
+    seq = 0
+    try:
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+            kind, name, payload = item
+            if kind == "error":
+                raise name
+            if kind == "event":
+                yield name, payload
+                continue
+            audio = await payload
+            if first_audio_at is None:
+                first_audio_at = time.perf_counter()
+            yield "audio", {"seq": seq, "text": name, "audio": audio}
+            seq += 1
+    finally:
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
+
+    finished = time.perf_counter()
+    if first_audio_at:
+        metrics.STAGE_SECONDS.observe(first_audio_at - started, "voice_first_audio")
+    timings = {
+        "sttMs": round((stt_done - started) * 1000, 1),
+        "firstAudioMs": round((first_audio_at - started) * 1000, 1) if first_audio_at else None,
+        "totalMs": round((finished - started) * 1000, 1),
+    }
+    logger.info(f"Streamed voice answer: {seq} sentences, time to first audio {timings['firstAudioMs']} ms, "
+                f"total {timings['totalMs']} ms")
+    yield "done", {"timings": timings, **({"skippedStages": skipped} if skipped else {})}
@@ -27,9 +27,11 @@ interface UseRagChatParams {
 export function useRagChat({
   initialMessages = [],
   topic,
-  sessionId = "default",
+  sessionId,
 }: UseRagChatParams = {}) {
   const [messages, setMessages] = useState<ChatMessage[]>(initialMessages);
+  // The backend keeps the conversation under this id, so the history is not resent
+  const sessionIdRef = useRef<string>(sessionId ?? crypto.randomUUID());
   const [isLoading, setIsLoading] = useState(false);
   const [followupQuestions, setFollowupQuestions] = useState<string[]>([]);
 
@@ -64,10 +66,7 @@ export function useRagChat({
         const response = await axios.post(`${backendUrl}/api/answerQuestion`, {
           question: content,
           category: topic,
-          conversationHistory: messages.map((msg) => ({
-            role: msg.role,
-            content: msg.content,
-          })),
+          sessionId: sessionIdRef.current,
         });
 
         const result = response.data;
@@ -104,11 +103,12 @@ export function useRagChat({
         setIsLoading(false);
       }
     },
-    [topic, sessionId, messages]
+    [topic]
   );
 
   // Clear all messages from the chat
   const clearMessages = useCallback(() => {
+    sessionIdRef.current = crypto.randomUUID();
     setMessages([]);
     setFollowupQuestions([]);
   }, []);
@@ -158,19 +158,28 @@ export function useRagChat({
   const handleRecordingStop = useCallback(async () => {
     const audioBlob = new Blob(audioChunksRef.current, { type: "audio/webm" });
     console.debug("Recorded audio blob size (bytes):", audioBlob.size);
-    const arrayBuffer = await audioBlob.arrayBuffer();
     try {
       const backendUrl = get_env_var("BACKEND_URL");
       console.debug("POST to audio endpoint:", `${backendUrl}/api/answerQuestionWithAudio`);
-      const response = await axios.post(`${backendUrl}/api/answerQuestionWithAudio`, {
-        audioBytes: Array.from(new Uint8Array(arrayBuffer)),
-        category: topic,
-        conversationHistory: messages.map((msg) => ({ role: msg.role, content: msg.content })),
+      // Send the recording as a binary multipart part and ask for a multipart
+      // reply (JSON metadata + MP3) instead of JSON integer arrays and base64.
+      const form = new FormData();
+      form.append("audio", audioBlob, "question.webm");
+      if (topic) form.append("category", topic);
+      form.append("sessionId", sessionIdRef.current);
+      const response = await fetch(`${backendUrl}/api/answerQuestionWithAudio`, {
+        method: "POST",
+        headers: { Accept: "multipart/form-data" },
+        body: form,
       });
-      console.debug("Audio endpoint response status/data:", response.status, response.data);
-      // Extract base64 audio, follow-up questions, and transcripts
-      const { audio: audioB64, followups, question_text, answer_text } = response.data as {
-        audio: string;
+      if (!response.ok) {
+        const errorData = await response.json().catch(() => ({}));
+        throw new Error(errorData.error || `Request failed with status ${response.status}`);
+      }
+      const parts = await response.formData();
+      console.debug("Audio endpoint response status:", response.status);
+      // Extract audio, follow-up questions, and transcripts
+      const { followups, question_text, answer_text } = JSON.parse(parts.get("metadata") as string) as {
         followups: string[];
         question_text: string;
         answer_text: string;
@@ -196,14 +205,8 @@ export function useRagChat({
       setMessages((prev) => [...prev, assistantMessage]);
       setFollowupQuestions(followups);
 
-      // Decode base64 to binary and play audio
-      const binaryString = atob(audioB64);
-      const len = binaryString.length;
-      const bytes = new Uint8Array(len);
-      for (let i = 0; i < len; i++) {
-        bytes[i] = binaryString.charCodeAt(i);
-      }
-      const audioBlobResponse = new Blob([bytes], { type: "audio/mpeg" });
+      // Play the MP3 part directly
+      const audioBlobResponse = parts.get("audio") as Blob;
       const audioUrl = URL.createObjectURL(audioBlobResponse);
       audioRef.current = new Audio(audioUrl);
       audioRef.current.addEventListener("ended", () => {
@@ -212,8 +215,8 @@ export function useRagChat({
       setIsSpeaking(true);
       await audioRef.current.play();
     } catch (error: any) {
-      console.error("Error processing voice message:", error, error.response?.data);
-      const errMsg = error.response?.data?.error || error.message || "Unknown error";
+      console.error("Error processing voice message:", error);
+      const errMsg = error.message || "Unknown error";
       alert(`Failed to process voice message: ${errMsg}`);
     } finally {
       setIsProcessingVoice(false);